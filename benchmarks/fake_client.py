@@ -0,0 +1,278 @@
+# fake_client.py — локальная имитация Telethon клиента для бенчмарков
+import asyncio
+import math
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetMessagesViewsRequest
+from telethon.tl.types import InputPeerChannel, MessageReplies, MessageViews, messages
+
+# Telegram отдает историю страницами не больше 100 сообщений
+PAGE_SIZE = 100
+
+
+class FakeReaction:
+    __slots__ = ("count",)
+
+    def __init__(self, count):
+        self.count = count
+
+
+class FakeReactions:
+    __slots__ = ("results",)
+
+    def __init__(self, results):
+        self.results = results
+
+
+class FakeReplies:
+    __slots__ = ("replies",)
+
+    def __init__(self, replies):
+        self.replies = replies
+
+
+class FakeMessage:
+    """Минимальный набор полей Message, который читает utils.message_parser"""
+
+    __slots__ = ("id", "date", "message", "views", "replies", "reactions", "forwards", "action")
+
+    def __init__(self, id, date, message, views, replies, reactions, forwards, action=None):
+        self.id = id
+        self.date = date
+        self.message = message
+        self.views = views
+        self.replies = replies
+        self.reactions = reactions
+        self.forwards = forwards
+        self.action = action
+
+
+class SyntheticChannel:
+    """
+    Синтетическая история канала
+
+    Сообщения не хранятся, а вычисляются по id (детерминированно от seed),
+    поэтому канал на миллион постов не занимает память.
+    Сообщение с id = messages — самое новое, его дата — newest_date.
+    """
+
+    def __init__(self, name, messages=10000, posts_per_day=10.0, newest_date=None,
+                 mean_views=5000, mean_reactions=40, mean_comments=5, mean_forwards=3,
+                 service_ratio=0.02, empty_ratio=0.02, seed=0):
+        self.name = name
+        self.messages = messages
+        self.interval = 86400.0 / posts_per_day
+        self.newest_date = newest_date or datetime.now(timezone.utc)
+        self.mean_views = mean_views
+        self.mean_reactions = mean_reactions
+        self.mean_comments = mean_comments
+        self.mean_forwards = mean_forwards
+        self.service_ratio = service_ratio
+        self.empty_ratio = empty_ratio
+        self.seed = seed
+        self.peer = InputPeerChannel(zlib.crc32(name.encode()), seed + 1)
+
+    def _offset_seconds(self, message_id):
+        # Равномерный шаг с джиттером меньше половины шага — даты монотонны
+        jitter = random.Random(self.seed * 1000003 + message_id).random() * self.interval * 0.5
+        return (self.messages - message_id) * self.interval - jitter
+
+    def date_of(self, message_id):
+        return self.newest_date - timedelta(seconds=self._offset_seconds(message_id))
+
+    def newest_id_before(self, date):
+        """Самый новый id с датой строго раньше date (0, если таких нет)"""
+        if date.tzinfo is None:
+            # Telethon считает даты без tzinfo датами в UTC
+            date = date.replace(tzinfo=timezone.utc)
+        seconds_back = (self.newest_date - date).total_seconds()
+        candidate = self.messages - math.floor(seconds_back / self.interval)
+        candidate = max(0, min(self.messages, candidate + 1))
+        while candidate > 0 and self.date_of(candidate) >= date:
+            candidate -= 1
+        return candidate
+
+    def message(self, message_id):
+        rng = random.Random(self.seed * 7919 + message_id)
+        date = self.date_of(message_id)
+
+        if rng.random() < self.service_ratio:
+            return FakeMessage(message_id, date, "", None, None, None, None, action=object())
+
+        empty = rng.random() < self.empty_ratio
+        views = int(rng.lognormvariate(math.log(self.mean_views), 0.8))
+        reactions = int(rng.expovariate(1 / self.mean_reactions)) if self.mean_reactions else 0
+        comments = int(rng.expovariate(1 / self.mean_comments)) if self.mean_comments else 0
+        forwards = int(rng.expovariate(1 / self.mean_forwards)) if self.mean_forwards else 0
+        if empty:
+            reactions = comments = 0
+
+        return FakeMessage(
+            message_id, date,
+            "" if empty else f"Пост {message_id} #тест https://example.com/{message_id % 97}",
+            views,
+            FakeReplies(comments),
+            FakeReactions([FakeReaction(reactions)]) if reactions else None,
+            forwards
+        )
+
+
+class FakeSession:
+    __slots__ = ("takeout_id",)
+
+    def __init__(self):
+        self.takeout_id = None
+
+
+class FakeTakeout:
+    """Аналог client.takeout(): в сессии запоминается takeout_id, запросы идут через тот же клиент"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def __aenter__(self):
+        if self.client.session.takeout_id is None:
+            self.client.takeouts += 1
+            self.client.session.takeout_id = self.client.takeouts
+        return self.client
+
+
+class FakeHistory(list):
+    """Результат get_messages: список с полем total, как TotalList у Telethon"""
+
+    total = 0
+
+
+class FakeMessagesIter:
+    """Итератор истории; как у Telethon, wait_time можно менять на ходу"""
+
+    def __init__(self, wait_time):
+        self.wait_time = wait_time
+        self._generator = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._generator.__anext__()
+
+
+class FakeTelegramClient:
+    """
+    Клиент с интерфейсом get_entity / get_messages / iter_messages / takeout поверх SyntheticChannel
+
+    latency — задержка на каждый запрос (страницу истории или get_entity),
+    flood_every — каждые N страниц поднимать FloodWaitError на flood_seconds.
+    Считает запрошенные страницы, просмотренные сообщения, запросы счетчиков и takeout-сессии.
+    """
+
+    def __init__(self, channels, latency=0.0, flood_every=0, flood_seconds=1):
+        self.channels = {channel.name.lstrip("@").lower(): channel for channel in channels}
+        self._by_peer = {channel.peer.channel_id: channel for channel in channels}
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.flood_sleep_threshold = 0
+        self.pages = 0
+        self.scanned = 0
+        self.entity_requests = 0
+        self.flood_waits = 0
+        self.takeouts = 0
+        self.counter_requests = 0
+        self.session = FakeSession()
+
+    async def _request(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_entity(self, channel_link):
+        from utils.entity_resolver import normalize_channel_link
+
+        self.entity_requests += 1
+        await self._request()
+        channel = self.channels.get(normalize_channel_link(channel_link))
+        if channel is None:
+            raise ValueError(f"No user has \"{channel_link}\" as username")
+        return channel.peer
+
+    def takeout(self, finalize=True, **kwargs):
+        return FakeTakeout(self)
+
+    async def end_takeout(self, success):
+        self.session.takeout_id = None
+        return True
+
+    async def __call__(self, request):
+        """Сырые запросы: поддерживается только messages.getMessagesViews"""
+        if not isinstance(request, GetMessagesViewsRequest):
+            raise NotImplementedError(type(request).__name__)
+        self.counter_requests += 1
+        await self._request()
+        channel = self._by_peer[request.peer.channel_id]
+        views = []
+        for message_id in request.id:
+            message = channel.message(message_id) if 0 < message_id <= channel.messages else None
+            if message is None or message.action is not None:
+                views.append(MessageViews())
+            else:
+                views.append(MessageViews(
+                    views=message.views, forwards=message.forwards,
+                    replies=MessageReplies(replies=message.replies.replies, replies_pts=0)
+                ))
+        return messages.MessageViews(views=views, chats=[], users=[])
+
+    async def get_messages(self, entity, limit=1, offset_date=None, ids=None, **kwargs):
+        if ids is not None:
+            # Сообщения по id одним запросом (channels.getMessages); несуществующие — None
+            self.counter_requests += 1
+            await self._request()
+            channel = self._by_peer[entity.channel_id]
+            return [channel.message(message_id) if 0 < message_id <= channel.messages else None for message_id in ids]
+
+        result = FakeHistory()
+        if limit:
+            async for message in self.iter_messages(entity, limit=limit, offset_date=offset_date):
+                result.append(message)
+        else:
+            await self._request()
+        result.total = self._by_peer[entity.channel_id].messages
+        return result
+
+    def iter_messages(self, entity, limit=None, offset_date=None, offset_id=0, min_id=0,
+                      wait_time=None, **kwargs):
+        channel = self._by_peer[entity.channel_id]
+        history = FakeMessagesIter(wait_time)
+        history._generator = self._iter(history, channel, limit, offset_date, offset_id, min_id)
+        return history
+
+    async def _iter(self, history, channel, limit, offset_date, offset_id, min_id):
+        # Как у Telethon: offset_id важнее offset_date, обе границы исключающие
+        if offset_id:
+            current = offset_id - 1
+        elif offset_date:
+            current = channel.newest_id_before(offset_date)
+        else:
+            current = channel.messages
+        current = min(current, channel.messages)
+
+        returned = 0
+        while current > min_id and (limit is None or returned < limit):
+            if returned and history.wait_time:
+                await asyncio.sleep(history.wait_time)
+            self.pages += 1
+            if self.flood_every and self.pages % self.flood_every == 0:
+                self.flood_waits += 1
+                raise FloodWaitError(None, capture=self.flood_seconds)
+            await self._request()
+
+            page_end = max(min_id, current - PAGE_SIZE)
+            for message_id in range(current, page_end, -1):
+                if limit is not None and returned >= limit:
+                    return
+                self.scanned += 1
+                returned += 1
+                yield channel.message(message_id)
+            current = page_end
@@ -0,0 +1,159 @@
+# run_benchmarks.py — офлайн-бенчмарк сбора постов и генерации отчета
+#
+# Запуск из корня проекта:
+#     python -m benchmarks.run_benchmarks --messages 20000 --latency 0.05
+#
+# Живой аккаунт не нужен: вместо Telethon используется FakeTelegramClient.
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Модули бота читают настройки при импорте — задаем их до импорта
+_workdir = tempfile.mkdtemp(prefix="postspy-bench-")
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ["POST_STORE_PATH"] = os.path.join(_workdir, "posts.db")
+os.environ["ENTITY_CACHE_PATH"] = os.path.join(_workdir, "posts.db")
+os.environ["TELETHON_SESSIONS"] = os.path.join(_workdir, "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import handlers  # noqa: E402
+import telethon_client  # noqa: E402
+from benchmarks.fake_client import FakeTelegramClient, SyntheticChannel  # noqa: E402
+from utils import message_parser, post_store, report_cache  # noqa: E402
+from utils.entity_resolver import EntityResolver  # noqa: E402
+
+
+def _previous_month(now, months_ago):
+    month_index = now.year * 12 + (now.month - 1) - months_ago
+    return month_index // 12, month_index % 12 + 1
+
+
+def _install(fake_client, run_id):
+    """Подменяет клиентов пула и сбрасывает кэши, чтобы каждый прогон шел в «сеть»"""
+    for account in telethon_client.client_pool.accounts:
+        account.client = fake_client
+        account.resolver = EntityResolver(fake_client, account=f"{account.name}-{run_id}")
+
+    path = os.path.join(_workdir, f"posts-{run_id}.db")
+    post_store.post_store = post_store.PostStore(path, post_store.POST_STORE_RETENTION_DAYS)
+    message_parser.post_store = post_store.post_store
+
+    report_cache.report_cache = report_cache.ReportCache()
+    handlers.report_cache = report_cache.report_cache
+
+
+async def _measure(name, make_coroutine, fake_client, reset, with_memory):
+    # Время меряем без tracemalloc: он заметно замедляет Python-код
+    started = time.perf_counter()
+    await make_coroutine()
+    elapsed = time.perf_counter() - started
+
+    peak = 0
+    if with_memory:
+        counters = fake_client.scanned, fake_client.pages, fake_client.entity_requests, fake_client.flood_waits
+        reset()
+        tracemalloc.start()
+        await make_coroutine()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        fake_client.scanned, fake_client.pages, fake_client.entity_requests, fake_client.flood_waits = counters
+
+    return {
+        "scenario": name,
+        "wall_s": elapsed,
+        "scanned": fake_client.scanned,
+        "msgs_per_s": fake_client.scanned / elapsed if elapsed else 0.0,
+        "pages": fake_client.pages,
+        "entity_requests": fake_client.entity_requests,
+        "flood_waits": fake_client.flood_waits,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+async def run_scenario(args, n_channels, target, run_id):
+    now = datetime.now(timezone.utc)
+    channels = [
+        SyntheticChannel(
+            f"@bench{i}", messages=args.messages, posts_per_day=args.posts_per_day,
+            newest_date=now, mean_views=args.mean_views, mean_reactions=args.mean_reactions,
+            mean_comments=args.mean_comments, mean_forwards=args.mean_forwards, seed=i
+        )
+        for i in range(n_channels)
+    ]
+    fake_client = FakeTelegramClient(
+        channels, latency=args.latency, flood_every=args.flood_every, flood_seconds=args.flood_seconds
+    )
+    _install(fake_client, run_id)
+
+    links = [channel.name for channel in channels]
+    year, month = _previous_month(now, args.months_ago)
+
+    if target == "messages":
+        make = lambda: message_parser.get_monthly_messages(links, year, month)
+    else:
+        make = lambda: handlers.generate_monthly_report_for_channels(links, year, month)
+
+    return await _measure(
+        f"{target} x{n_channels}", make, fake_client,
+        reset=lambda: _install(fake_client, f"{run_id}-memory"),
+        with_memory=not args.no_memory
+    )
+
+
+def _print_table(rows):
+    header = (f"{'scenario':<20} {'wall, s':>9} {'scanned':>9} {'msg/s':>10} "
+              f"{'pages':>7} {'entity':>7} {'flood':>6} {'peak, MB':>9}")
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['scenario']:<20} {row['wall_s']:>9.3f} {row['scanned']:>9} "
+              f"{row['msgs_per_s']:>10.0f} {row['pages']:>7} {row['entity_requests']:>7} "
+              f"{row['flood_waits']:>6} {row['peak_mb']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк PostSpy на синтетических каналах")
+    parser.add_argument("--messages", type=int, default=20000, help="сообщений в истории канала")
+    parser.add_argument("--posts-per-day", type=float, default=20, help="частота постов")
+    parser.add_argument("--months-ago", type=int, default=3, help="насколько старый месяц брать для отчета")
+    parser.add_argument("--mean-views", type=int, default=5000)
+    parser.add_argument("--mean-reactions", type=float, default=40)
+    parser.add_argument("--mean-comments", type=float, default=5)
+    parser.add_argument("--mean-forwards", type=float, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка на запрос, с")
+    parser.add_argument("--flood-every", type=int, default=0, help="FloodWait каждые N страниц (0 — нет)")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 32],
+                        help="размеры отчетов по числу каналов")
+    parser.add_argument("--target", choices=["messages", "report", "both"], default="both")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память")
+    parser.add_argument("--takeout", choices=["off", "auto", "always"], default=message_parser.TAKEOUT_MODE,
+                        help="массовый режим через takeout-сессию (TAKEOUT_MODE)")
+    args = parser.parse_args()
+    message_parser.TAKEOUT_MODE = args.takeout
+
+    targets = ["messages", "report"] if args.target == "both" else [args.target]
+
+    async def run_all():
+        rows = []
+        for target in targets:
+            for n_channels in args.channels:
+                rows.append(await run_scenario(args, n_channels, target, len(rows)))
+        return rows
+
+    # Лог сканирования при бенчмарке не нужен
+    logging.disable(logging.WARNING)
+    rows = asyncio.run(run_all())
+
+    _print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,444 @@
 # handlers.py — команды бота (/start, /monthly_report)
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from datetime import datetime
-
-from utils.message_parser import get_monthly_messages
+from telegram.helpers import escape_markdown
+from datetime import datetime, timedelta
+from bisect import bisect_right
+import asyncio
+import logging
+import math
+import os
+import re
+import tempfile
+
+from utils import metrics
+from utils.admission import QuotaExceededError, estimate_cost, user_quota
+from utils.analytics import PostFrameBuilder
+from utils.bulk import (
+    BULK_FORMATS, BULK_MAX_CHANNELS, BULK_MAX_FILE_SIZE, BulkJob, bulk_store, read_channel_file, run_bulk,
+    write_result
+)
+from utils.entity_resolver import normalize_channel_link
+from utils.export import EXPORT_FORMATS, EXPORT_MAX_UPLOAD, export_posts
+from utils.message_parser import ChannelDeadlineError, ChannelDone, iter_range_posts
+from utils.post_store import month_bounds, months_between
+from utils.prefetch import watchlist
+from utils.posts import from_timestamp, to_timestamp
+from utils.report_cache import report_cache
+from utils.report_jobs import QueueFullError, ReportJob, UserLimitError, report_queue
+from utils.report_stats import WEEKDAYS, ChannelStats
+from utils.text_analytics import TEXT_ANALYTICS_WORKERS, TextCollector, length_engagement
 
 # Константы для ConversationHandler
-ASK_CHANNELS, ASK_MONTH, ASK_YEAR = range(3)
+ASK_CHANNELS, ASK_MONTH, ASK_YEAR, ASK_BULK_CHANNELS = range(4)
+
+# Как часто (в постах) сообщать о прогрессе сканирования канала
+PROGRESS_EVERY = 50
+
+# Названия месяцев для красивого вывода
+MONTH_NAMES = [
+    "", "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь"
+]
+QUARTER_NAMES = ["", "I", "II", "III", "IV"]
+
+# Сколько лучших постов канала показывать в отчете
+TOP_POSTS_SHOWN = 3
+
+# Сколько самых частых хэштегов, доменов и слов показывать в отчете
+TOP_TERMS_SHOWN = 5
+
+# Сколько лучших часов публикации показывать в отчете
+TOP_HOURS_SHOWN = 3
+
+# Квартал: Q1, к1, кв1, кв.1, 1 кв, 1 квартал
+QUARTER_RE = re.compile(r"^(?:q|к|кв\.?)\s*([1-4])$|^([1-4])\s*(?:q|кв\.?|квартал)$")
+MONTH_RANGE_RE = re.compile(r"^(\d{1,2})\s*[-–—]\s*(\d{1,2})$")
+FULL_YEAR_WORDS = {"год", "весь год", "year", "все"}
+
+# Сколько секунд дать одному каналу и всему отчету (0 — без ограничения, по умолчанию).
+# Не успевшие каналы помечаются в отчете как неполные, остальные приходят как обычно
+CHANNEL_DEADLINE = float(os.getenv("CHANNEL_DEADLINE", "0"))
+REPORT_DEADLINE = float(os.getenv("REPORT_DEADLINE", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+async def _scan_channel_stats(channels, months, publish, progress=None):
+    """
+    Сканирует каналы за месяцы months одним проходом по истории каждого канала
+    и публикует статистику всех его месяцев, как только канал готов
+    """
+    # Посты канала копятся в компактных колонках (без текста и объектов Post),
+    # а статистика всех его месяцев считается одним векторным проходом, когда канал готов
+    month_starts = [to_timestamp(month_bounds(*year_month)[0]) for year_month in months]
+    frames = {channel: PostFrameBuilder(month_starts) for channel in channels}
+    scanned = dict.fromkeys(channels, 0)
+    # Тексты разбираются в пуле процессов, пока идет сканирование
+    with_text = TEXT_ANALYTICS_WORKERS > 0
+    collectors = {channel: [TextCollector() for _ in months] for channel in channels} if with_text else None
+    finishing = []
+
+    async def finish(channel, error):
+        cacheable = error is None
+        period_stats = frames.pop(channel).period_stats()
+        if with_text:
+            texts = await asyncio.gather(*(collector.result() for collector in collectors.pop(channel)))
+            for stats, text in zip(period_stats, texts):
+                stats.text = text
+            # Без текстовой части статистику не кэшируем: следующий отчет досчитает ее из хранилища
+            cacheable = cacheable and all(text is not None for text in texts)
+        for year_month, stats in zip(months, period_stats):
+            stats = stats.as_dict()
+            if error is not None:
+                stats['error'] = error
+            publish(channel, year_month, stats, cacheable=cacheable)
+
+    posts = iter_range_posts(channels, months[0], months[-1], include_text=with_text, deadline=CHANNEL_DEADLINE)
+    async for channel, post in posts:
+        if not isinstance(post, ChannelDone):
+            frames[channel].add(post)
+            if with_text:
+                collectors[channel][bisect_right(month_starts, post.timestamp) - 1].add(post)
+            scanned[channel] += 1
+            if progress and scanned[channel] % PROGRESS_EVERY == 0:
+                progress(channel, scanned[channel], False)
+            continue
+
+        # Канал досканирован — статистика всех его месяцев готова, как только пул доразберет тексты.
+        # Неудачный канал в кэш не кладем, чтобы следующий запрос попробовал снова
+        logger.info("Channel %s: %s posts in %s months", channel, scanned[channel], len(months))
+        if post.error is None:
+            error = None
+        elif isinstance(post.error, ChannelDeadlineError):
+            error = str(post.error)
+        else:
+            error = f"{type(post.error).__name__}: {post.error}"
+        finishing.append(asyncio.ensure_future(finish(channel, error)))
+
+    await asyncio.gather(*finishing)
+
 
+async def _scan_missing(missing, publish, progress=None):
+    """Сканирует недостающие месяцы; каналы с одинаковым набором месяцев идут одним потоком"""
+    groups = {}
+    for channel, channel_months in missing.items():
+        groups.setdefault((channel_months[0], channel_months[-1]), []).append(channel)
 
-async def generate_monthly_report_for_channels(channels, year, month):
+    await asyncio.gather(*(
+        _scan_channel_stats(channels, months_between(first, last), publish, progress)
+        for (first, last), channels in groups.items()
+    ))
+
+
+async def generate_range_report_for_channels(channels, first, last, progress=None, deadline=None):
+    """
+    Generate report for months first..last ((year, month) pairs) for 1-4 channels
+
+    Each channel's history is walked once for the whole range; per-month
+    stats are cached in report_cache, so months already computed are not
+    rescanned and identical requests that are already running share one scan.
+    progress(channel, posts, done) is called as channels are being scanned.
+    Months not ready after deadline seconds are reported empty with an
+    'error' key; scans nobody waits for any more are stopped.
+
+    Returns:
+        ({channel: {(year, month): stats}}, {channel: stats for the whole range});
+        stats of a channel that could not be scanned (or was cut off by a
+        deadline) carry an 'error' key
+    """
+    months = months_between(first, last)
+    logger.info("Generating report for %s channels: %s, period %s-%02d..%s-%02d",
+                len(channels), channels, *first, *last)
+
+    # Прошедший месяц уже не изменится — его статистику можно хранить бессрочно
+    now = datetime.utcnow()
+
+    def immutable(year, month):
+        return month_bounds(year, month)[1] <= now
+
+    on_ready = None
+    if progress:
+        ready = {channel: {} for channel in channels}
+
+        def on_ready(channel, year_month, stats):
+            ready[channel][year_month] = stats['total_posts']
+            progress(channel, sum(ready[channel].values()), len(ready[channel]) == len(months))
+
+    per_month = await report_cache.get_or_compute(
+        channels, months, immutable,
+        lambda missing, publish: _scan_missing(missing, publish, progress),
+        on_ready=on_ready, timeout=deadline
+    )
+    for channel_months in per_month.values():
+        for year_month, stats in channel_months.items():
+            if stats is None:
+                channel_months[year_month] = dict(
+                    ChannelStats().as_dict(), error=f"не успели собрать за {deadline:g} с"
+                )
+
+    totals = {}
+    for channel, channel_months in per_month.items():
+        total = ChannelStats()
+        errors = []
+        for stats in channel_months.values():
+            total.merge(ChannelStats.from_dict(stats))
+            if 'error' in stats:
+                errors.append(stats['error'])
+        totals[channel] = total.as_dict()
+        if errors:
+            totals[channel]['error'] = errors[0]
+    return per_month, totals
+
+
+async def generate_monthly_report_for_channels(channels, year, month, progress=None, deadline=None):
     """
     Generate monthly report for specified channels (1-4 channels)
+
+    See generate_range_report_for_channels; returns {channel: stats}.
     """
+    _, totals = await generate_range_report_for_channels(
+        channels, (year, month), (year, month), progress, deadline
+    )
+    return totals
 
-    print(f"[REPORT] Generating report for {len(channels)} channels: {channels}")
-    print(f"[REPORT] Period: {year}-{month:02d}")
 
-    # Используем оптимизированную функцию
-    monthly_posts = await get_monthly_messages(channels, year, month)
+def parse_month_range(text):
+    """
+    Месяцы отчета из ответа пользователя: «3», «1-3», «Q2», «2 квартал», «год»
+
+    Returns:
+        (first_month, last_month) или None, если не удалось разобрать
+    """
+    text = text.strip().lower()
+    if text in FULL_YEAR_WORDS:
+        return 1, 12
+
+    match = QUARTER_RE.match(text)
+    if match:
+        quarter = int(match.group(1) or match.group(2))
+        return quarter * 3 - 2, quarter * 3
+
+    match = MONTH_RANGE_RE.match(text)
+    if match:
+        first, last = int(match.group(1)), int(match.group(2))
+    elif text.isdigit():
+        first = last = int(text)
+    else:
+        return None
+
+    if 1 <= first <= last <= 12:
+        return first, last
+    return None
+
+
+def period_name(year, first, last):
+    """«март 2025 года», «I квартал 2025 года», «2025 год», «январь–май 2025 года»"""
+    if first == last:
+        return f"{MONTH_NAMES[first]} {year} года"
+    if (first, last) == (1, 12):
+        return f"{year} год"
+    if first % 3 == 1 and last == first + 2:
+        return f"{QUARTER_NAMES[last // 3]} квартал {year} года"
+    return f"{MONTH_NAMES[first]}–{MONTH_NAMES[last]} {year} года"
+
+
+def _post_link(channel, message_id):
+    """Ссылка на пост публичного канала (Markdown) или просто номер для закрытого"""
+    name = normalize_channel_link(channel)
+    if name.startswith("+") or name.startswith("joinchat/"):
+        return f"#{message_id}"
+    return f"[#{message_id}](https://t.me/{name}/{message_id})"
+
+
+def _format_distribution(channel, stats):
+    """Квантили и лучшие посты — если статистика собрана со скетчами"""
+    if 'p50_views' not in stats:
+        return ""
+    text = "\n"
+    for label, name in (("просмотры", "views"), ("реакции", "reactions")):
+        text += (f"   📐 Медиана / p90 / p99, {label}: "
+                 f"{stats[f'p50_{name}']} / {stats[f'p90_{name}']} / {stats[f'p99_{name}']}\n")
+    for label, key in (("🏆 Топ по просмотрам", 'top_views'), ("🔥 Топ по вовлеченности", 'top_engagement')):
+        top = stats.get(key, [])[:TOP_POSTS_SHOWN]
+        if top:
+            posts = ", ".join(
+                f"{_post_link(channel, message_id)} ({score}, {from_timestamp(timestamp):%d.%m})"
+                for score, message_id, timestamp in top
+            )
+            text += f"   {label}: {posts}\n"
+    return text
 
-    # Группируем посты по каналам
-    posts_by_channel = {}
-    for post in monthly_posts:
-        channel = post['channel']
-        if channel not in posts_by_channel:
-            posts_by_channel[channel] = []
-        posts_by_channel[channel].append(post)
 
+def _format_schedule(stats):
+    """Средние просмотры по дням недели и лучшие часы публикации — если есть разбивка по времени"""
+    if 'by_weekday' not in stats:
+        return ""
+    days = ", ".join(
+        f"{day} {round(views / posts)}" for day, (posts, views) in zip(WEEKDAYS, stats['by_weekday']) if posts
+    )
+    text = f"\n   📅 Просм./пост по дням недели: {days}\n"
+    hours = sorted(
+        ((views / posts, hour) for hour, (posts, views) in enumerate(stats['by_hour']) if posts), reverse=True
+    )[:TOP_HOURS_SHOWN]
+    listed = ", ".join(f"{hour:02d}:00 ({round(avg_views)})" for avg_views, hour in hours)
+    text += f"   🕐 Лучшие часы (UTC), просм./пост: {listed}\n"
+    return text
+
+
+def _format_text_stats(stats):
+    """Хэштеги, ссылки, слова и длина поста против вовлеченности — если тексты разбирались"""
+    if 'text' not in stats:
+        return ""
+    text_stats = stats['text']
+    text = "\n"
+    for label, key, prefix in (("#️⃣ Хэштеги", 'hashtags', "#"), ("🔗 Ссылки", 'domains', ""),
+                               ("🔤 Частые слова", 'keywords', "")):
+        terms = text_stats[key][:TOP_TERMS_SHOWN]
+        if terms:
+            listed = ", ".join(f"{escape_markdown(prefix + term)} ({count})" for term, count in terms)
+            text += f"   {label}: {listed}\n"
+
+    by_length = length_engagement(text_stats['lengths'])
+    if by_length:
+        text += "   📏 Длина текста → постов, просм./пост, вовлеченность:\n"
+        for label, posts, avg_views, engagement in by_length:
+            text += f"   • {label}: {posts}, {avg_views}, {engagement}%\n"
+    return text
+
+
+def _format_channel_stats(i, channel, stats):
+    """Блок отчета по одному каналу"""
+    # Имя канала — вне жирного: в нем бывают «_», которые Markdown принял бы за разметку
+    report_text = f"*{i}.* {escape_markdown(channel)}\n"
+    if 'error' in stats:
+        report_text += f"   ⚠️ Собрано не полностью: {escape_markdown(stats['error'])}\n"
+    report_text += f"   📝 Постов: {stats.get('total_posts', 0)}\n"
+    report_text += f"   📊 Среднее количество просмотров на пост: {stats.get('avg_views', 0)}\n"
+    report_text += f"   ❤️ Реакций: {stats.get('avg_reactions', 0)}\n"
+    report_text += f"   💬 Комментариев: {stats.get('avg_comments', 0)}\n"
+    report_text += f"   🔄 Пересылок: {stats.get('avg_forwards', 0)}\n\n"
+
+    # Охваты (если есть данные)
+    if stats.get('total_reactions', 0) > 0:
+        report_text += f"   📈 Охват на реакцию: {stats.get('coverage_per_reaction', 0)}\n"
+    if stats.get('total_comments', 0) > 0:
+        report_text += f"   📈 Охват на комментарий: {stats.get('coverage_per_comment', 0)}\n"
+    if stats.get('total_forwards', 0) > 0:
+        report_text += f"   📈 Охват на пересылку: {stats.get('coverage_per_forward', 0)}\n"
+    if stats.get('total_views', 0) > 0:
+        report_text += f"   💡 Вовлеченность (взаимодействия на просмотр): {stats.get('engagement_rate', 0)}%\n"
+
+    report_text += _format_distribution(channel, stats)
+    report_text += _format_schedule(stats)
+    report_text += _format_text_stats(stats)
+    return report_text
+
+
+def _partial_warning(channel_stats):
+    """Предупреждение в шапке отчета, если часть каналов собрана не полностью"""
+    partial = sum('error' in stats for stats in channel_stats.values())
+    if not partial:
+        return ""
+    return f"⚠️ *Неполные данные:* каналов — {partial}, подробности в их блоках\n"
+
+
+def format_monthly_report(channels, channel_stats, month_name, year):
+    """Текст отчета (Markdown) по готовой статистике каналов"""
+    report_text = f"📊 *Отчет за {month_name} {year} года*\n\n"
+    report_text += f"*Период:* {month_name.capitalize()} {year}\n"
+    report_text += f"*Количество каналов:* {len(channels)}\n"
+    report_text += _partial_warning(channel_stats)
+    report_text += "*" * 40 + "\n\n"
+
+    # Статистика по каждому каналу
+    for i, channel in enumerate(channels, 1):
+        report_text += _format_channel_stats(i, channel, channel_stats.get(channel, {}))
+        report_text += "\n" + "-" * 30 + "\n\n"
+
+    report_text += "*" * 40 + "\n"
+    report_text += "✅ Отчет сгенерирован!\n"
+    report_text += "Для нового отчета отправьте /monthly"
+    return report_text
+
+
+def format_range_report(channels, per_month, totals, year, first, last):
+    """Текст отчета (Markdown) за несколько месяцев: итог по каналу и разбивка по месяцам"""
+    start_date, _ = month_bounds(year, first)
+    _, end_date = month_bounds(year, last)
+
+    report_text = f"📊 *Отчет за {period_name(year, first, last)}*\n\n"
+    report_text += f"*Период:* {start_date:%d.%m.%Y} – {end_date - timedelta(days=1):%d.%m.%Y}\n"
+    report_text += f"*Количество каналов:* {len(channels)}\n"
+    report_text += _partial_warning(totals)
+    report_text += "*" * 40 + "\n\n"
+
+    for i, channel in enumerate(channels, 1):
+        report_text += _format_channel_stats(i, channel, totals.get(channel, {}))
+
+        report_text += "\n   📅 По месяцам:\n"
+        for (_, month), stats in per_month.get(channel, {}).items():
+            report_text += (f"   • {MONTH_NAMES[month]}: {stats.get('total_posts', 0)} постов, "
+                            f"{stats.get('avg_views', 0)} просм./пост\n")
+        report_text += "\n" + "-" * 30 + "\n\n"
+
+    report_text += "*" * 40 + "\n"
+    report_text += "✅ Отчет сгенерирован!\n"
+    report_text += "Для нового отчета отправьте /monthly"
+    return report_text
+
+
+def _channel_link(channel):
+    """Приводит запись канала к ссылке @name или https://t.me/name"""
+    # Проверяем формат ссылки
+    if channel.startswith('@') or channel.startswith('https://t.me/'):
+        return channel
+    if 't.me/' in channel:
+        # Добавляем https:// если нет
+        if not channel.startswith('http'):
+            channel = f"https://{channel}"
+        return channel
+    # Пробуем добавить @ если это просто имя
+    return f"@{channel}"
+
+
+def parse_channels(raw_text):
+    """Ссылки на каналы из текста: через запятую или с новой строки"""
+    channels = []
+    for line in raw_text.split('\n'):
+        for channel in line.split(','):
+            channel = channel.strip()
+            if channel:
+                channels.append(_channel_link(channel))
+    return channels
 
-    # Словарь для хранения статистики по каналам
-    channel_stats = {}
 
-    for channel in channels:
-        posts = posts_by_channel.get(channel, [])
-
-        print(f"[REPORT] Channel {channel}: {len(posts)} posts in {month}-{year}")
-
-        if posts:
-            # Рассчитываем статистику
-            total_posts = len(posts)
-            total_views = sum(post.get('views', 0) for post in posts)
-            avg_views = round(total_views / total_posts, 2) if total_posts > 0 else 0
-
-            total_reactions = sum(post.get('reactions_count', 0) for post in posts)
-            total_comments = sum(post.get('comments_count', 0) for post in posts)
-            total_forwards = sum(post.get('forwards_count', 0) for post in posts)
-
-            # Средние значения на пост
-            avg_reactions = round(total_reactions / total_posts, 2) if total_posts > 0 else 0
-            avg_comments = round(total_comments / total_posts, 2) if total_posts > 0 else 0
-            avg_forwards = round(total_forwards / total_posts, 2) if total_posts > 0 else 0
-
-            # Охваты
-            coverage_per_reaction = round(total_views / total_reactions, 2) if total_reactions > 0 else 0
-            coverage_per_forward = round(total_views / total_forwards, 2) if total_forwards > 0 else 0
-            coverage_per_comment = round(total_views / total_comments, 2) if total_comments > 0 else 0
-
-            channel_stats[channel] = {
-                'total_posts': total_posts,
-                'avg_views': avg_views,
-                'total_reactions': total_reactions,
-                'avg_reactions': avg_reactions,
-                'total_comments': total_comments,
-                'avg_comments': avg_comments,
-                'total_forwards': total_forwards,
-                'avg_forwards': avg_forwards,
-                'coverage_per_reaction': coverage_per_reaction,
-                'coverage_per_forward': coverage_per_forward,
-                'coverage_per_comment': coverage_per_comment
-            }
-        else:
-            # Если постов нет
-            channel_stats[channel] = {
-                'total_posts': 0,
-                'avg_views': 0,
-                'total_reactions': 0,
-                'avg_reactions': 0,
-                'total_comments': 0,
-                'avg_comments': 0,
-                'total_forwards': 0,
-                'avg_forwards': 0,
-                'coverage_per_reaction': 0,
-                'coverage_per_forward': 0,
-                'coverage_per_comment': 0
-            }
-
-    return channel_stats
+async def _ask_month(update, header):
+    """Спрашивает период отчета"""
+    await update.message.reply_text(
+        f"{header}\n\n"
+        "📅 *За какой период нужен отчет?*\n\n"
+        "Введите номер месяца (1-12):\n"
+        "1 - Январь\n"
+        "2 - Февраль\n"
+        "3 - Март\n"
+        "... и так далее\n\n"
+        "Или несколько месяцев сразу:\n"
+        "1-3 - с января по март\n"
+        "Q2 - второй квартал\n"
+        "год - весь год\n\n"
+        "Или напишите /cancel для отмены",
+        parse_mode='Markdown'
+    )
 
 
 async def monthly_report_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало диалога для получения ежемесячного отчета"""
+    context.user_data["mode"] = "monthly"
     await update.message.reply_text(
         "📊 *Ежемесячный отчет по Telegram-каналам*\n\n"
         "Я могу сгенерировать подробную статистику по 1-4 каналам "
-        "за любой месяц.\n\n"
+        "за любой месяц, квартал или год.\n\n"
         "📌 *Что я делаю:*\n"
         "1. Собираю все посты за указанный месяц\n"
         "2. Анализирую просмотры, реакции, комментарии и пересылки\n"
@@ -115,25 +459,8 @@ async def monthly_report_start(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def get_report_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение списка каналов для отчета"""
-    raw_text = update.message.text
-    channels = []
-
     # Парсим каналы из сообщения
-    for line in raw_text.split('\n'):
-        for channel in line.split(','):
-            channel = channel.strip()
-            if channel:
-                # Проверяем формат ссылки
-                if channel.startswith('@') or channel.startswith('https://t.me/'):
-                    channels.append(channel)
-                elif 't.me/' in channel:
-                    # Добавляем https:// если нет
-                    if not channel.startswith('http'):
-                        channel = f"https://{channel}"
-                    channels.append(channel)
-                else:
-                    # Пробуем добавить @ если это просто имя
-                    channels.append(f"@{channel}")
+    channels = parse_channels(update.message.text)
 
     # Проверяем количество каналов
     if not channels:
@@ -157,57 +484,222 @@ async def get_report_channels(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data["channels"] = channels
 
     # Спрашиваем месяц
+    await _ask_month(update, f"✅ Получено каналов: {len(channels)}\n📺 Каналы: {escape_markdown(', '.join(channels))}")
+
+    return ASK_MONTH
+
+
+async def bulk_report_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало диалога массового отчета: /bulk [csv|xlsx]"""
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in BULK_FORMATS:
+        await update.message.reply_text("❌ Формат результата: /bulk csv или /bulk xlsx")
+        return ConversationHandler.END
+
+    context.user_data["mode"] = "bulk"
+    context.user_data["format"] = fmt
     await update.message.reply_text(
-        f"✅ Получено каналов: {len(channels)}\n"
-        f"📺 Каналы: {', '.join(channels)}\n\n"
-        "📅 *За какой месяц нужен отчет?*\n\n"
-        "Введите номер месяца (1-12):\n"
-        "1 - Январь\n"
-        "2 - Февраль\n"
-        "3 - Март\n"
-        "... и так далее\n\n"
+        "📦 *Массовый отчет*\n\n"
+        f"Пришлите файл .txt или .csv со списком каналов (до {BULK_MAX_CHANNELS}) — "
+        "по одному в строке, из CSV берется первая колонка. "
+        "Можно и просто сообщением, через запятую или с новой строки.\n\n"
+        f"Результат придет файлом {fmt.upper()}.\n\n"
         "Или напишите /cancel для отмены",
         parse_mode='Markdown'
     )
+    return ASK_BULK_CHANNELS
 
-    return ASK_MONTH
 
+async def export_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало диалога выгрузки постов: /export [csv|jsonl]"""
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text("❌ Формат выгрузки: /export csv или /export jsonl")
+        return ConversationHandler.END
 
-async def get_report_month(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Получение месяца для отчета"""
-    try:
-        month = int(update.message.text)
+    context.user_data["mode"] = "export"
+    context.user_data["format"] = fmt
+    await update.message.reply_text(
+        "📄 *Выгрузка постов*\n\n"
+        "Пришлю файл со всеми постами каналов за период: id, дата, просмотры, "
+        f"реакции, комментарии и пересылки ({fmt.upper()}, сжатый gzip).\n\n"
+        "✍️ *Отправьте ссылки на каналы:*\n"
+        "от 1 до 4 каналов через запятую или с новой строки\n\n"
+        "Или напишите /cancel для отмены",
+        parse_mode='Markdown'
+    )
+    return ASK_CHANNELS
 
-        if month < 1 or month > 12:
-            await update.message.reply_text(
-                "❌ Месяц должен быть от 1 до 12.\n"
-                "Пожалуйста, введите число от 1 до 12:"
-            )
-            return ASK_MONTH
 
-        # Сохраняем месяц
-        context.user_data["month"] = month
+def _export_run(bot, chat_id, channels, first, last, period, fmt):
+    """Задача выгрузки постов: файл собирается потоком и отправляется в чат документом"""
+    async def run(job):
+        filename = f"postspy_posts_{first[0]}_{first[1]:02d}-{last[1]:02d}.{fmt}.gz"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            counts, errors = await export_posts(channels, first, last, fmt, path, progress=job.set_progress)
+            if os.path.getsize(path) > EXPORT_MAX_UPLOAD:
+                return (
+                    "❌ Файл выгрузки больше 50 МБ — Telegram его не примет.\n"
+                    "Выберите период покороче: /export"
+                )
+            with open(path, "rb") as f:
+                await bot.send_document(
+                    chat_id, document=f, filename=filename,
+                    caption=f"📄 Посты за {period}: {sum(counts.values())}"
+                )
+
+        failed = f"\nНе удалось собрать каналов: {len(errors)}" if errors else ""
+        return f"✅ Выгрузка за {period} готова — файл ниже.{failed}"
+
+    return run
+
+
+async def get_bulk_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Получение списка каналов массового отчета (файлом или текстом)"""
+    document = update.message.document
+    if document is not None:
+        if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+            await update.message.reply_text("❌ Файл слишком большой. Пришлите список до 1 МБ:")
+            return ASK_BULK_CHANNELS
+        file = await document.get_file()
+        entries = read_channel_file(bytes(await file.download_as_bytearray()))
+        channels = [_channel_link(entry) for entry in entries]
+    else:
+        channels = parse_channels(update.message.text)
+
+    # Один канал в разных форматах ссылки считаем один раз
+    unique = {}
+    for channel in channels:
+        unique.setdefault(normalize_channel_link(channel), channel)
+    channels = list(unique.values())
 
-        # Спрашиваем год
-        current_year = datetime.now().year
+    if not channels:
+        await update.message.reply_text("❌ Не найдено ссылок на каналы. Пришлите файл или список еще раз:")
+        return ASK_BULK_CHANNELS
+    if len(channels) > BULK_MAX_CHANNELS:
         await update.message.reply_text(
-            f"✅ Месяц: {month}\n\n"
-            "📅 *За какой год нужен отчет?*\n\n"
-            f"Введите год (например, {current_year}):\n"
-            f"Минимум: {current_year - 1}\n"
-            f"Максимум: {current_year}\n\n"
-            "Или напишите /cancel для отмены",
-            parse_mode='Markdown'
+            f"❌ Слишком много каналов: {len(channels)}. Максимум — {BULK_MAX_CHANNELS}.\n"
+            "Пришлите список покороче:"
         )
+        return ASK_BULK_CHANNELS
 
-        return ASK_YEAR
+    context.user_data["channels"] = channels
+    await _ask_month(update, f"✅ Получено каналов: {len(channels)}")
+    return ASK_MONTH
 
-    except ValueError:
+
+async def _submit_bulk_job(bot, run, processing_msg, cost):
+    """Ставит массовый отчет в очередь; результат отправляется в чат документом"""
+    period = period_name(run.first[0], run.first[1], run.last[1])
+
+    async def run_job(job):
+        try:
+            await run_bulk(job, generate_range_report_for_channels)
+        except asyncio.CancelledError:
+            # Отмененный пользователем отчет не продолжается после перезапуска (в отличие от прерванного)
+            if job.cancelled:
+                bulk_store.finish(run.run_id)
+            raise
+
+        filename = f"postspy_{run.first[0]}_{run.first[1]:02d}-{run.last[1]:02d}.{run.fmt}"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            write_result(run, path)
+            with open(path, "rb") as f:
+                await bot.send_document(
+                    run.chat_id, document=f, filename=filename,
+                    caption=f"📊 Массовый отчет за {period}, каналов: {len(run.channels)}"
+                )
+        bulk_store.finish(run.run_id)
+
+        errors = f"\nНе удалось собрать каналов: {job.errors}" if job.errors else ""
+        return f"✅ Массовый отчет за {period} готов — файл ниже.{errors}"
+
+    job = BulkJob(run, processing_msg, f"Массовый отчет за {period}...", run_job, cost=cost)
+    position = await report_queue.submit(job)
+    if position > 0:
+        await job.flush(force=True)
+    return position
+
+
+async def _bulk_report(update, context, channels, first, last, period):
+    """Массовый отчет из диалога /bulk"""
+    user_id = update.effective_user.id
+    cost = await estimate_cost(channels, first, last, probe=False)
+    metrics.report_cost.observe(cost)
+    try:
+        user_quota.check(user_id, cost)
+    except QuotaExceededError as e:
+        metrics.report_rejections.inc(reason=f"quota_{e.reason}")
         await update.message.reply_text(
-            "❌ Пожалуйста, введите число от 1 до 12:"
+            "❌ Лимит отчетов на этот час исчерпан.\n"
+            f"Попробуйте через {max(1, math.ceil(e.retry_after / 60))} мин: /bulk"
+        )
+        return ConversationHandler.END
+
+    run = bulk_store.open_run(
+        user_id, update.effective_chat.id, channels, first, last, context.user_data.get("format", "csv")
+    )
+    processing_msg = await update.message.reply_text(
+        f"🔄 Массовый отчет за {period}, каналов: {len(channels)}"
+    )
+    try:
+        await _submit_bulk_job(context.bot, run, processing_msg, cost)
+    except (QueueFullError, UserLimitError) as e:
+        metrics.report_rejections.inc(reason="queue_full" if isinstance(e, QueueFullError) else "user_jobs")
+        await processing_msg.edit_text(
+            "❌ Сейчас слишком много запросов на отчеты.\n"
+            "Пожалуйста, попробуйте через несколько минут: /bulk"
+        )
+        return ConversationHandler.END
+    user_quota.record(user_id, cost)
+    return ConversationHandler.END
+
+
+async def resume_bulk_reports(bot):
+    """Продолжает массовые отчеты, прерванные остановкой бота (с последнего чекпоинта)"""
+    for run in bulk_store.unfinished_runs():
+        try:
+            cost = await estimate_cost(run.channels, run.first, run.last, probe=False)
+            processing_msg = await bot.send_message(
+                run.chat_id, f"🔄 Продолжаю прерванный массовый отчет, каналов: {len(run.channels)}"
+            )
+            await _submit_bulk_job(bot, run, processing_msg, cost)
+        except Exception as e:
+            logger.warning("Массовый отчет %s не продолжен: %s: %s", run.run_id, type(e).__name__, e)
+
+
+async def get_report_month(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Получение месяца (или диапазона месяцев) для отчета"""
+    month_range = parse_month_range(update.message.text)
+
+    if month_range is None:
+        await update.message.reply_text(
+            "❌ Месяц должен быть от 1 до 12.\n"
+            "Пожалуйста, введите число от 1 до 12, диапазон (1-3), квартал (Q1) или «год»:"
         )
         return ASK_MONTH
 
+    # Сохраняем месяцы
+    first, last = month_range
+    context.user_data["month"] = first
+    context.user_data["last_month"] = last
+
+    # Спрашиваем год
+    current_year = datetime.now().year
+    await update.message.reply_text(
+        f"✅ Месяц: {first if first == last else f'{first}-{last}'}\n\n"
+        "📅 *За какой год нужен отчет?*\n\n"
+        f"Введите год (например, {current_year}):\n"
+        f"Минимум: {current_year - 1}\n"
+        f"Максимум: {current_year}\n\n"
+        "Или напишите /cancel для отмены",
+        parse_mode='Markdown'
+    )
+
+    return ASK_YEAR
+
 
 async def get_report_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение года и генерация отчета"""
@@ -225,58 +717,104 @@ async def get_report_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем данные из контекста
         channels = context.user_data.get("channels", [])
         month = context.user_data.get("month", 1)
+        last_month = context.user_data.get("last_month", month)
+        month_name = MONTH_NAMES[month]
+
+        if last_month > month and year == current_year:
+            # Будущие месяцы диапазона еще пусты — отчет до текущего месяца
+            current_month = datetime.now().month
+            if month > current_month:
+                await update.message.reply_text(
+                    "❌ Этот период еще не наступил.\n"
+                    "Пожалуйста, введите другой год:"
+                )
+                return ASK_YEAR
+            last_month = min(last_month, current_month)
+
+        period = period_name(year, month, last_month)
+        user_id = update.effective_user.id
+
+        try:
+            report_queue.check_user(user_id)
+        except UserLimitError:
+            metrics.report_rejections.inc(reason="user_jobs")
+            await update.message.reply_text(
+                "⏳ Ваши предыдущие отчеты еще собираются.\n"
+                "Дождитесь их и отправьте /monthly снова."
+            )
+            return ConversationHandler.END
 
-        # Названия месяцев для красивого вывода
-        month_names = [
-            "", "январь", "февраль", "март", "апрель", "май", "июнь",
-            "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь"
-        ]
+        mode = context.user_data.get("mode", "monthly")
+        if mode == "bulk":
+            return await _bulk_report(update, context, channels, (year, month), (year, last_month), period)
 
-        month_name = month_names[month]
+        if mode == "export":
+            title = f"Выгружаю посты за {period}..."
+        else:
+            title = f"Собираю статистику за {period}..."
 
-        # Сообщение о начале сбора
+        # Сообщение о начале сбора — дальше его правит фоновая задача
         processing_msg = await update.message.reply_text(
-            f"🔄 Собираю статистику за {month_name} {year} года...\n"
+            f"🔄 {title}\n"
             f"Каналы: {', '.join(channels)}\n\n"
             "Это может занять несколько минут..."
         )
 
-        # Генерируем отчет
-        channel_stats = await generate_monthly_report_for_channels(channels, year, month)
-
-        # Формируем отчет
-        report_text = f"📊 *Отчет за {month_name} {year} года*\n\n"
-        report_text += f"*Период:* {month_name.capitalize()} {year}\n"
-        report_text += f"*Количество каналов:* {len(channels)}\n"
-        report_text += "*" * 40 + "\n\n"
-
-        # Статистика по каждому каналу
-        for i, channel in enumerate(channels, 1):
-            stats = channel_stats.get(channel, {})
-
-            report_text += f"*{i}. {channel}*\n"
-            report_text += f"   📝 Постов: {stats.get('total_posts', 0)}\n"
-            report_text += f"   📊 Среднее количество просмотров на пост: {stats.get('avg_views', 0)}\n"
-            report_text += f"   ❤️ Реакций: {stats.get('avg_reactions', 0)}\n"
-            report_text += f"   💬 Комментариев: {stats.get('avg_comments', 0)}\n"
-            report_text += f"   🔄 Пересылок: {stats.get('avg_forwards', 0)}\n\n"
-
-            # Охваты (если есть данные)
-            if stats.get('total_reactions', 0) > 0:
-                report_text += f"   📈 Охват на реакцию: {stats.get('coverage_per_reaction', 0)}\n"
-            if stats.get('total_comments', 0) > 0:
-                report_text += f"   📈 Охват на комментарий: {stats.get('coverage_per_comment', 0)}\n"
-            if stats.get('total_forwards', 0) > 0:
-                report_text += f"   📈 Охват на пересылку: {stats.get('coverage_per_forward', 0)}\n"
+        async def report(job):
+            # Срок отчета считается от начала работы над ним, ожидание в очереди не входит
+            deadline = REPORT_DEADLINE or None
+            if last_month == month:
+                channel_stats = await generate_monthly_report_for_channels(
+                    channels, year, month, progress=job.set_progress, deadline=deadline
+                )
+                return format_monthly_report(channels, channel_stats, month_name, year)
+
+            # Несколько месяцев — один проход по истории каждого канала
+            per_month, totals = await generate_range_report_for_channels(
+                channels, (year, month), (year, last_month), progress=job.set_progress, deadline=deadline
+            )
+            return format_range_report(channels, per_month, totals, year, month, last_month)
 
-            report_text += "\n" + "-" * 30 + "\n\n"
+        if mode == "export":
+            run = _export_run(
+                context.bot, update.effective_chat.id, channels, (year, month), (year, last_month), period,
+                context.user_data.get("format", "csv")
+            )
+        else:
+            run = report
+
+        # Стоимость отчета: сколько сообщений придется получить из Telegram
+        cost = await estimate_cost(channels, (year, month), (year, last_month))
+        metrics.report_cost.observe(cost)
+        try:
+            user_quota.check(user_id, cost)
+        except QuotaExceededError as e:
+            metrics.report_rejections.inc(reason=f"quota_{e.reason}")
+            await processing_msg.edit_text(
+                "❌ Лимит отчетов на этот час исчерпан.\n"
+                f"Попробуйте через {max(1, math.ceil(e.retry_after / 60))} мин: /monthly"
+            )
+            return ConversationHandler.END
+
+        job = ReportJob(user_id, processing_msg, title, channels, run, cost=cost)
+
+        # Отчет считается в фоне, обработчик сразу освобождается
+        try:
+            position = await report_queue.submit(job)
+        except (QueueFullError, UserLimitError) as e:
+            metrics.report_rejections.inc(reason="queue_full" if isinstance(e, QueueFullError) else "user_jobs")
+            await processing_msg.edit_text(
+                "❌ Сейчас слишком много запросов на отчеты.\n"
+                "Пожалуйста, попробуйте через несколько минут: /monthly"
+            )
+            return ConversationHandler.END
+        user_quota.record(user_id, cost)
 
-        report_text += "*" * 40 + "\n"
-        report_text += "✅ Отчет сгенерирован!\n"
-        report_text += "Для нового отчета отправьте /monthly"
+        if position > 0:
+            await job.flush(force=True)
 
-        # Отправляем отчет
-        await processing_msg.edit_text(report_text, parse_mode='Markdown')
+        # Каналы из отчетов догружаются в фоне — следующий отчет соберется из локальных данных
+        watchlist.watch(channels)
 
         return ConversationHandler.END
 
@@ -293,13 +831,15 @@ async def get_report_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отмена диалога"""
+    """Отмена диалога и отчетов пользователя — ожидающих в очереди и уже идущих"""
+    context.user_data.clear()
+    cancelled = await report_queue.cancel_user(update.effective_user.id)
+    stopped = f"⛔ Остановлено отчетов: {cancelled}\n\n" if cancelled else ""
     await update.message.reply_text(
-        "❌ Диалог отменен.\n\n"
+        f"❌ Диалог отменен.\n\n{stopped}"
         "Для нового отчета отправьте /monthly\n"
         "Для начала работы отправьте /start"
     )
-    context.user_data.clear()
     return ConversationHandler.END
 
 
@@ -314,6 +854,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "✅ Рассчитывать средние значения и охваты\n\n"
         "🛠 *Доступные команды:*\n"
         "/monthly - 📊 Получить ежемесячный отчет\n"
+        "/bulk - 📦 Массовый отчет по списку каналов (CSV/XLSX)\n"
+        "/export - 📄 Выгрузить посты каналов файлом (CSV/JSONL)\n"
         "/help - 📖 Справка по использованию\n"
         "/cancel - ❌ Отменить текущий диалог\n\n"
         "Чтобы начать анализ, отправьте команду: /monthly ",
@@ -331,7 +873,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Как получить отчет:
 1. Отправьте /monthly
 2. Введите ссылки на каналы (1-4 канала)
-3. Укажите месяц (1-12)
+3. Укажите месяц (1-12), диапазон (1-3), квартал (Q1) или «год»
 4. Укажите год
 
 Форматы ссылок на каналы:
@@ -352,6 +894,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ Пересылки
 ✅ Охваты на взаимодействия
 
+Массовый отчет:
+/bulk или /bulk xlsx - пришлите файл .txt/.csv со списком каналов,
+период и год — результат придет файлом CSV или XLSX.
+Если бот перезапустится, отчет продолжится с того же места.
+
+Выгрузка постов:
+/export или /export jsonl - все посты каналов за период файлом
+(id, дата, просмотры, реакции, комментарии, пересылки; сжатый gzip).
+
 Другие команды:
 /cancel - отменить текущий диалог
 /help - показать эту справку
@@ -1,27 +1,174 @@
 # main.py — запускает Telegram-бота с функцией ежемесячных отчетов
 import asyncio
+import logging
 import os
+import re
+import secrets
+import signal
+import time
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes, ConversationHandler, MessageHandler, filters
+from telegram.ext import (
+    Application, CommandHandler, ContextTypes, ConversationHandler, MessageHandler, TypeHandler, filters
+)
 from dotenv import load_dotenv
 
 from handlers import (
     start, help_command, cancel,
     monthly_report_start, get_report_channels, get_report_month, get_report_year,
-    ASK_CHANNELS, ASK_MONTH, ASK_YEAR
+    bulk_report_start, get_bulk_channels, resume_bulk_reports, export_start,
+    ASK_CHANNELS, ASK_MONTH, ASK_YEAR, ASK_BULK_CHANNELS
 )
-from telethon_client import init_telethon
+from telethon_client import init_telethon, shutdown_telethon
+from utils import metrics
+from utils.metrics import start_metrics_server
+from utils.prefetch import prefetcher
+from utils.report_jobs import report_queue
+from utils.text_analytics import shutdown_executor
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# DEBUG включает подробный лог сканирования (прогресс по каналам)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Как получать обновления: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+# Сколько обновлений обрабатывается одновременно (1 — строго по очереди)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "1"))
+
+# Webhook: публичный адрес бота и локальный HTTP-сервер, на который его проксируют
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Допустимый секрет по правилам Bot API
+SECRET_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+logger = logging.getLogger(__name__)
+
+
+def setup_logging():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+    )
+    # Библиотеки логируют каждый сетевой запрос — оставляем им только предупреждения
+    for name in ("httpx", "telethon"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def webhook_secret():
+    """
+    Проверяет настройки режима получения обновлений до запуска клиентов
+
+    Returns:
+        секрет webhook или None в режиме polling
+    """
+    if BOT_MODE == "polling":
+        return None
+    if BOT_MODE != "webhook":
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+    if not WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_URL — публичный https-адрес бота")
+
+    if not WEBHOOK_SECRET:
+        # Без явного секрета генерируем свой на каждый запуск.
+        # Несколько экземпляров за балансировщиком должны использовать общий WEBHOOK_SECRET.
+        return secrets.token_urlsafe(32)
+    if not SECRET_TOKEN_RE.match(WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_SECRET: 1-256 символов из A-Z, a-z, 0-9, _ и -")
+    return WEBHOOK_SECRET
+
+
+async def start_updates(app, secret):
+    """Запускает получение обновлений: long polling или webhook (BOT_MODE)"""
+    if BOT_MODE == "polling":
+        await app.updater.start_polling()
+        return
+
+    # Запросы без заголовка X-Telegram-Bot-Api-Secret-Token с этим секретом сервер отклоняет
+    await app.updater.start_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        secret_token=secret
+    )
+    print(f"🌐 Webhook: {WEBHOOK_URL}/{WEBHOOK_PATH} -> {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+
+
+async def _timed(started, stage, coroutine):
+    """Ждет этап запуска и записывает, на какой секунде от старта он закончился"""
+    result = await coroutine
+    elapsed = time.monotonic() - started
+    metrics.startup_seconds.set(round(elapsed, 3), stage=stage)
+    logger.info("Запуск: %s — %.2f с", stage, elapsed)
+    return result
+
+
+async def stop_bot(app):
+    """
+    Останавливает бота в порядке, обратном запуску
+
+    Сначала прекращается прием обновлений (в режиме webhook бот снимается
+    с webhook, чтобы Telegram не слал обновления остановленному серверу),
+    затем отменяются фоновая догрузка и воркеры отчетов — они еще работают
+    с Telethon и отправляют сообщения через бота, — и только после этого
+    закрываются приложение бота и сессии Telethon. Прерванные массовые
+    отчеты продолжатся с чекпоинта при следующем запуске.
+    """
+    metrics.ready.set(0)
+    if app.updater.running:
+        await app.updater.stop()
+    if BOT_MODE == "webhook":
+        try:
+            await app.bot.delete_webhook()
+        except Exception as e:
+            logger.warning("Не удалось снять webhook: %s: %s", type(e).__name__, e)
+
+    await prefetcher.stop()
+    await report_queue.stop()
+
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+
+    # Сессии Telethon дописывают на диск то, что еще не сбросили в фоне
+    await shutdown_telethon()
+    shutdown_executor()
+
+
+def first_update_handler(started):
+    """Обработчик, который замечает первое обновление после запуска (холодный старт до первого апдейта)"""
+    async def on_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not metrics.startup_seconds.get(stage="first_update"):
+            elapsed = time.monotonic() - started
+            metrics.startup_seconds.set(round(elapsed, 3), stage="first_update")
+            logger.info("Первое обновление через %.2f с после запуска", elapsed)
+
+    return TypeHandler(Update, on_update)
+
 
 async def main():
-    # Инициализируем Telethon клиент
-    await init_telethon()
+    started = time.monotonic()
+    setup_logging()
+    if not BOT_TOKEN:
+        raise ValueError("Не задан BOT_TOKEN (@BotFather)")
+    secret = webhook_secret()
+
+    # /metrics и проба /ready доступны с первых секунд: до готовности /ready отвечает 503
+    await start_metrics_server()
 
     # Создаем приложение бота
-    app = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(BOT_TOKEN)
+    if BOT_CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(BOT_CONCURRENT_UPDATES)
+    app = builder.build()
 
     # Обработчик для ежемесячного отчета
     monthly_report_handler = ConversationHandler(
@@ -37,26 +184,82 @@ async def main():
         ],
     )
 
+    # Массовый отчет: список каналов файлом, результат файлом
+    bulk_report_handler = ConversationHandler(
+        entry_points=[CommandHandler("bulk", bulk_report_start)],
+        states={
+            ASK_BULK_CHANNELS: [MessageHandler(
+                filters.Document.ALL | (filters.TEXT & ~filters.COMMAND), get_bulk_channels
+            )],
+            ASK_MONTH: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_month)],
+            ASK_YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_year)],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CommandHandler("help", help_command)
+        ],
+    )
+
+    # Выгрузка постов файлом: каналы и период спрашиваются так же, как для отчета
+    export_handler = ConversationHandler(
+        entry_points=[CommandHandler("export", export_start)],
+        states={
+            ASK_CHANNELS: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_channels)],
+            ASK_MONTH: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_month)],
+            ASK_YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_year)],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CommandHandler("help", help_command)
+        ],
+    )
+
     # Добавляем обработчики команд
+    app.add_handler(first_update_handler(started), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(monthly_report_handler)
+    app.add_handler(bulk_report_handler)
+    app.add_handler(export_handler)
     app.add_handler(CommandHandler("cancel", cancel))
 
-    print("✅ Бот запущен и готов к работе!")
-    print("🤖 Основная функция: генерация ежемесячных отчетов по 1-4 каналам")
-
-    # Получаем информацию о боте
-    bot_info = await app.bot.getMe()
-    print(f"🤖 Имя бота: @{bot_info.username}")
+    # Telethon и бот подключаются параллельно; app.initialize() заодно проверяет токен (getMe).
+    # Неавторизованная сессия или неверный токен останавливают запуск сразу
+    await asyncio.gather(
+        _timed(started, "telethon", init_telethon()),
+        _timed(started, "bot", app.initialize())
+    )
+    print(f"🤖 Имя бота: @{app.bot.username}")
 
     # Запускаем бота
-    await app.initialize()
     await app.start()
-    await app.updater.start_polling()
+    await start_updates(app, secret)
+
+    # Воркеры фоновой генерации отчетов
+    report_queue.start()
+
+    metrics.ready.set(1)
+    metrics.startup_seconds.set(round(time.monotonic() - started, 3), stage="ready")
+    print(f"✅ Бот запущен и готов к работе за {time.monotonic() - started:.2f} с!")
+    print("🤖 Основная функция: генерация ежемесячных отчетов по 1-4 каналам")
+
+    # Массовые отчеты, прерванные прошлой остановкой, продолжаются с чекпоинта
+    await resume_bulk_reports(app.bot)
+
+    # Догрузка отслеживаемых каналов в непиковые часы
+    prefetcher.start()
 
-    # Бот работает до принудительной остановки
-    await asyncio.Event().wait()
+    # Бот работает до остановки: Ctrl+C или SIGTERM (docker stop, systemd)
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass  # Windows: остается только Ctrl+C
+    try:
+        await stop.wait()
+    finally:
+        await stop_bot(app)
+        logger.info("Бот остановлен")
 
 
 if __name__ == "__main__":
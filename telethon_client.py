@@ -1,52 +1,345 @@
-# telethon_client.py — инициализация и авторизация Telethon клиента
+# telethon_client.py — инициализация и авторизация Telethon клиентов (пул аккаунтов)
 from telethon import TelegramClient
+from telethon.sessions import StringSession
 from dotenv import load_dotenv
 import os
+import sys
 import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
 
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import FloodWaitError, RPCError, SessionPasswordNeededError, TakeoutInitDelayError
+
+from utils import metrics
+from utils.buffered_session import BufferedSQLiteSession
+from utils.entity_resolver import EntityResolver
 
 load_dotenv()
 
-API_ID = int(os.getenv("API_ID"))
-API_HASH = os.getenv("API_HASH")
+logger = logging.getLogger(__name__)
+
+# Проверяются при запуске (init_telethon), а не при импорте
+API_ID = int(os.getenv("API_ID") or 0)
+API_HASH = os.getenv("API_HASH", "")
+
+# Готовые авторизованные сессии строками (StringSession) через запятую — для контейнеров
+# без файлов сессий; получить: python telethon_client.py. Если заданы, TELETHON_SESSIONS не нужен.
+TELETHON_STRING_SESSIONS = [
+    session.strip() for session in os.getenv("TELETHON_STRING_SESSIONS", "").split(",") if session.strip()
+]
+
+# Имена файлов сессий через запятую: telethon,telethon2,... (каждая — отдельный аккаунт)
+TELETHON_SESSIONS = [
+    name.strip() for name in os.getenv("TELETHON_SESSIONS", "" if TELETHON_STRING_SESSIONS else "telethon").split(",")
+    if name.strip()
+]
+
+# Вход с вводом телефона и кода: auto — только если запущены в терминале, иначе неавторизованная
+# сессия сразу останавливает запуск (контейнер не повиснет на input())
+TELETHON_INTERACTIVE_LOGIN = os.getenv("TELETHON_INTERACTIVE_LOGIN", "auto").lower()
+
+# Сколько сканирований одновременно ведет один аккаунт
+ACCOUNT_MAX_CONCURRENCY = int(os.getenv("ACCOUNT_MAX_CONCURRENCY", "4"))
+
+# FloodWait короче порога Telethon пережидает сам на том же аккаунте.
+# При нескольких аккаунтах выгоднее сразу отдать работу другому.
+FLOOD_SLEEP_THRESHOLD = int(os.getenv(
+    "FLOOD_SLEEP_THRESHOLD", "0" if len(TELETHON_SESSIONS) + len(TELETHON_STRING_SESSIONS) > 1 else "60"
+))
+
+# Пауза между страницами истории в takeout-сессии (секунды): начальная и предельная.
+# После FloodWait пауза удваивается, после каждой спокойной страницы понемногу сокращается.
+TAKEOUT_WAIT_MIN = float(os.getenv("TAKEOUT_WAIT_MIN", "0"))
+TAKEOUT_WAIT_MAX = float(os.getenv("TAKEOUT_WAIT_MAX", "3"))
+TAKEOUT_WAIT_STEP = 0.5
+TAKEOUT_WAIT_DECAY = 0.9
+
+
+class AuthorizationError(Exception):
+    """Сессия аккаунта не авторизована, а войти интерактивно нельзя"""
+
+
+def _session_specs():
+    """(имя аккаунта, сессия): файловые сессии и строковые (StringSession)"""
+    specs = [(name, name) for name in TELETHON_SESSIONS]
+    for session in TELETHON_STRING_SESSIONS:
+        # Имя — по хэшу строки: кэш сущностей аккаунта не путается при смене порядка
+        specs.append((f"string-{hashlib.sha1(session.encode()).hexdigest()[:8]}", StringSession(session)))
+    return specs
+
+
+class Account:
+    """Аккаунт пула: клиент, свой кэш сущностей и счетчики нагрузки"""
+
+    def __init__(self, name, session=None):
+        self.name = name
+        if session is None or isinstance(session, str):
+            # Файловая сессия: сущности в памяти, на диск — пачками в фоне (см. utils.buffered_session)
+            session = BufferedSQLiteSession(session or name)
+        self.client = TelegramClient(session, API_ID, API_HASH)
+        self.client.flood_sleep_threshold = FLOOD_SLEEP_THRESHOLD
+        # access_hash у каждого аккаунта свой, поэтому и кэш сущностей свой
+        self.resolver = EntityResolver(self.client, account=name)
+        self.active = 0
+        self.acquired_total = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.cooldown_until = 0.0
+        # Takeout-сессия одна на аккаунт и разделяется всеми его сканированиями
+        self.takeout_wait = TAKEOUT_WAIT_MIN
+        self.takeout_blocked_until = 0.0
+        self._takeout = None
+        self._takeout_users = 0
+        self._takeout_lock = None
+
+    @property
+    def cooling_down(self):
+        return self.cooldown_until > time.monotonic()
+
+    @property
+    def takeout_available(self):
+        return self.takeout_blocked_until <= time.monotonic()
+
+    @asynccontextmanager
+    async def takeout(self):
+        """
+        Takeout-клиент аккаунта (у запросов через него мягче лимиты)
+
+        Сессия открывается первым пользователем и закрывается последним.
+        Если Telegram еще не разрешил takeout (TakeoutInitDelayError),
+        выдает None, и на время задержки аккаунт перестает предлагать takeout.
+        """
+        if self._takeout_lock is None:
+            self._takeout_lock = asyncio.Lock()
+
+        async with self._takeout_lock:
+            if self._takeout is None and self.takeout_available:
+                try:
+                    if self.client.session.takeout_id is not None:
+                        # Сессия осталась незакрытой с прошлого запуска — продолжаем ее
+                        takeout = self.client.takeout(finalize=False)
+                    else:
+                        takeout = self.client.takeout(finalize=False, channels=True, megagroups=True)
+                    self._takeout = await takeout.__aenter__()
+                except TakeoutInitDelayError as e:
+                    self.takeout_blocked_until = time.monotonic() + e.seconds
+                    logger.warning("Аккаунт %s: takeout будет доступен через %s с", self.name, e.seconds)
+                except RPCError as e:
+                    self.takeout_blocked_until = time.monotonic() + 3600
+                    logger.warning("Аккаунт %s: takeout недоступен: %s", self.name, e)
+            if self._takeout is not None:
+                self._takeout_users += 1
+            takeout = self._takeout
+
+        if takeout is None:
+            yield None
+            return
+
+        try:
+            yield takeout
+        finally:
+            async with self._takeout_lock:
+                self._takeout_users -= 1
+                if self._takeout_users == 0:
+                    self._takeout = None
+                    await self.client.end_takeout(success=True)
+
+    def takeout_paced(self, flood):
+        """Подстраивает паузу между страницами takeout: после FloodWait (flood=True) или спокойной страницы"""
+        if flood:
+            self.takeout_wait = min(TAKEOUT_WAIT_MAX, max(TAKEOUT_WAIT_STEP, self.takeout_wait * 2))
+        else:
+            self.takeout_wait = max(TAKEOUT_WAIT_MIN, self.takeout_wait * TAKEOUT_WAIT_DECAY)
+
+
+class ClientPool:
+    """
+    Пул авторизованных аккаунтов
+
+    acquire() выдает наименее загруженный аккаунт вне FloodWait-паузы.
+    FloodWaitError внутри acquire() ставит аккаунт на паузу на указанное
+    Telegram время — до ее окончания он в ротацию не попадает.
+    """
+
+    def __init__(self, session_specs, max_concurrency=ACCOUNT_MAX_CONCURRENCY):
+        self._session_specs = session_specs
+        self._accounts = None
+        self.max_concurrency = max_concurrency
+        self._condition = None
+
+    @property
+    def accounts(self):
+        # Клиенты создаются при первом обращении, а не при импорте модуля
+        if self._accounts is None:
+            self._accounts = [Account(name, session) for name, session in self._session_specs]
+        return self._accounts
 
-client = TelegramClient("telethon", API_ID, API_HASH)
+    @property
+    def condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
 
+    def _pick(self):
+        available = [
+            account for account in self.accounts
+            if not account.cooling_down and account.active < self.max_concurrency
+        ]
+        if not available:
+            return None
+        return min(available, key=lambda account: (account.active, account.acquired_total))
 
-async def init_telethon():
-    """Инициализация и авторизация Telethon клиента"""
-    print("🔄 Инициализация Telethon клиента...")
+    def _next_release_in(self):
+        """Через сколько секунд закончится ближайшая FloodWait-пауза"""
+        cooling = [account.cooldown_until for account in self.accounts if account.cooling_down]
+        if not cooling:
+            return None
+        return max(0.0, min(cooling) - time.monotonic())
 
-    # Подключаемся к Telegram
-    await client.connect()
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                account = self._pick()
+                if account is not None:
+                    break
+                # Ждем освобождения аккаунта или конца ближайшей паузы
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=self._next_release_in())
+                except asyncio.TimeoutError:
+                    pass
+            account.active += 1
+            account.acquired_total += 1
 
-    # Проверяем, нужна ли авторизация
-    if not await client.is_user_authorized():
-        print("🔐 Требуется авторизация. Начинаем процесс входа...")
         try:
-            # Запрашиваем номер телефона
-            phone = input("📱 Введите номер телефона: ")
-
-            # Отправляем код подтверждения
-            sent_code = await client.send_code_request(phone)
-            print("📨 Код подтверждения отправлен!")
-
-            # Ждем ввода кода
-            code = input("🔢 Введите код из Telegram: ")
-
-            # Пытаемся авторизоваться
-            await client.sign_in(phone, code)
-
-            print("✅ Авторизация прошла успешно!")
-        except SessionPasswordNeededError:
-            print("⚠️ Требуется двухфакторная аутентификация")
-            password = input("🔑 Введите 2FA пароль: ")
-            await client.sign_in(password=password)
-            print("✅ Авторизация с 2FA прошла успешно!")
-        except Exception as e:
-            print(f"❌ Ошибка при авторизации: {e}")
+            yield account
+        except FloodWaitError as e:
+            account.flood_waits += 1
+            account.flood_wait_seconds += e.seconds
+            account.cooldown_until = time.monotonic() + e.seconds
+            metrics.flood_waits.inc(account=account.name)
+            metrics.flood_wait_seconds.inc(e.seconds, account=account.name)
+            logger.warning("Аккаунт %s: FloodWait %s с, выведен из ротации", account.name, e.seconds)
             raise
-    else:
-        print("✅ Клиент уже авторизован!")
-    print("Telethon-клиент авторизирован")
+        finally:
+            async with self.condition:
+                account.active -= 1
+                self.condition.notify_all()
+
+    @staticmethod
+    def retry_delay(error, attempt):
+        """
+        Пауза перед повтором после FloodWait (для utils.scheduler.run_bounded)
+
+        Ждать error.seconds не нужно: аккаунт уже на паузе, и acquire()
+        выдаст другой аккаунт или сам дождется конца ближайшей паузы.
+        """
+        return min(attempt, 5)
+
+
+client_pool = ClientPool(_session_specs())
+
+
+def __getattr__(name):
+    # telethon_client.client — клиент первого аккаунта, для кода, которому нужен один клиент
+    if name == "client":
+        return client_pool.accounts[0].client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _interactive_login():
+    if TELETHON_INTERACTIVE_LOGIN == "auto":
+        return sys.stdin.isatty()
+    return TELETHON_INTERACTIVE_LOGIN in ("1", "true", "yes", "on")
+
+
+async def _connect(account):
+    """Подключает аккаунт; возвращает True, если сессия уже авторизована"""
+    await account.client.connect()
+    return await account.client.is_user_authorized()
+
+
+async def _authorize(account):
+    """Интерактивный вход в аккаунт (телефон, код, 2FA)"""
+    client = account.client
+    print(f"🔐 [{account.name}] Требуется авторизация. Начинаем процесс входа...")
+    try:
+        # Запрашиваем номер телефона
+        phone = input(f"📱 [{account.name}] Введите номер телефона: ")
+
+        # Отправляем код подтверждения
+        sent_code = await client.send_code_request(phone)
+        print("📨 Код подтверждения отправлен!")
+
+        # Ждем ввода кода
+        code = input("🔢 Введите код из Telegram: ")
+
+        # Пытаемся авторизоваться
+        await client.sign_in(phone, code)
+
+        print("✅ Авторизация прошла успешно!")
+    except SessionPasswordNeededError:
+        print("⚠️ Требуется двухфакторная аутентификация")
+        password = input("🔑 Введите 2FA пароль: ")
+        await client.sign_in(password=password)
+        print("✅ Авторизация с 2FA прошла успешно!")
+    except Exception as e:
+        print(f"❌ Ошибка при авторизации: {e}")
+        raise
+
+
+async def init_telethon(interactive=None):
+    """
+    Инициализация и авторизация всех Telethon клиентов пула
+
+    Аккаунты подключаются параллельно. Если какая-то сессия не авторизована,
+    а вход с клавиатуры недоступен (TELETHON_INTERACTIVE_LOGIN), поднимается
+    AuthorizationError — запуск останавливается сразу, а не ждет input().
+    """
+    if not API_ID or not API_HASH:
+        raise AuthorizationError("Не заданы API_ID и API_HASH (my.telegram.org)")
+    if not client_pool.accounts:
+        raise AuthorizationError("Не задано ни одной сессии: TELETHON_SESSIONS или TELETHON_STRING_SESSIONS")
+    if interactive is None:
+        interactive = _interactive_login()
+
+    started = time.monotonic()
+    names = ", ".join(account.name for account in client_pool.accounts)
+    print(f"🔄 Инициализация Telethon клиентов: {names}...")
+
+    authorized = await asyncio.gather(*(_connect(account) for account in client_pool.accounts))
+    missing = [account for account, ok in zip(client_pool.accounts, authorized) if not ok]
+    if missing and not interactive:
+        raise AuthorizationError(
+            f"Сессии не авторизованы: {', '.join(account.name for account in missing)}. "
+            "Авторизуйте их в терминале (python telethon_client.py) или задайте TELETHON_STRING_SESSIONS"
+        )
+
+    # Вход по очереди: нужен ввод с клавиатуры
+    for account in missing:
+        await _authorize(account)
+    print(f"Telethon-клиенты авторизированы: {len(client_pool.accounts)} за {time.monotonic() - started:.2f} с")
+
+
+async def shutdown_telethon():
+    """Отключает клиенты пула; сессии при этом дописывают накопленное на диск"""
+    if client_pool._accounts is None:
+        return
+    await asyncio.gather(
+        *(account.client.disconnect() for account in client_pool.accounts if account.client.is_connected()),
+        return_exceptions=True
+    )
+
+
+async def _export_string_sessions():
+    """Входит во все аккаунты (интерактивно) и печатает их строковые сессии для TELETHON_STRING_SESSIONS"""
+    await init_telethon(interactive=True)
+    for account in client_pool.accounts:
+        print(f"\n[{account.name}]\n{StringSession.save(account.client.session)}")
+        await account.client.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_export_string_sessions())
@@ -0,0 +1,165 @@
+# admission.py — оценка стоимости отчетов и квоты пользователей
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+
+from telethon_client import client_pool
+from utils.post_store import month_bounds, months_between, post_store
+from utils.report_cache import report_cache, report_key
+from utils.text_analytics import TEXT_ANALYTICS_WORKERS
+
+# Квота на пользователя за окно USER_QUOTA_WINDOW секунд: отчетов и сообщений, выкачанных из Telegram
+USER_REPORTS_PER_WINDOW = int(os.getenv("USER_REPORTS_PER_WINDOW", "20"))
+USER_MESSAGES_PER_WINDOW = int(os.getenv("USER_MESSAGES_PER_WINDOW", "500000"))
+USER_QUOTA_WINDOW = int(os.getenv("USER_QUOTA_WINDOW", "3600"))
+
+# Сколько ждать оценки размера канала и сколько сообщений в месяце считать, если оценить не удалось
+ESTIMATE_TIMEOUT = float(os.getenv("ESTIMATE_TIMEOUT", "5"))
+ESTIMATE_MONTH_MESSAGES = 3000
+
+# Стоимость отчета, который целиком собирается из кэша и хранилища
+BASE_COST = 100
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceededError(Exception):
+    """Пользователь исчерпал квоту на отчеты; retry_after — через сколько секунд она освободится"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _months_to_fetch(channel_link, months):
+    """
+    Месяцы, которые придется сканировать из сети, и max_id уже сохраненных постов
+
+    Месяцы из кэша статистики и завершенные месяцы из хранилища бесплатны
+    (если для текстовой аналитики нужны тексты — только сохраненные с ними).
+    """
+    needed = []
+    min_id = 0
+    for year, month in months:
+        if report_cache.get(report_key(channel_link, year, month)) is not None:
+            continue
+        stored = post_store.get_month(channel_link, year, month)
+        if stored is not None and not stored[2] and TEXT_ANALYTICS_WORKERS > 0:
+            # Месяц без текстов собирается заново целиком
+            stored = None
+        if stored is not None and stored[1]:
+            continue
+        needed.append((year, month))
+        if stored is not None:
+            min_id = stored[0]
+    # Сохраненный max_id сокращает сканирование, только если недостает одного месяца
+    return needed, min_id if len(needed) == 1 else 0
+
+
+async def _message_id_before(client, channel, date):
+    """id последнего сообщения канала до date (0, если сообщений нет)"""
+    messages = await client.get_messages(channel, limit=1, offset_date=date)
+    return messages[0].id if messages else 0
+
+
+async def _estimate_channel(channel_link, months, probe=True):
+    """
+    Примерное число сообщений канала, которое придется получить из Telegram
+
+    id сообщений в канале идут подряд, поэтому разница id на границах
+    диапазона — это размер диапазона (с удаленными сообщениями). Оценка
+    стоит двух запросов по одному сообщению; если Telegram не ответил
+    за ESTIMATE_TIMEOUT (или probe=False), берется ESTIMATE_MONTH_MESSAGES на месяц.
+    """
+    needed, min_id = _months_to_fetch(channel_link, months)
+    if not needed:
+        return 0
+    if not probe:
+        return len(needed) * ESTIMATE_MONTH_MESSAGES
+
+    start_date, _ = month_bounds(*needed[0])
+    _, end_date = month_bounds(*needed[-1])
+
+    async def request():
+        async with client_pool.acquire() as account:
+            async def probe_ids():
+                channel = await account.resolver.resolve(channel_link)
+                last_id = await _message_id_before(account.client, channel, end_date)
+                first_id = await _message_id_before(account.client, channel, start_date)
+                return last_id, first_id
+
+            last_id, first_id = await account.resolver.retry_stale(channel_link, probe_ids)
+        return max(0, last_id - max(first_id, min_id))
+
+    try:
+        return await asyncio.wait_for(request(), timeout=ESTIMATE_TIMEOUT)
+    except Exception as e:
+        logger.debug("Оценка размера %s не удалась: %s: %s", channel_link, type(e).__name__, e)
+        return len(needed) * ESTIMATE_MONTH_MESSAGES
+
+
+async def estimate_cost(channels, first, last, probe=True):
+    """
+    Оценка стоимости отчета по каналам за месяцы от first до last
+
+    probe=False — без запросов к Telegram, только по локальным данным
+    (для массовых отчетов, где запросы на оценку сами стоили бы заметно).
+
+    Returns:
+        примерное число сообщений, которое придется получить из Telegram, плюс BASE_COST
+    """
+    months = months_between(first, last)
+    sizes = await asyncio.gather(*(_estimate_channel(channel, months, probe) for channel in channels))
+    return BASE_COST + sum(sizes)
+
+
+class UserQuota:
+    """
+    Квоты пользователей в скользящем окне
+
+    За window секунд пользователь может заказать не больше reports отчетов
+    суммарной стоимостью не больше messages. Один отчет дороже всей квоты
+    разрешен, если до него окно пустое, — иначе его нельзя было бы заказать вовсе.
+    """
+
+    def __init__(self, reports=USER_REPORTS_PER_WINDOW, messages=USER_MESSAGES_PER_WINDOW, window=USER_QUOTA_WINDOW):
+        self.reports = reports
+        self.messages = messages
+        self.window = window
+        self._history = defaultdict(deque)
+
+    def _recent(self, user_id, now):
+        history = self._history[user_id]
+        while history and history[0][0] <= now - self.window:
+            history.popleft()
+        if not history:
+            del self._history[user_id]
+        return history
+
+    def check(self, user_id, cost):
+        """Поднимает QuotaExceededError, если отчет стоимостью cost не помещается в квоту"""
+        now = time.monotonic()
+        history = self._recent(user_id, now)
+        if not history:
+            return
+
+        if self.reports and len(history) >= self.reports:
+            raise QuotaExceededError("reports", history[0][0] + self.window - now)
+
+        spent = sum(charged for _, charged in history)
+        if self.messages and spent + cost > self.messages:
+            # Ждем, пока из окна выйдет достаточно старых отчетов
+            for charged_at, charged in history:
+                spent -= charged
+                if spent + cost <= self.messages:
+                    break
+            raise QuotaExceededError("messages", charged_at + self.window - now)
+
+    def record(self, user_id, cost):
+        self._history[user_id].append((time.monotonic(), cost))
+
+
+user_quota = UserQuota()
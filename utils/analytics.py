@@ -0,0 +1,96 @@
+# analytics.py — статистика канала по месяцам одним векторным проходом (NumPy)
+from array import array
+
+import numpy as np
+
+from utils.report_stats import REPORT_TOP_POSTS, SKETCH_COUNTERS, ChannelStats
+from utils.sketches import QuantileSketch, TopPosts
+
+# Колонки поста, которые копит PostFrameBuilder
+COLUMNS = ("timestamp", "message_id", "views", "reactions_count", "comments_count", "forwards_count")
+
+
+class PostFrameBuilder:
+    """
+    Копит посты канала в компактные колонки (array) по мере их получения
+
+    На пост уходит ~50 байт, текст и объекты Post не хранятся. Статистику
+    всех месяцев period_stats считает сразу, групповыми операциями NumPy
+    по номеру месяца, — без обработки каждого поста в Python.
+    """
+
+    def __init__(self, month_starts):
+        # Начала месяцев отчета (timestamp) по возрастанию
+        self.month_starts = np.asarray(month_starts, dtype=np.int64)
+        self.columns = {name: array("q") for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def add(self, post):
+        for name, column in self.columns.items():
+            column.append(getattr(post, name))
+
+    def _column(self, name):
+        column = self.columns[name]
+        return np.frombuffer(column, dtype=np.int64) if column else np.zeros(0, np.int64)
+
+    def period_stats(self):
+        """[ChannelStats] по месяцам month_starts; месяцы без постов — пустые"""
+        n_periods = len(self.month_starts)
+        columns = {name: self._column(name) for name in COLUMNS}
+        timestamps = columns["timestamp"]
+        group = np.searchsorted(self.month_starts, timestamps, side="right") - 1
+        counts = np.bincount(group, minlength=n_periods)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+
+        def sums(values, cells=None, size=n_periods):
+            return np.bincount(group if cells is None else cells, weights=values, minlength=size).astype(np.int64)
+
+        totals = {name: sums(columns[name]) for name in SKETCH_COUNTERS.values()}
+
+        # 1970-01-01 — четверг, поэтому день недели — (дней с эпохи + 3) % 7
+        days, seconds = np.divmod(timestamps, 86400)
+        weekday_cells = group * 7 + (days + 3) % 7
+        hour_cells = group * 24 + seconds // 3600
+        views = columns["views"]
+        by_weekday = np.stack([sums(None, weekday_cells, n_periods * 7), sums(views, weekday_cells, n_periods * 7)], 1)
+        by_hour = np.stack([sums(None, hour_cells, n_periods * 24), sums(views, hour_cells, n_periods * 24)], 1)
+
+        # Значения счетчиков, отсортированные внутри каждого месяца, — для скетчей квантилей
+        ordered = {
+            name: columns[attribute][np.lexsort((columns[attribute], group))]
+            for name, attribute in SKETCH_COUNTERS.items()
+        }
+        interactions = columns["reactions_count"] + columns["comments_count"] + columns["forwards_count"]
+        tops = {
+            'top_views': self._top_order(group, views),
+            'top_engagement': self._top_order(group, interactions),
+        }
+        scores = {'top_views': views, 'top_engagement': interactions}
+
+        result = []
+        for period in range(n_periods):
+            stats = ChannelStats()
+            stats.total_posts = int(counts[period])
+            stats.total_views = int(totals["views"][period])
+            stats.total_reactions = int(totals["reactions_count"][period])
+            stats.total_comments = int(totals["comments_count"][period])
+            stats.total_forwards = int(totals["forwards_count"][period])
+            stats.by_weekday = by_weekday[period * 7:(period + 1) * 7].tolist()
+            stats.by_hour = by_hour[period * 24:(period + 1) * 24].tolist()
+
+            start, end = bounds[period], bounds[period + 1]
+            for name, values in ordered.items():
+                stats.sketches[name] = QuantileSketch.from_sorted(values[start:end].tolist())
+            for key, order in tops.items():
+                best = order[max(start, end - REPORT_TOP_POSTS):end]
+                setattr(stats, key, TopPosts.from_list(REPORT_TOP_POSTS, zip(
+                    scores[key][best].tolist(), columns["message_id"][best].tolist(), timestamps[best].tolist()
+                )))
+            result.append(stats)
+        return result
+
+    def _top_order(self, group, scores):
+        """Индексы постов по месяцу, внутри месяца — по возрастанию (оценка, message_id), как в TopPosts"""
+        return np.lexsort((self._column("message_id"), scores, group))
@@ -0,0 +1,207 @@
+# buffered_session.py — файловая сессия Telethon, которая пишет сущности на диск пачками в фоне
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from telethon import utils
+from telethon.sessions import SQLiteSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+
+# Как часто (секунды) сбрасывать накопленные сущности и состояние обновлений в файл сессии
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedSQLiteSession(SQLiteSession):
+    """
+    Сессия Telethon в том же файле *.session, но с сущностями в памяти
+
+    SQLiteSession пишет строки сущностей в базу синхронно после каждого
+    ответа Telegram — прямо в событийном цикле, и под нагрузкой цикл ждет
+    диск. Здесь сущности и состояние обновлений живут в словарях с
+    индексами по username, телефону и имени, а в файл уходят пачкой в
+    фоновом потоке раз в flush_interval секунд, а также при save() и
+    close() (Telethon вызывает их при подключении, отключении и раз
+    в минуту). Ключ авторизации, DC и takeout_id записываются и
+    фиксируются сразу — их потеря при падении стоила бы повторного входа.
+    """
+
+    def __init__(self, session_id, flush_interval=SESSION_FLUSH_INTERVAL):
+        # SQLiteSession.__init__ уже вызывает save() и _update_session_table — состояние нужно до него
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._by_username = {}
+        self._by_phone = {}
+        self._by_name = {}
+        self._states = {}
+        self._dirty_rows = {}
+        self._dirty_states = {}
+        self._flusher = None
+        super().__init__(session_id)
+        self._load()
+
+    def _load(self):
+        """Читает сущности и состояние обновлений из файла (старые сначала: новые перекрывают индексы)"""
+        with self._lock:
+            cursor = self._cursor()
+            try:
+                rows = cursor.execute(
+                    "select id, hash, username, phone, name, date from entities order by date"
+                ).fetchall()
+            finally:
+                cursor.close()
+        for row in rows:
+            self._index(row)
+        self._states = dict(super().get_update_states())
+
+    def _index(self, row):
+        """Кладет строку сущности в память; у username, телефона и имени остается самый новый владелец"""
+        entity_id, _, username, phone, name, _ = row
+        previous = self._rows.get(entity_id)
+        if previous is not None:
+            for index, value in ((self._by_username, previous[2]), (self._by_phone, previous[3]),
+                                 (self._by_name, previous[4])):
+                if value is not None and index.get(value) == entity_id:
+                    del index[value]
+        self._rows[entity_id] = row
+
+        if username is not None:
+            owner = self._by_username.get(username)
+            if owner is not None and owner != entity_id:
+                # Username перешел к другой сущности — как SQLiteSession, забываем его у прежней
+                stale = self._rows[owner]
+                self._rows[owner] = self._dirty_rows[owner] = stale[:2] + (None,) + stale[3:]
+            self._by_username[username] = entity_id
+        if phone is not None:
+            self._by_phone[phone] = entity_id
+        if name:
+            self._by_name[name] = entity_id
+
+    # Сущности: только память, запись — в фоне
+
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        rows = self._entities_to_rows(tlo)
+        if not rows:
+            return
+        now = int(time.time())
+        for row in rows:
+            row = tuple(row) + (now,)
+            self._index(row)
+            self._dirty_rows[row[0]] = row
+        self._schedule_flush()
+
+    def _lookup(self, entity_id):
+        row = self._rows.get(entity_id)
+        return (row[0], row[1]) if row is not None else None
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._lookup(self._by_phone.get(phone))
+
+    def get_entity_rows_by_username(self, username):
+        return self._lookup(self._by_username.get(username))
+
+    def get_entity_rows_by_name(self, name):
+        return self._lookup(self._by_name.get(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._lookup(id)
+        for peer_id in (utils.get_peer_id(PeerUser(id)), utils.get_peer_id(PeerChat(id)),
+                        utils.get_peer_id(PeerChannel(id))):
+            result = self._lookup(peer_id)
+            if result is not None:
+                return result
+        return None
+
+    # Состояние обновлений: тоже в памяти
+
+    def get_update_state(self, entity_id):
+        return self._states.get(entity_id)
+
+    def set_update_state(self, entity_id, state):
+        self._states[entity_id] = self._dirty_states[entity_id] = state
+        self._schedule_flush()
+
+    def get_update_states(self):
+        return list(self._states.items())
+
+    # Запись на диск
+
+    def _take_changes(self):
+        rows, states = list(self._dirty_rows.values()), list(self._dirty_states.items())
+        self._dirty_rows, self._dirty_states = {}, {}
+        return rows, states
+
+    def _write(self, rows, states):
+        """Пишет пачку и фиксирует ее (в фоновом потоке или синхронно из save/close)"""
+        with self._lock:
+            cursor = self._cursor()
+            try:
+                if rows:
+                    cursor.executemany("insert or replace into entities values (?,?,?,?,?,?)", rows)
+                if states:
+                    cursor.executemany(
+                        "insert or replace into update_state values (?,?,?,?,?)",
+                        [(entity_id, state.pts, state.qts, state.date.timestamp(), state.seq)
+                         for entity_id, state in states]
+                    )
+                self._conn.commit()
+            finally:
+                cursor.close()
+
+    def _schedule_flush(self):
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне событийного цикла изменения дождутся save() или close()
+            return
+        self._flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Сбрасывает изменения раз в flush_interval, пока они появляются"""
+        while self._dirty_rows or self._dirty_states:
+            await asyncio.sleep(self.flush_interval)
+            rows, states = self._take_changes()
+            if not rows and not states:
+                continue
+            try:
+                await asyncio.to_thread(self._write, rows, states)
+            except Exception as e:
+                logger.warning("Не удалось записать сессию %s: %s: %s", self.filename, type(e).__name__, e)
+                # Вернем несохраненное, не затирая более свежие изменения
+                for row in rows:
+                    self._dirty_rows.setdefault(row[0], row)
+                for entity_id, state in states:
+                    self._dirty_states.setdefault(entity_id, state)
+                return
+
+    def save(self):
+        # Telethon вызывает save() при подключении, отключении и раз в минуту — фиксируем все накопленное
+        self._write(*self._take_changes())
+
+    def close(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        if self._conn is not None:
+            self.save()
+        with self._lock:
+            super().close()
+
+    # Авторизация и DC: сразу на диск
+
+    def _update_session_table(self):
+        with self._lock:
+            super()._update_session_table()
+            self._conn.commit()
+
+    def _execute(self, stmt, *values):
+        with self._lock:
+            return super()._execute(stmt, *values)
@@ -0,0 +1,295 @@
+# bulk.py — массовые отчеты: список каналов файлом, чекпоинты, результат в CSV/XLSX
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from utils.post_store import POST_STORE_PATH, months_between
+from utils.report_jobs import ReportJob
+from utils.report_stats import ChannelStats
+
+# Сколько каналов можно прислать за раз и сколько из них считается одновременно
+BULK_MAX_CHANNELS = int(os.getenv("BULK_MAX_CHANNELS", "300"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+
+# Максимальный размер файла со списком каналов (байт)
+BULK_MAX_FILE_SIZE = 1024 * 1024
+
+BULK_FORMATS = ("csv", "xlsx")
+
+# Прерванные отчеты старше стольких дней после перезапуска не продолжаются
+BULK_RESUME_DAYS = 7
+
+# Колонки результата (ключи статистики ChannelStats.as_dict)
+STATS_COLUMNS = [
+    'total_posts', 'total_views', 'avg_views',
+    'total_reactions', 'avg_reactions', 'total_comments', 'avg_comments',
+    'total_forwards', 'avg_forwards',
+    'coverage_per_reaction', 'coverage_per_forward', 'coverage_per_comment',
+    'engagement_rate', 'p50_views', 'p90_views', 'p99_views'
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_runs (
+    run_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    channels TEXT NOT NULL,
+    first_year INTEGER NOT NULL,
+    first_month INTEGER NOT NULL,
+    last_year INTEGER NOT NULL,
+    last_month INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS bulk_results (
+    run_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    months TEXT NOT NULL,
+    error TEXT,
+    PRIMARY KEY (run_id, channel)
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def read_channel_file(data):
+    """
+    Записи каналов из загруженного файла (.txt или .csv)
+
+    Берется первая колонка каждой строки; пустые строки, комментарии (#)
+    и заголовок channel/канал пропускаются.
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    dialect = csv.excel_tab if "\t" in text and "," not in text else csv.excel
+    entries = []
+    for row in csv.reader(io.StringIO(text), dialect):
+        cells = [cell.strip() for cell in row if cell.strip()]
+        if not cells or cells[0].startswith("#"):
+            continue
+        if cells[0].lower() in ("channel", "channels", "канал", "каналы"):
+            continue
+        entries.append(cells[0])
+    return entries
+
+
+class BulkRun:
+    """Массовый отчет: каналы, период (first..last, пары (year, month)) и формат результата"""
+
+    def __init__(self, run_id, user_id, chat_id, channels, first, last, fmt):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.channels = channels
+        self.first = first
+        self.last = last
+        self.fmt = fmt
+
+    @property
+    def months(self):
+        return months_between(self.first, self.last)
+
+
+class BulkStore:
+    """
+    Чекпоинты массовых отчетов (SQLite, та же база, что у хранилища постов)
+
+    Результат каждого канала сохраняется сразу после его подсчета. Если
+    выгрузка прервалась (перезапуск бота, ошибка), повторный запуск того же
+    отчета считает только оставшиеся каналы.
+    """
+
+    def __init__(self, path=POST_STORE_PATH):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    @staticmethod
+    def run_id(user_id, channels, first, last, fmt):
+        """Один и тот же запрос пользователя — один и тот же id: так находится прерванная выгрузка"""
+        key = json.dumps([user_id, channels, first, last, fmt])
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def open_run(self, user_id, chat_id, channels, first, last, fmt):
+        """
+        Начинает массовый отчет или продолжает прерванный такой же
+
+        Завершенный ранее отчет начинается заново: текущий месяц мог измениться.
+        """
+        run_id = self.run_id(user_id, channels, first, last, fmt)
+        row = self.conn.execute("SELECT finished FROM bulk_runs WHERE run_id = ?", (run_id,)).fetchone()
+        with self.conn:
+            if row is not None and row[0]:
+                self.conn.execute("DELETE FROM bulk_results WHERE run_id = ?", (run_id,))
+            self.conn.execute(
+                "INSERT INTO bulk_runs (run_id, user_id, chat_id, channels, first_year, first_month, "
+                "last_year, last_month, format, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id) DO UPDATE SET "
+                "chat_id = excluded.chat_id, created_at = excluded.created_at, finished = 0",
+                (run_id, user_id, chat_id, json.dumps(channels), *first, *last, fmt, int(time.time()))
+            )
+        return BulkRun(run_id, user_id, chat_id, channels, first, last, fmt)
+
+    def unfinished_runs(self):
+        """Прерванные массовые отчеты (для продолжения после перезапуска)"""
+        cutoff = int(time.time() - BULK_RESUME_DAYS * 86400)
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM bulk_results WHERE run_id IN (SELECT run_id FROM bulk_runs WHERE created_at < ?)",
+                (cutoff,)
+            )
+            self.conn.execute("DELETE FROM bulk_runs WHERE created_at < ?", (cutoff,))
+        rows = self.conn.execute(
+            "SELECT run_id, user_id, chat_id, channels, first_year, first_month, last_year, last_month, format "
+            "FROM bulk_runs WHERE finished = 0 ORDER BY created_at"
+        ).fetchall()
+        return [
+            BulkRun(run_id, user_id, chat_id, json.loads(channels), (first_year, first_month),
+                    (last_year, last_month), fmt)
+            for run_id, user_id, chat_id, channels, first_year, first_month, last_year, last_month, fmt in rows
+        ]
+
+    def done_channels(self, run_id):
+        """Уже посчитанные каналы: {channel: error}"""
+        return dict(self.conn.execute("SELECT channel, error FROM bulk_results WHERE run_id = ?", (run_id,)))
+
+    def save_result(self, run_id, channel, months, error):
+        """months — {(year, month): stats}"""
+        encoded = json.dumps([[year, month, stats] for (year, month), stats in months.items()])
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO bulk_results (run_id, channel, months, error) VALUES (?, ?, ?, ?)",
+                (run_id, channel, encoded, error)
+            )
+
+    def iter_results(self, run_id, channels):
+        """Результаты в порядке channels: (channel, {(year, month): stats}, error)"""
+        for channel in channels:
+            row = self.conn.execute(
+                "SELECT months, error FROM bulk_results WHERE run_id = ? AND channel = ?", (run_id, channel)
+            ).fetchone()
+            if row is None:
+                yield channel, {}, "не обработан"
+                continue
+            months = {(year, month): stats for year, month, stats in json.loads(row[0])}
+            yield channel, months, row[1]
+
+    def finish(self, run_id):
+        with self.conn:
+            self.conn.execute("UPDATE bulk_runs SET finished = 1 WHERE run_id = ?", (run_id,))
+            self.conn.execute("DELETE FROM bulk_results WHERE run_id = ?", (run_id,))
+
+
+class BulkJob(ReportJob):
+    """Задание на массовый отчет: в сообщении — счетчик каналов вместо списка"""
+
+    def __init__(self, run, processing_msg, title, run_job, cost=1):
+        super().__init__(run.user_id, processing_msg, title, run.channels, run_job, cost=cost)
+        self.bulk_run = run
+        self.errors = 0
+
+    def render(self):
+        if self.position > 0:
+            return super().render()
+        done = sum(1 for _, finished in self.progress.values() if finished)
+        errors = f" (ошибок: {self.errors})" if self.errors else ""
+        return (
+            f"🔄 {self.title}\n\n"
+            f"Готово каналов: {done} из {len(self.channels)}{errors}\n"
+            "Результат придет файлом."
+        )
+
+
+async def run_bulk(job, scan):
+    """
+    Считает каналы массового отчета, которых еще нет в чекпоинтах
+
+    Каналы идут через ограниченный пул (BULK_CONCURRENCY) — внутри каждый
+    сканируется через scan(channels, first, last, progress) (см.
+    handlers.generate_range_report_for_channels). Результат канала
+    сохраняется сразу, поэтому прерванная выгрузка продолжится с того же места.
+    """
+    run = job.bulk_run
+    done = bulk_store.done_channels(run.run_id)
+    for channel, error in done.items():
+        job.set_progress(channel, 0, done=True)
+        job.errors += error is not None
+    todo = asyncio.Queue()
+    for channel in run.channels:
+        if channel not in done:
+            todo.put_nowait(channel)
+    if done:
+        logger.info("Массовый отчет %s: продолжаем, готово %s из %s", run.run_id, len(done), len(run.channels))
+
+    async def worker():
+        while not todo.empty():
+            channel = todo.get_nowait()
+            try:
+                per_month, totals = await scan([channel], run.first, run.last, progress=job.set_progress)
+                months, error, posts = per_month[channel], totals[channel].get('error'), totals[channel]['total_posts']
+            except Exception as e:
+                months, error, posts = {}, f"{type(e).__name__}: {e}", 0
+            if error is not None:
+                job.errors += 1
+                logger.warning("Массовый отчет %s: %s: %s", run.run_id, channel, error)
+            bulk_store.save_result(run.run_id, channel, months, error)
+            job.set_progress(channel, posts, done=True)
+
+    await asyncio.gather(*(worker() for _ in range(min(BULK_CONCURRENCY, todo.qsize()))))
+
+
+def _rows(run):
+    """Строки результата: по строке на канал и месяц, для нескольких месяцев — еще итог"""
+    months = run.months
+    for channel, channel_months, error in bulk_store.iter_results(run.run_id, run.channels):
+        periods = [(f"{year}-{month:02d}", channel_months.get((year, month))) for year, month in months]
+        if len(months) > 1 and error is None:
+            periods.append(("итого", _total(channel_months.values())))
+        for period, stats in periods:
+            stats = stats or {}
+            yield [channel, period] + [stats.get(column, "") for column in STATS_COLUMNS] + [error or ""]
+
+
+def _total(stats_list):
+    total = ChannelStats()
+    for stats in stats_list:
+        total.merge(ChannelStats.from_dict(stats))
+    return total.as_dict()
+
+
+def write_result(run, path):
+    """Пишет результат массового отчета в CSV или XLSX (run.fmt)"""
+    header = ["channel", "period"] + STATS_COLUMNS + ["error"]
+    if run.fmt == "xlsx":
+        # openpyxl нужен только для XLSX — импортируем по требованию
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("report")
+        sheet.append(header)
+        for row in _rows(run):
+            sheet.append(row)
+        workbook.save(path)
+        return
+
+    # utf-8-sig — чтобы Excel сразу открыл кириллицу
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(_rows(run))
+
+
+bulk_store = BulkStore()
@@ -0,0 +1,171 @@
+# entity_resolver.py — кэш разрешения ссылок на каналы перед client.get_entity
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from telethon import utils
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+# Где хранить разрешенные каналы между перезапусками и сколько им доверять
+ENTITY_CACHE_PATH = os.getenv("ENTITY_CACHE_PATH", os.getenv("POST_STORE_PATH", "posts.db"))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", str(24 * 3600)))
+
+# Ошибки Telegram, после которых peer из кэша считается устаревшим (access_hash, пересозданный канал)
+STALE_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    account TEXT NOT NULL,
+    key TEXT NOT NULL,
+    peer_type TEXT NOT NULL,
+    peer_id INTEGER NOT NULL,
+    access_hash INTEGER NOT NULL DEFAULT 0,
+    resolved_at INTEGER NOT NULL,
+    PRIMARY KEY (account, key)
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+_LINK_PREFIX = re.compile(r"^(?:https?://)?(?:www\.)?(?:t|telegram)\.(?:me|dog)/", re.IGNORECASE)
+
+
+def normalize_channel_link(channel_link):
+    """
+    Приводит ссылку на канал к единому ключу
+
+    @name, t.me/name, https://t.me/name и https://t.me/name/123 дают "name".
+    Пригласительные ссылки (joinchat/..., +...) сохраняют регистр хэша.
+    """
+    link = channel_link.strip()
+    link = _LINK_PREFIX.sub("", link)
+    link = link.split("?", 1)[0].strip("/")
+
+    if link.startswith("+") or link.lower().startswith("joinchat/"):
+        return link
+
+    link = link.lstrip("@").split("/", 1)[0]
+    return link.lower()
+
+
+def _peer_to_row(peer):
+    if isinstance(peer, InputPeerChannel):
+        return "channel", peer.channel_id, peer.access_hash
+    if isinstance(peer, InputPeerUser):
+        return "user", peer.user_id, peer.access_hash
+    if isinstance(peer, InputPeerChat):
+        return "chat", peer.chat_id, 0
+    return None
+
+
+def _row_to_peer(peer_type, peer_id, access_hash):
+    if peer_type == "channel":
+        return InputPeerChannel(peer_id, access_hash)
+    if peer_type == "user":
+        return InputPeerUser(peer_id, access_hash)
+    return InputPeerChat(peer_id)
+
+
+class EntityResolver:
+    """
+    Разрешает ссылки на каналы во input peer с кэшированием
+
+    Кэш двухуровневый: в памяти (с TTL) и в SQLite, чтобы после перезапуска
+    не тратить на популярные каналы лимитированный ResolveUsername.
+    Одновременные запросы одного и того же канала разделяют один вызов get_entity.
+    access_hash привязан к аккаунту, поэтому кэш ведется отдельно по account.
+    """
+
+    def __init__(self, client, account="telethon", path=ENTITY_CACHE_PATH, ttl=ENTITY_CACHE_TTL):
+        self.client = client
+        self.account = account
+        self.path = path
+        self.ttl = ttl
+        self._cache = {}
+        self._inflight = {}
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _load(self, key):
+        row = self.conn.execute(
+            "SELECT peer_type, peer_id, access_hash, resolved_at FROM entities "
+            "WHERE account = ? AND key = ?",
+            (self.account, key)
+        ).fetchone()
+        if row is None or row[3] + self.ttl < time.time():
+            return None
+        return _row_to_peer(row[0], row[1], row[2]), row[3] + self.ttl
+
+    def _save(self, key, peer):
+        row = _peer_to_row(peer)
+        if row is None:
+            return
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entities (account, key, peer_type, peer_id, access_hash, resolved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.account, key, *row, int(time.time()))
+            )
+
+    async def _resolve_remote(self, key, channel_link):
+        entity = await self.client.get_entity(channel_link)
+        peer = utils.get_input_peer(entity)
+        self._cache[key] = (peer, time.time() + self.ttl)
+        self._save(key, peer)
+        return peer
+
+    async def resolve(self, channel_link):
+        """Возвращает input peer канала"""
+        key = normalize_channel_link(channel_link)
+
+        cached = self._cache.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        stored = self._load(key)
+        if stored:
+            self._cache[key] = stored
+            return stored[0]
+
+        # Если этот канал уже разрешается — ждем тот же запрос
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve_remote(key, channel_link))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def retry_stale(self, channel_link, attempt):
+        """
+        Выполняет attempt() — запрос, который сам разрешает канал через resolve
+
+        Если Telegram отверг peer канала (STALE_PEER_ERRORS), кэш канала
+        сбрасывается и запрос повторяется один раз: канал разрешится заново
+        через get_entity, а не будет отказывать до конца TTL.
+        """
+        try:
+            return await attempt()
+        except STALE_PEER_ERRORS as e:
+            logger.warning("%s: peer из кэша не подошел (%s) — разрешаем канал заново",
+                           channel_link, type(e).__name__)
+            self.invalidate(channel_link)
+            return await attempt()
+
+    def invalidate(self, channel_link):
+        """Забывает канал (например, если access_hash перестал подходить)"""
+        key = normalize_channel_link(channel_link)
+        self._cache.pop(key, None)
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM entities WHERE account = ? AND key = ?", (self.account, key)
+            )
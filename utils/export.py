@@ -0,0 +1,87 @@
+# export.py — потоковая выгрузка постов в сжатый CSV/JSONL
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+
+from utils.message_parser import ChannelDone, iter_range_posts
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Сколько строк копить перед записью в файл
+EXPORT_CHUNK_SIZE = 1000
+
+# Как часто (в постах) сообщать о прогрессе канала
+EXPORT_PROGRESS_EVERY = 100
+
+# Лимит Bot API на размер отправляемого файла
+EXPORT_MAX_UPLOAD = 50 * 1024 * 1024
+
+# Колонки выгрузки (атрибуты Post)
+EXPORT_COLUMNS = ["channel", "message_id", "date", "views", "reactions_count", "comments_count", "forwards_count"]
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _encode_jsonl(rows):
+    return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+def _write(f, encode, rows):
+    f.write(encode(rows))
+
+
+async def export_posts(channels, first, last, fmt, path, progress=None):
+    """
+    Выгружает посты каналов за месяцы first..last в файл path (gzip)
+
+    Посты идут из iter_range_posts прямо в файл пачками по EXPORT_CHUNK_SIZE
+    строк: в памяти — только текущая пачка и ограниченная очередь потока,
+    сколько бы постов ни было в диапазоне. Сжатие и запись идут в потоке,
+    чтобы не задерживать событийный цикл. Порядок постов между каналами
+    не определен.
+
+    Returns:
+        ({channel: число постов}, {channel: ошибка}) — ошибка для каналов, которые собрать не удалось
+    """
+    encode = _encode_jsonl if fmt == "jsonl" else _encode_csv
+    counts = dict.fromkeys(channels, 0)
+    errors = {}
+    chunk = []
+
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            _write(f, _encode_csv, [EXPORT_COLUMNS])
+
+        async for channel, post in iter_range_posts(channels, first, last):
+            if isinstance(post, ChannelDone):
+                if post.error is not None:
+                    errors[channel] = f"{type(post.error).__name__}: {post.error}"
+                if progress:
+                    progress(channel, counts[channel], True)
+                continue
+
+            chunk.append([
+                channel, post.message_id, post.raw_date.isoformat(), post.views,
+                post.reactions_count, post.comments_count, post.forwards_count
+            ])
+            counts[channel] += 1
+            if progress and counts[channel] % EXPORT_PROGRESS_EVERY == 0:
+                progress(channel, counts[channel], False)
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                await asyncio.to_thread(_write, f, encode, chunk)
+                chunk = []
+
+        if chunk:
+            await asyncio.to_thread(_write, f, encode, chunk)
+
+    logger.info("Выгружено постов: %s в %s", sum(counts.values()), path)
+    return counts, errors
@@ -1,209 +1,679 @@
 # message_parser.py — оптимизированный парсинг сообщений
-from telethon_client import client
+from telethon_client import client_pool
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import asyncio
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetMessagesViewsRequest
+
+from utils import metrics
+from utils.post_store import post_store, month_bounds, months_between
+from utils.posts import Post, to_timestamp
+from utils.scheduler import run_bounded
 
 EMPTY_POST_TEXTS = {"buffet", "", " ", "\n", "\t", "null", "none"}
 
+# Размер пачки постов при записи в хранилище и длина очереди потока постов
+STORE_CHUNK_SIZE = 500
+STREAM_QUEUE_SIZE = 1000
 
-async def get_monthly_messages(channel_links, year, month):
-    """
-    Оптимизированная функция для сбора постов за конкретный месяц
+# Сколько сообщений Telethon запрашивает за один вызов истории
+HISTORY_PAGE_SIZE = 100
 
-    Args:
-        channel_links: список ссылок на каналы
-        year: год
-        month: месяц (1-12)
-    """
-    all_messages = []
+# Сколько id постов помещается в один запрос счетчиков (ограничение Telegram)
+COUNTERS_BATCH_SIZE = 100
 
-    # Создаем границы месяца
-    start_date = datetime(year, month, 1)
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1)
-    else:
-        end_date = datetime(year, month + 1, 1)
+# У постов старше стольких дней при обновлении счетчиков реакции не запрашиваются (только просмотры и пересылки)
+REFRESH_REACTIONS_DAYS = int(os.getenv("REFRESH_REACTIONS_DAYS", "7"))
 
-    print(f"[OPTIMIZED] Собираем посты за период: {start_date} - {end_date}")
+# Массовый режим через takeout-сессию: off (по умолчанию), auto или always.
+# В режиме auto он включается для длинных диапазонов и больших каналов.
+TAKEOUT_MODE = os.getenv("TAKEOUT_MODE", "off").lower()
+TAKEOUT_MIN_MONTHS = int(os.getenv("TAKEOUT_MIN_MONTHS", "6"))
+TAKEOUT_MIN_MESSAGES = int(os.getenv("TAKEOUT_MIN_MESSAGES", "100000"))
 
-    for channel_link in channel_links:
-        channel_link = channel_link.strip()
-        try:
-            print(f"[OPTIMIZED] Получаем канал: {channel_link}")
-            channel = await client.get_entity(channel_link)
+logger = logging.getLogger(__name__)
 
-            collected_in_channel = 0
-            skipped_old = 0
-            skipped_new = 0
 
-            # ПРОБЛЕМА: мы запрашиваем фиксированное количество сообщений (1000)
-            # РЕШЕНИЕ: используем offset_date для начала сбора с нужной даты
-            print(f"[OPTIMIZED] Запрашиваем сообщения...")
+class ChannelDeadlineError(Exception):
+    """Канал не успел собраться за отведенное время (iter_range_posts, deadline)"""
 
-            # Собираем сообщения БЕЗ лимита, но с фильтрацией по дате
-            async for message in client.iter_messages(channel, limit=None):
-                # Пропускаем удаленные сообщения
-                if hasattr(message, 'deleted') and message.deleted:
-                    continue
+    def __init__(self, deadline):
+        super().__init__(f"не уложился в {deadline:g} с, данные неполные")
+        self.deadline = deadline
 
-                # Пропускаем служебные сообщения
-                if hasattr(message, 'action') and message.action:
-                    continue
 
-                # Проверяем дату сообщения
-                message_date = message.date.replace(tzinfo=None)
+class StaleCountersError(Exception):
+    """Счетчики постов, сохраненных раньше, обновить не удалось — в статистике они прежние"""
 
-                # Если сообщение новее конца месяца - пропускаем
-                if message_date >= end_date:
-                    skipped_new += 1
-                    continue
+    def __init__(self, error):
+        super().__init__(f"счетчики ранее сохраненных постов не обновлены ({type(error).__name__})")
+        self.error = error
 
-                # Если сообщение старше начала месяца - ПРЕРЫВАЕМ цикл
-                if message_date < start_date:
-                    skipped_old += 1
-                    break  # Все последующие сообщения будут еще старше
 
-                # Получаем количество комментариев
-                comments_count = 0
-                if hasattr(message, 'replies') and message.replies:
-                    comments_count = message.replies.replies
+class ChannelDone:
+    """Маркер в потоке iter_monthly_posts: канал обработан (error — если с ошибкой)"""
 
-                # Получаем количество реакций
-                reactions_count = 0
-                if hasattr(message, 'reactions') and message.reactions:
-                    reactions_count = sum(reaction.count for reaction in message.reactions.results)
+    __slots__ = ("error",)
 
-                # Получаем количество пересылок
-                forwards_count = 0
-                if hasattr(message, 'forwards'):
-                    forwards_count = message.forwards or 0
+    def __init__(self, error=None):
+        self.error = error
 
-                # Фильтр пустых постов
-                text = message.message or ""
-                stripped_text = text.strip().lower()
 
-                # Проверяем, является ли текст пустым
-                is_empty_text = (stripped_text in EMPTY_POST_TEXTS) and (
-                        comments_count == 0 and reactions_count == 0)
+def _message_counters(message):
+    """Возвращает (комментарии, реакции, пересылки) для сообщения"""
+    # Получаем количество комментариев
+    comments_count = 0
+    if hasattr(message, 'replies') and message.replies:
+        comments_count = message.replies.replies
 
-                # Также считаем пустым постом, если текст пустой и нет взаимодействий
-                is_empty_interaction = (not stripped_text and comments_count == 0 and reactions_count == 0)
+    # Получаем количество реакций
+    reactions_count = 0
+    if hasattr(message, 'reactions') and message.reactions:
+        reactions_count = sum(reaction.count for reaction in message.reactions.results)
 
-                if is_empty_text or is_empty_interaction:
-                    continue
+    # Получаем количество пересылок
+    forwards_count = 0
+    if hasattr(message, 'forwards'):
+        forwards_count = message.forwards or 0
 
-                # Сохраняем данные сообщения
-                message_data = {
-                    "channel": channel_link,
-                    "text": text,
-                    "date": message_date.strftime("%Y-%m-%d %H:%M:%S"),
-                    "views": message.views or 0,
-                    "comments_count": comments_count,
-                    "reactions_count": reactions_count,
-                    "forwards_count": forwards_count,
-                    "message_id": message.id,
-                    "raw_date": message_date
-                }
-
-                all_messages.append(message_data)
-                collected_in_channel += 1
-
-                # Выводим прогресс каждые 10 сообщений
-                if collected_in_channel % 10 == 0:
-                    print(f"[OPTIMIZED] {channel_link}: собрано {collected_in_channel} постов")
-
-            print(f"[OPTIMIZED] Канал {channel_link}:")
-            print(f"  • Собрано: {collected_in_channel}")
-            print(f"  • Пропущено (новые): {skipped_new}")
-            print(f"  • Пропущено (старые): {skipped_old}")
-
-        except Exception as e:
-            print(f"[OPTIMIZED] Ошибка при получении канала {channel_link}: {type(e).__name__}: {e}")
-            continue
+    return comments_count, reactions_count, forwards_count
 
-    # Сортируем по дате (новые сначала)
-    all_messages.sort(key=lambda x: x['raw_date'], reverse=True)
 
-    print(f"[OPTIMIZED] Всего собрано постов: {len(all_messages)}")
-    return all_messages
+def _is_service_message(message):
+    """Удаленные и служебные сообщения в статистику не попадают"""
+    if hasattr(message, 'deleted') and message.deleted:
+        return True
+    if hasattr(message, 'action') and message.action:
+        return True
+    return False
+
+
+def _is_empty_post(text, comments_count, reactions_count):
+    """Фильтр пустых постов"""
+    stripped_text = text.strip().lower()
+
+    # Проверяем, является ли текст пустым
+    is_empty_text = (stripped_text in EMPTY_POST_TEXTS) and (
+            comments_count == 0 and reactions_count == 0)
 
+    # Также считаем пустым постом, если текст пустой и нет взаимодействий
+    is_empty_interaction = (not stripped_text and comments_count == 0 and reactions_count == 0)
 
-async def get_last_messages(channel_links, limit=0, days=0):
+    return is_empty_text or is_empty_interaction
+
+
+async def _wants_takeout(account, channel, months, min_id):
+    """Нужен ли массовый режим для сканирования (см. TAKEOUT_MODE)"""
+    if TAKEOUT_MODE == "always":
+        return True
+    if TAKEOUT_MODE != "auto" or min_id:
+        # Догрузка новых постов незавершенного месяца всегда небольшая
+        return False
+    if len(months) >= TAKEOUT_MIN_MONTHS:
+        return True
+    # limit=0 возвращает только общее число сообщений канала — один дешевый запрос
+    history = await account.client.get_messages(channel, limit=0)
+    return (history.total or 0) >= TAKEOUT_MIN_MESSAGES
+
+
+@asynccontextmanager
+async def _history_client(account, channel_link, months, state, min_id):
     """
-    Универсальная функция для обратной совместимости
+    Клиент для сканирования истории: takeout-клиент аккаунта в массовом режиме или обычный
+
+    Решение принимается один раз на канал и сохраняется в state["bulk"],
+    чтобы повтор после FloodWait шел в том же режиме.
     """
-    # Если нужно собрать за определенный период (для старых вызовов)
-    if days > 0:
-        date_limit = datetime.utcnow() - timedelta(days=days)
+    if state["bulk"] is None:
+        channel = await account.resolver.resolve(channel_link)
+        state["bulk"] = await _wants_takeout(account, channel, months, min_id)
+
+    if not state["bulk"]:
+        yield account.client, False
+        return
+
+    async with account.takeout() as takeout:
+        if takeout is None:
+            # Telegram еще не разрешил takeout — сканируем обычными запросами
+            yield account.client, False
+        else:
+            logger.info("%s: массовый режим (takeout), пауза %.2f с", channel_link, account.takeout_wait)
+            yield takeout, True
+
+
+async def _fetch_channel_range(account, channel_link, months, state, sink, min_id=0, include_text=False,
+                               client=None, bulk=False):
+    """
+    Сканирует историю одного канала за месяцы months (подряд, по возрастанию)
+    через аккаунт, выданный пулом (telethon_client.client_pool)
+
+    Весь диапазон проходится за один проход по истории — от конца последнего
+    месяца к началу первого. Каждый подходящий пост сразу передается в sink
+    (корутина) и пачками сохраняется в локальное хранилище — список постов
+    не накапливается. Если задан min_id, из сети берутся только сообщения
+    новее него (остальное уже лежит в локальном хранилище).
+
+    state хранит прогресс между повторами после FloodWait: id последнего
+    просмотренного сообщения, чтобы продолжить листать историю с того же
+    места, а не с начала, id самого нового поста каждого месяца
+    (month_max_ids) и счетчики для сводки по каналу.
+
+    client — takeout-клиент в массовом режиме (bulk=True); страницы тогда
+    идут с адаптивной паузой account.takeout_wait. Фильтры постов те же.
+    """
+    logger.info("Получаем канал: %s (аккаунт %s)", channel_link, account.name)
+    client = client or account.client
+    wait_time = account.takeout_wait if bulk else None
+    started = time.perf_counter()
+    channel = await account.resolver.resolve(channel_link)
+
+    start_date, end_date = month_bounds(*months[0])[0], month_bounds(*months[-1])[1]
+    month_starts = [month_bounds(*year_month)[0] for year_month in months]
+    month_max_ids = state["month_max_ids"]
+    # История идет от новых к старым, поэтому текущий месяц только сдвигается назад
+    bucket = len(months) - 1
+
+    # Начинаем листать историю сразу с конца диапазона: offset_date
+    # отдает только сообщения старше end_date, поэтому стоимость
+    # запроса зависит от числа постов за период, а не от его давности.
+    # После FloodWait продолжаем с последнего просмотренного id.
+    if state["last_id"]:
+        logger.info("%s: продолжаем с id %s...", channel_link, state["last_id"])
+        history = client.iter_messages(
+            channel, limit=None, offset_id=state["last_id"], min_id=min_id, wait_time=wait_time
+        )
     else:
-        date_limit = None
+        logger.info("%s: запрашиваем сообщения до %s...", channel_link, end_date)
+        history = client.iter_messages(
+            channel, limit=None, offset_date=end_date, min_id=min_id, wait_time=wait_time
+        )
+
+    # Уровень логирования проверяем один раз, а не на каждом сообщении
+    debug = logger.isEnabledFor(logging.DEBUG)
+    fetched_before, kept_before = state["fetched"], state["kept"]
+    pending = []
+    try:
+        async for message in history:
+            state["fetched"] += 1
+            state["last_id"] = message.id
+
+            if bulk and state["fetched"] % HISTORY_PAGE_SIZE == 0:
+                # Страница прошла без FloodWait — можно чуть ускориться
+                account.takeout_paced(flood=False)
+                history.wait_time = account.takeout_wait
+
+            if _is_service_message(message):
+                continue
+
+            # Проверяем дату сообщения
+            message_date = message.date.replace(tzinfo=None)
+
+            # Если сообщение новее конца диапазона - пропускаем
+            # (при offset_date такого быть не должно, оставлено как страховка)
+            if message_date >= end_date:
+                state["skipped_new"] += 1
+                continue
+
+            # Если сообщение старше начала диапазона - ПРЕРЫВАЕМ цикл
+            if message_date < start_date:
+                state["skipped_old"] += 1
+                break  # Все последующие сообщения будут еще старше
+
+            comments_count, reactions_count, forwards_count = _message_counters(message)
+
+            text = message.message or ""
+            if _is_empty_post(text, comments_count, reactions_count):
+                continue
+
+            # Текст храним, только если его попросили
+            post = Post(
+                channel_link, message.id, to_timestamp(message_date), message.views or 0,
+                comments_count, reactions_count, forwards_count,
+                text if include_text else None
+            )
+            state["kept"] += 1
+            while bucket > 0 and message_date < month_starts[bucket]:
+                bucket -= 1
+            if message.id > month_max_ids.get(months[bucket], 0):
+                month_max_ids[months[bucket]] = message.id
+
+            pending.append(post)
+            if len(pending) >= STORE_CHUNK_SIZE:
+                post_store.save_posts(channel_link, pending)
+                pending = []
+
+            await sink(post)
+
+            if debug and state["kept"] % 10 == 0:
+                logger.debug("%s: собрано %s постов", channel_link, state["kept"])
+    except FloodWaitError:
+        if bulk:
+            account.takeout_paced(flood=True)
+        raise
+    finally:
+        # Уже отданные посты сохраняем даже при FloodWait/ошибке
+        if pending:
+            post_store.save_posts(channel_link, pending)
+
+        fetched = state["fetched"] - fetched_before
+        metrics.api_pages.inc(max(1, -(-fetched // HISTORY_PAGE_SIZE)), account=account.name)
+        metrics.messages_scanned.inc(fetched)
+        metrics.posts_kept.inc(state["kept"] - kept_before, source="api")
+        metrics.channel_fetch_seconds.observe(time.perf_counter() - started)
+
+    logger.info(
+        "Канал %s: получено из API %s, собрано %s, пропущено новых %s, старых %s",
+        channel_link, state["fetched"], state["kept"], state["skipped_new"], state["skipped_old"]
+    )
+
+
+async def _stream_stored(channel_link, year, month, sink, include_text, max_id=None):
+    """Отдает в sink посты месяца из локального хранилища; возвращает их число"""
+    start_date, end_date = month_bounds(year, month)
+    count = 0
+    for post in post_store.iter_posts(channel_link, start_date, end_date, include_text, max_id=max_id):
+        await sink(post)
+        count += 1
+    metrics.posts_kept.inc(count, source="store")
+    return count
+
+
+async def _collect_channel_range(channel_link, months, state, sink, include_text=False):
+    """
+    Посты канала за месяцы months: сначала из локального хранилища, из сети — только недостающие
+
+    Завершенные месяцы отдаются из хранилища без единого запроса к Telegram.
+    Остальные собираются одним проходом по истории — от самого нового
+    недостающего месяца до самого старого. Если нужны тексты, а месяц
+    сохранен без них, он собирается заново. У незавершенного месяца,
+    собранного раньше, из истории берутся только новые посты, а счетчики
+    сохраненных обновляются пачками по id (refresh_month_counters).
+    """
+    stored = {}
+    for year, month in months:
+        month_state = post_store.get_month(channel_link, year, month)
+        if month_state and include_text and not month_state[2]:
+            month_state = None
+        stored[(year, month)] = month_state
+
+    needed = [year_month for year_month in months if not (stored[year_month] and stored[year_month][1])]
+    span = months[months.index(needed[0]):months.index(needed[-1]) + 1] if needed else []
+
+    # После FloodWait run_bounded повторяет канал с тем же state — сохраненные месяцы уже отданы
+    if not state.get("stored_streamed"):
+        count = 0
+        for year, month in months:
+            if (year, month) not in span:
+                post_store.touch_month(channel_link, year, month)
+                count += await _stream_stored(channel_link, year, month, sink, include_text)
+        state["stored_streamed"] = True
+        if count:
+            logger.info("%s: %s постов из локального хранилища", channel_link, count)
+    if not span:
+        return
+
+    # Один незавершенный месяц, уже собранный раньше, — догружаем только новые посты
+    min_id = stored[span[0]][0] if len(span) == 1 and stored[span[0]] else 0
+    async with client_pool.acquire() as account:
+        async def fetch():
+            async with _history_client(account, channel_link, span, state, min_id) as (client, bulk):
+                await _fetch_channel_range(
+                    account, channel_link, span, state, sink, min_id=min_id, include_text=include_text,
+                    client=client, bulk=bulk
+                )
+
+        await account.resolver.retry_stale(channel_link, fetch)
+
+    refresh_error = None
+    if min_id:
+        # Просмотры и реакции сохраненных постов с прошлого сбора выросли — освежаем их
+        # (вне acquire: refresh_counters сам берет аккаунт из пула)
+        result = (await refresh_month_counters([channel_link], *span[0], max_id=min_id))[channel_link]
+        if isinstance(result, BaseException):
+            refresh_error = StaleCountersError(result)
+
+    now = datetime.utcnow()
+    for year, month in span:
+        # Месяц закончился — список его постов больше не изменится.
+        # Со старыми счетчиками завершенным его не отмечаем: иначе они застынут навсегда
+        complete = month_bounds(year, month)[1] <= now and refresh_error is None
+        post_store.mark_month(
+            channel_link, year, month, state["month_max_ids"].get((year, month), 0), complete,
+            with_text=include_text, full=not min_id
+        )
+
+    if min_id:
+        # Догрузили только новые посты, остальные берем из хранилища
+        count = await _stream_stored(channel_link, *span[0], sink, include_text, max_id=min_id)
+        logger.info("%s: %s постов из хранилища + %s из сети", channel_link, count, state["kept"])
+    if refresh_error is not None:
+        # Посты отданы, но канал помечается неполным, и его статистика не кэшируется
+        raise refresh_error
+
+
+async def iter_range_posts(channel_links, first, last, include_text=False, deadline=None):
+    """
+    Потоково отдает посты за месяцы от first до last (включительно) по мере их получения
 
-    all_messages = []
+    Каналы сканируются параллельно (см. utils.scheduler), FloodWait
+    приостанавливает только тот канал, на котором он случился. История
+    каждого канала проходится один раз за весь диапазон. Уже собранные
+    посты берутся из локального хранилища (utils.post_store).
 
-    for channel_link in channel_links:
-        channel_link = channel_link.strip()
+    Args:
+        first, last: месяцы (year, month)
+        deadline: сколько секунд дать каждому каналу с начала его сканирования
+            (паузы FloodWait входят); не успевший канал завершается
+            с ChannelDeadlineError, уже отданные посты остаются
+
+    Yields:
+        (channel_link, Post) — очередной пост канала;
+        (channel_link, ChannelDone) — канал полностью обработан
+        (ChannelDone.error — исключение, если канал собрать не удалось).
+        Порядок постов между каналами и месяцами не определен.
+    """
+    months = months_between(first, last)
+    start_date, end_date = month_bounds(*months[0])[0], month_bounds(*months[-1])[1]
+    logger.info("Собираем посты за период: %s - %s", start_date, end_date)
+
+    channel_links = [channel_link.strip() for channel_link in channel_links]
+    post_store.evict()
+
+    # Ограниченная очередь: если потребитель не успевает, сканирование притормаживает
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def make_factory(channel_link):
+        state = {
+            "last_id": 0, "fetched": 0, "kept": 0, "month_max_ids": {}, "skipped_new": 0, "skipped_old": 0,
+            "bulk": None
+        }
+
+        async def sink(post):
+            await queue.put((channel_link, post))
+
+        async def run():
+            if not deadline:
+                await _collect_channel_range(channel_link, months, state, sink, include_text)
+            else:
+                # Срок считается от первой попытки: повтор после FloodWait его не продлевает
+                loop = asyncio.get_running_loop()
+                state["deadline_at"] = state.get("deadline_at") or loop.time() + deadline
+                timeout = asyncio.timeout_at(state["deadline_at"])
+                try:
+                    async with timeout:
+                        await _collect_channel_range(channel_link, months, state, sink, include_text)
+                except TimeoutError:
+                    if not timeout.expired():
+                        raise
+                    raise ChannelDeadlineError(deadline) from None
+            await queue.put((channel_link, ChannelDone()))
+
+        return run
+
+    async def produce():
         try:
-            channel = await client.get_entity(channel_link)
+            results = await run_bounded(
+                [make_factory(channel_link) for channel_link in channel_links],
+                labels=channel_links,
+                flood_delay=client_pool.retry_delay
+            )
+            for channel_link, result in zip(channel_links, results):
+                if isinstance(result, BaseException):
+                    logger.warning("Ошибка при получении канала %s: %s: %s",
+                                   channel_link, type(result).__name__, result)
+                    await queue.put((channel_link, ChannelDone(result)))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+
+
+def iter_monthly_posts(channel_links, year, month, include_text=False):
+    """Поток постов за один месяц (см. iter_range_posts)"""
+    return iter_range_posts(channel_links, (year, month), (year, month), include_text)
+
+
+async def get_monthly_messages(channel_links, year, month, include_text=False):
+    """
+    Оптимизированная функция для сбора постов за конкретный месяц
 
-            collected = 0
-            request_limit = min(limit * 3, 1000) if limit > 0 else 500
+    Собирает весь поток iter_monthly_posts в список. Для статистики
+    лучше использовать iter_monthly_posts напрямую — без списка в памяти.
 
-            async for message in client.iter_messages(channel, limit=request_limit):
-                # Фильтры как в старой версии
-                if hasattr(message, 'deleted') and message.deleted:
-                    continue
-                if hasattr(message, 'action') and message.action:
-                    continue
+    Args:
+        channel_links: список ссылок на каналы
+        year: год
+        month: месяц (1-12)
+        include_text: сохранять ли текст постов (по умолчанию только счетчики)
+
+    Returns:
+        список Post (см. utils.posts), новые сначала
+    """
+    all_messages = [
+        post async for _, post in iter_monthly_posts(channel_links, year, month, include_text)
+        if isinstance(post, Post)
+    ]
+
+    # Сортируем по дате (новые сначала)
+    all_messages.sort(key=lambda post: post.timestamp, reverse=True)
+
+    logger.info("Всего собрано постов: %s", len(all_messages))
+    return all_messages
+
+
+async def _fetch_counters(account, channel, ids, reactions):
+    """
+    Свежие счетчики пачки постов одним запросом
+
+    reactions=True — channels.getMessages (сообщения целиком, с реакциями);
+    иначе messages.getMessagesViews (только просмотры, комментарии и
+    пересылки — ответ легче, реакции остаются прежними).
+
+    Returns:
+        ([(message_id, views, comments, reactions или None, forwards)], [id удаленных постов])
+    """
+    counters = []
+    deleted = []
+    if reactions:
+        messages = await account.client.get_messages(channel, ids=ids)
+        for message_id, message in zip(ids, messages):
+            if message is None or _is_service_message(message):
+                deleted.append(message_id)
+                continue
+            comments_count, reactions_count, forwards_count = _message_counters(message)
+            counters.append((message_id, message.views or 0, comments_count, reactions_count, forwards_count))
+        return counters, deleted
+
+    result = await account.client(GetMessagesViewsRequest(peer=channel, id=ids, increment=False))
+    for message_id, views in zip(ids, result.views):
+        if views.views is None:
+            # Telegram не вернул просмотры (например, пост удален) — оставляем как есть
+            continue
+        comments_count = views.replies.replies if views.replies else 0
+        counters.append((message_id, views.views, comments_count, None, views.forwards or 0))
+    return counters, deleted
+
+
+async def _refresh_channel_counters(channel_link, message_ids, reactions, state):
+    """Обновляет счетчики постов одного канала пачками; state["done"] — сколько id уже обработано"""
+    async with client_pool.acquire() as account:
+        async def refresh():
+            channel = await account.resolver.resolve(channel_link)
+            # После FloodWait (и после повторного разрешения канала) продолжаем с первой необработанной пачки
+            while state["done"] < len(message_ids):
+                ids = message_ids[state["done"]:state["done"] + COUNTERS_BATCH_SIZE]
+                counters, deleted = await _fetch_counters(account, channel, ids, reactions)
+                metrics.counter_requests.inc(account=account.name)
+                metrics.counters_refreshed.inc(len(counters))
+                post_store.update_counters(channel_link, counters, deleted)
+                state["done"] += len(ids)
+                state["updated"] += len(counters)
+
+        await account.resolver.retry_stale(channel_link, refresh)
+    return state["updated"]
+
+
+async def refresh_counters(channel_ids, reactions=True):
+    """
+    Обновляет просмотры, реакции, комментарии и пересылки уже сохраненных постов
 
-                # Фильтр по дате
-                if date_limit and message.date.replace(tzinfo=None) < date_limit:
+    Вместо повторного прохода по истории — запросы по COUNTERS_BATCH_SIZE id:
+    месяц канала на 3000 постов обновляется за 30 запросов. Обновленные
+    счетчики записываются в локальное хранилище; статистику по ним
+    надо пересчитать (кэш report_cache вызывающий сбрасывает сам).
+
+    Args:
+        channel_ids: {channel_link: [message_id, ...]}
+        reactions: обновлять ли реакции (см. _fetch_counters)
+
+    Returns:
+        {channel_link: число обновленных постов или исключение}
+    """
+    channel_links = list(channel_ids)
+    results = await run_bounded(
+        [
+            lambda link=channel_link, state={"done": 0, "updated": 0}: _refresh_channel_counters(
+                link, channel_ids[link], reactions, state
+            )
+            for channel_link in channel_links
+        ],
+        labels=channel_links,
+        flood_delay=client_pool.retry_delay
+    )
+    for channel_link, result in zip(channel_links, results):
+        if isinstance(result, BaseException):
+            logger.warning("Счетчики %s не обновлены: %s: %s", channel_link, type(result).__name__, result)
+    return dict(zip(channel_links, results))
+
+
+async def refresh_month_counters(channel_links, year, month, max_id=None):
+    """
+    Обновляет счетчики сохраненных постов каналов за месяц (см. refresh_counters)
+
+    Реакции набираются в первые дни после публикации, а просмотры растут
+    неделями: у постов старше REFRESH_REACTIONS_DAYS обновляются только
+    просмотры, комментарии и пересылки (messages.getMessagesViews — ответ
+    без сообщений целиком), у более новых — все счетчики.
+    max_id — только посты не новее этого id (например, без только что догруженных).
+
+    Returns:
+        {channel_link: число обновленных постов или исключение}
+    """
+    start_date, end_date = month_bounds(year, month)
+    cutoff = min(max(start_date, datetime.utcnow() - timedelta(days=REFRESH_REACTIONS_DAYS)), end_date)
+
+    results = dict.fromkeys(channel_links, 0)
+    for reactions, since, until in ((True, cutoff, end_date), (False, start_date, cutoff)):
+        channel_ids = {
+            channel_link: post_store.message_ids(channel_link, since, until, max_id=max_id)
+            for channel_link in channel_links
+        }
+        channel_ids = {channel_link: ids for channel_link, ids in channel_ids.items() if ids}
+        if not channel_ids:
+            continue
+        for channel_link, result in (await refresh_counters(channel_ids, reactions)).items():
+            # Ошибка любой части важнее числа обновленных постов
+            if not isinstance(results[channel_link], BaseException):
+                results[channel_link] = result if isinstance(result, BaseException) else results[channel_link] + result
+    return results
+
+
+def _last_request_limit(limit):
+    return min(limit * 3, 1000) if limit > 0 else 500
+
+
+def _last_message_post(message, channel_link, date_limit, include_text):
+    """Post для get_last_messages или None, если сообщение не подходит"""
+    # Фильтры как в старой версии
+    if _is_service_message(message):
+        return None
+
+    # Фильтр по дате
+    if date_limit and message.date.replace(tzinfo=None) < date_limit:
+        return None
+
+    comments_count, reactions_count, forwards_count = _message_counters(message)
+
+    text = message.message or ""
+    if _is_empty_post(text, comments_count, reactions_count):
+        return None
+
+    return Post(
+        channel_link, message.id, int(message.date.timestamp()), message.views or 0,
+        comments_count, reactions_count, forwards_count,
+        text if include_text else None
+    )
+
+
+async def _fetch_channel_last(channel_link, limit, date_limit, include_text):
+    """Собирает последние посты одного канала через аккаунт из пула"""
+    messages = []
+    fetched = 0
+    async with client_pool.acquire() as account:
+        async def fetch():
+            nonlocal fetched
+            channel = await account.resolver.resolve(channel_link)
+            async for message in account.client.iter_messages(channel, limit=_last_request_limit(limit)):
+                fetched += 1
+                post = _last_message_post(message, channel_link, date_limit, include_text)
+                if post is None:
                     continue
 
                 # Если достигли лимита
-                if limit > 0 and collected >= limit:
+                if limit > 0 and len(messages) >= limit:
                     break
+                messages.append(post)
 
-                # Получаем данные
-                comments_count = 0
-                if hasattr(message, 'replies') and message.replies:
-                    comments_count = message.replies.replies
-
-                reactions_count = 0
-                if hasattr(message, 'reactions') and message.reactions:
-                    reactions_count = sum(reaction.count for reaction in message.reactions.results)
+        try:
+            # Устаревший peer отказывает на первом же запросе — повтор не дублирует посты
+            await account.resolver.retry_stale(channel_link, fetch)
+        finally:
+            metrics.api_pages.inc(max(1, -(-fetched // HISTORY_PAGE_SIZE)), account=account.name)
+            metrics.messages_scanned.inc(fetched)
+            metrics.posts_kept.inc(len(messages), source="api")
 
-                forwards_count = 0
-                if hasattr(message, 'forwards'):
-                    forwards_count = message.forwards or 0
+    return messages
 
-                # Фильтр пустых постов
-                text = message.message or ""
-                stripped_text = text.strip().lower()
 
-                is_empty_text = (stripped_text in EMPTY_POST_TEXTS) and (
-                        comments_count == 0 and reactions_count == 0)
-                is_empty_interaction = (not stripped_text and comments_count == 0 and reactions_count == 0)
+async def get_last_messages(channel_links, limit=0, days=0, include_text=False):
+    """
+    Универсальная функция для обратной совместимости
+    """
+    # Если нужно собрать за определенный период (для старых вызовов)
+    if days > 0:
+        date_limit = datetime.utcnow() - timedelta(days=days)
+    else:
+        date_limit = None
 
-                if is_empty_text or is_empty_interaction:
-                    continue
+    all_messages = []
 
-                message_data = {
-                    "channel": channel_link,
-                    "text": text,
-                    "date": message.date.strftime("%Y-%m-%d %H:%M:%S"),
-                    "views": message.views or 0,
-                    "comments_count": comments_count,
-                    "reactions_count": reactions_count,
-                    "forwards_count": forwards_count,
-                    "message_id": message.id,
-                    "raw_date": message.date
-                }
-
-                all_messages.append(message_data)
-                collected += 1
-
-        except Exception as e:
-            print(f"[ERROR] Ошибка: {e}")
+    channel_links = [channel_link.strip() for channel_link in channel_links]
+    results = await run_bounded(
+        [lambda link=channel_link: _fetch_channel_last(link, limit, date_limit, include_text)
+         for channel_link in channel_links],
+        labels=channel_links,
+        flood_delay=client_pool.retry_delay
+    )
+
+    for channel_link, result in zip(channel_links, results):
+        if isinstance(result, BaseException):
+            logger.warning("Ошибка в канале %s: %s: %s", channel_link, type(result).__name__, result)
             continue
+        all_messages.extend(result)
 
-    return all_messages
\ No newline at end of file
+    return all_messages
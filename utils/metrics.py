@@ -0,0 +1,248 @@
+# metrics.py — счетчики и гистограммы конвейера и HTTP-эндпоинт в формате Prometheus
+import asyncio
+import bisect
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Адрес эндпоинта /metrics; METRICS_PORT=0 отключает его
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if not self.labelnames and self.kind != "histogram":
+            # Метрика без меток видна в выдаче сразу, со значением 0
+            self._values[()] = 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение (глубина очереди, число активных задач)"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (+ сумма и количество)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # Счетчики корзин без накопления + сумма + количество
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """Набор метрик, который отдается эндпоинтом /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Запуск
+ready = registry.register(Gauge(
+    "postspy_ready", "1 — бот запущен и получает обновления"
+))
+startup_seconds = registry.register(Gauge(
+    "postspy_startup_seconds", "Холодный старт: секунды от запуска до окончания этапа", ["stage"]
+))
+
+# Сбор постов
+api_pages = registry.register(Counter(
+    "postspy_api_pages_total", "Запросы страниц истории к Telegram (по 100 сообщений)", ["account"]
+))
+messages_scanned = registry.register(Counter(
+    "postspy_messages_scanned_total", "Сообщения, полученные из Telegram API"
+))
+posts_kept = registry.register(Counter(
+    "postspy_posts_kept_total", "Посты, прошедшие фильтры", ["source"]
+))
+channel_fetch_seconds = registry.register(Histogram(
+    "postspy_channel_fetch_seconds", "Время сканирования истории одного канала"
+))
+counter_requests = registry.register(Counter(
+    "postspy_counter_requests_total", "Запросы обновления счетчиков сохраненных постов (до 100 id)", ["account"]
+))
+counters_refreshed = registry.register(Counter(
+    "postspy_counters_refreshed_total", "Посты, у которых обновлены счетчики"
+))
+flood_waits = registry.register(Counter(
+    "postspy_flood_waits_total", "Полученные FloodWait", ["account"]
+))
+flood_wait_seconds = registry.register(Counter(
+    "postspy_flood_wait_seconds_total", "Суммарное время FloodWait, запрошенное Telegram", ["account"]
+))
+text_chunks = registry.register(Counter(
+    "postspy_text_chunks_total", "Пачки текстов постов, отправленные в пул процессов"
+))
+text_wait_seconds = registry.register(Histogram(
+    "postspy_text_wait_seconds", "Сколько отчет ждал текстовую аналитику после окончания сканирования канала"
+))
+prefetch_channels = registry.register(Counter(
+    "postspy_prefetch_channels_total", "Каналы, обработанные фоновой догрузкой", ["result"]
+))
+
+# Отчеты
+report_seconds = registry.register(Histogram(
+    "postspy_report_seconds", "Время от постановки отчета в очередь до ответа пользователю", ["status"]
+))
+report_queue_depth = registry.register(Gauge(
+    "postspy_report_queue_depth", "Отчеты, ожидающие свободного воркера"
+))
+reports_active = registry.register(Gauge(
+    "postspy_reports_active", "Отчеты, которые считаются прямо сейчас"
+))
+report_cost = registry.register(Histogram(
+    "postspy_report_cost_messages", "Оценка стоимости отчета: сообщений, которые придется получить из Telegram",
+    buckets=(100, 1000, 10000, 50000, 100000, 500000, 1000000)
+))
+report_rejections = registry.register(Counter(
+    "postspy_report_rejections_total", "Отклоненные запросы отчетов", ["reason"]
+))
+report_cache_lookups = registry.register(Counter(
+    "postspy_report_cache_lookups_total", "Обращения к кэшу статистики", ["result"]
+))
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки не нужны, но их надо дочитать
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else None
+        if path == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/ready":
+            # Проба готовности: 503, пока бот не запустился
+            status, body = ("200 OK", b"ready\n") if ready.get() else ("503 Service Unavailable", b"starting\n")
+            content_type = "text/plain; charset=utf-8"
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+            content_type = "text/plain; charset=utf-8"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug("Запрос к /metrics прерван: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Запускает эндпоинт /metrics (формат Prometheus) и пробу готовности /ready
+
+    Returns:
+        asyncio.Server или None, если METRICS_PORT=0
+    """
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,261 @@
+# post_store.py — локальное хранилище постов (SQLite), чтобы не качать завершенные месяцы повторно
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from utils.entity_resolver import normalize_channel_link
+from utils.posts import Post, to_timestamp
+
+# Файл базы и срок хранения месяцев, к которым давно не обращались
+POST_STORE_PATH = os.getenv("POST_STORE_PATH", "posts.db")
+POST_STORE_RETENTION_DAYS = int(os.getenv("POST_STORE_RETENTION_DAYS", "180"))
+
+# Как часто запускать очистку устаревших данных (секунды)
+EVICTION_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    channel TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    text TEXT,
+    views INTEGER NOT NULL DEFAULT 0,
+    comments_count INTEGER NOT NULL DEFAULT 0,
+    reactions_count INTEGER NOT NULL DEFAULT 0,
+    forwards_count INTEGER NOT NULL DEFAULT 0,
+    saved_at INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel, message_id)
+);
+CREATE INDEX IF NOT EXISTS posts_channel_date ON posts (channel, date);
+CREATE TABLE IF NOT EXISTS months (
+    channel TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    max_id INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    with_text INTEGER NOT NULL DEFAULT 1,
+    accessed_at INTEGER NOT NULL,
+    PRIMARY KEY (channel, year, month)
+);
+"""
+
+
+def channel_key(channel_link):
+    """Ключ канала в хранилище: @name, t.me/name и https://t.me/name — один канал"""
+    return normalize_channel_link(channel_link)
+
+
+def month_bounds(year, month):
+    """Границы месяца [start, end) в UTC без tzinfo"""
+    start_date = datetime(year, month, 1)
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1)
+    else:
+        end_date = datetime(year, month + 1, 1)
+    return start_date, end_date
+
+
+def months_between(first, last):
+    """Список месяцев (year, month) от first до last включительно"""
+    first_index = first[0] * 12 + first[1] - 1
+    last_index = last[0] * 12 + last[1] - 1
+    return [(index // 12, index % 12 + 1) for index in range(first_index, last_index + 1)]
+
+
+class PostStore:
+    """
+    Хранилище постов по ключу (канал, message_id)
+
+    Для каждого месяца канала запоминается id самого нового сохраненного
+    поста (max_id) и признак complete. Завершенный месяц отдается целиком
+    из базы, для незавершенного из сети догружаются только посты новее max_id.
+    with_text показывает, сохранены ли тексты всех постов месяца.
+    """
+
+    def __init__(self, path, retention_days):
+        self.path = path
+        self.retention_days = retention_days
+        self._conn = None
+        self._last_eviction = 0
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+            self._migrate(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _migrate(conn):
+        """Добавляет колонки, появившиеся после создания базы"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(months)")}
+        if "with_text" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE months ADD COLUMN with_text INTEGER NOT NULL DEFAULT 1")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(posts)")}
+        if "saved_at" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE posts ADD COLUMN saved_at INTEGER NOT NULL DEFAULT 0")
+
+    def get_month(self, channel_link, year, month):
+        """Возвращает (max_id, complete, with_text) или None, если месяц еще не собирался"""
+        row = self.conn.execute(
+            "SELECT max_id, complete, with_text FROM months WHERE channel = ? AND year = ? AND month = ?",
+            (channel_key(channel_link), year, month)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1]), bool(row[2])
+
+    def iter_posts(self, channel_link, start_date, end_date, include_text=False, max_id=None):
+        """
+        Посты канала за период [start_date, end_date), новые сначала
+
+        Строки читаются курсором по одной, весь месяц в память не загружается.
+        max_id ограничивает выборку постами не новее указанного id.
+        """
+        text_column = "text" if include_text else "NULL"
+        query = (
+            f"SELECT message_id, date, views, comments_count, reactions_count, forwards_count, {text_column} "
+            "FROM posts WHERE channel = ? AND date >= ? AND date < ?"
+        )
+        params = [channel_key(channel_link), to_timestamp(start_date), to_timestamp(end_date)]
+        if max_id is not None:
+            query += " AND message_id <= ?"
+            params.append(max_id)
+        query += " ORDER BY message_id DESC"
+
+        for row in self.conn.execute(query, params):
+            yield Post(channel_link, *row)
+
+    def message_ids(self, channel_link, start_date, end_date, max_id=None):
+        """id сохраненных постов канала за период [start_date, end_date), новые сначала (max_id — как в iter_posts)"""
+        query = "SELECT message_id FROM posts WHERE channel = ? AND date >= ? AND date < ?"
+        params = [channel_key(channel_link), to_timestamp(start_date), to_timestamp(end_date)]
+        if max_id is not None:
+            query += " AND message_id <= ?"
+            params.append(max_id)
+        query += " ORDER BY message_id DESC"
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def update_counters(self, channel_link, counters, deleted=()):
+        """
+        Обновляет счетчики уже сохраненных постов
+
+        counters — (message_id, views, comments_count, reactions_count, forwards_count);
+        reactions_count=None оставляет прежнее значение. deleted — id постов,
+        которых в канале больше нет: они удаляются из хранилища.
+        """
+        key = channel_key(channel_link)
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE posts SET views = ?, comments_count = ?, "
+                "reactions_count = COALESCE(?, reactions_count), forwards_count = ? "
+                "WHERE channel = ? AND message_id = ?",
+                [
+                    (views, comments_count, reactions_count, forwards_count, key, message_id)
+                    for message_id, views, comments_count, reactions_count, forwards_count in counters
+                ]
+            )
+            self.conn.executemany(
+                "DELETE FROM posts WHERE channel = ? AND message_id = ?",
+                [(key, message_id) for message_id in deleted]
+            )
+
+    def save_posts(self, channel_link, posts):
+        """Сохраняет (или обновляет) пачку постов канала"""
+        key = channel_key(channel_link)
+        saved_at = int(time.time())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO posts (channel, message_id, date, text, views, "
+                "comments_count, reactions_count, forwards_count, saved_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (channel, message_id) DO UPDATE SET "
+                "text = COALESCE(excluded.text, text), views = excluded.views, "
+                "comments_count = excluded.comments_count, reactions_count = excluded.reactions_count, "
+                "forwards_count = excluded.forwards_count, saved_at = excluded.saved_at",
+                [
+                    (key, post.message_id, post.timestamp, post.text, post.views,
+                     post.comments_count, post.reactions_count, post.forwards_count, saved_at)
+                    for post in posts
+                ]
+            )
+
+    def mark_month(self, channel_link, year, month, max_id, complete, with_text, full):
+        """
+        Обновляет состояние месяца после успешного сканирования
+
+        full=True означает, что месяц собран целиком (а не только новые посты),
+        и его with_text заменяет прежний.
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO months (channel, year, month, max_id, complete, with_text, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (channel, year, month) DO UPDATE SET "
+                "max_id = MAX(max_id, excluded.max_id), complete = excluded.complete, "
+                "with_text = CASE WHEN ? THEN excluded.with_text "
+                "ELSE MIN(with_text, excluded.with_text) END, "
+                "accessed_at = excluded.accessed_at",
+                (channel_key(channel_link), year, month, max_id, int(complete), int(with_text),
+                 int(time.time()), int(full))
+            )
+
+    def touch_month(self, channel_link, year, month):
+        """Отмечает обращение к месяцу (для политики хранения)"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE months SET accessed_at = ? WHERE channel = ? AND year = ? AND month = ?",
+                (int(time.time()), channel_key(channel_link), year, month)
+            )
+
+    def evict(self, force=False):
+        """
+        Удаляет месяцы (и их посты), к которым не обращались дольше срока хранения
+
+        Посты месяцев без записи в months (сканирование оборвалось до
+        mark_month) удаляются, если сохранены раньше того же срока: свежие
+        могут принадлежать сканированию, которое идет прямо сейчас.
+        """
+        now = time.time()
+        if not force and now - self._last_eviction < EVICTION_INTERVAL:
+            return 0
+        self._last_eviction = now
+
+        cutoff = int(now - self.retention_days * 86400)
+        stale = self.conn.execute(
+            "SELECT channel, year, month FROM months WHERE accessed_at < ?", (cutoff,)
+        ).fetchall()
+
+        with self.conn:
+            for key, year, month in stale:
+                start_date, end_date = month_bounds(year, month)
+                self.conn.execute(
+                    "DELETE FROM posts WHERE channel = ? AND date >= ? AND date < ?",
+                    (key, to_timestamp(start_date), to_timestamp(end_date))
+                )
+                self.conn.execute(
+                    "DELETE FROM months WHERE channel = ? AND year = ? AND month = ?",
+                    (key, year, month)
+                )
+            orphans = self.conn.execute(
+                "DELETE FROM posts WHERE saved_at < ? AND NOT EXISTS ("
+                "SELECT 1 FROM months WHERE months.channel = posts.channel "
+                "AND months.year = CAST(strftime('%Y', posts.date, 'unixepoch') AS INTEGER) "
+                "AND months.month = CAST(strftime('%m', posts.date, 'unixepoch') AS INTEGER))",
+                (cutoff,)
+            ).rowcount
+
+        if stale:
+            logger.info("Удалено устаревших месяцев: %s", len(stale))
+        if orphans:
+            logger.info("Удалено постов без записи о месяце: %s", orphans)
+        return len(stale)
+
+
+post_store = PostStore(POST_STORE_PATH, POST_STORE_RETENTION_DAYS)
@@ -0,0 +1,64 @@
+# posts.py — компактное представление собранного поста
+from datetime import datetime, timezone
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_timestamp(naive_utc):
+    """datetime в UTC без tzinfo -> unix timestamp"""
+    return int(naive_utc.replace(tzinfo=timezone.utc).timestamp())
+
+
+def from_timestamp(ts):
+    """unix timestamp -> datetime в UTC без tzinfo"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None)
+
+
+class Post:
+    """
+    Пост канала: только числовые поля, текст — по запросу
+
+    Вместо словаря на 9 ключей храним слоты; дата лежит как unix timestamp,
+    а raw_date/date вычисляются при обращении. Для совместимости со старым
+    кодом поддерживаются post['views'] и post.get('views', 0).
+    """
+
+    __slots__ = (
+        "channel", "message_id", "timestamp", "views",
+        "comments_count", "reactions_count", "forwards_count", "text"
+    )
+
+    FIELDS = __slots__ + ("date", "raw_date")
+
+    def __init__(self, channel, message_id, timestamp, views=0,
+                 comments_count=0, reactions_count=0, forwards_count=0, text=None):
+        self.channel = channel
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.views = views
+        self.comments_count = comments_count
+        self.reactions_count = reactions_count
+        self.forwards_count = forwards_count
+        # None, если текст не запрашивали
+        self.text = text
+
+    @property
+    def raw_date(self):
+        return from_timestamp(self.timestamp)
+
+    @property
+    def date(self):
+        return self.raw_date.strftime(DATE_FORMAT)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.FIELDS:
+            return default
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Post({self.channel!r}, {self.message_id}, {self.date!r}, views={self.views})"
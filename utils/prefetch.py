@@ -0,0 +1,258 @@
+# prefetch.py — фоновая догрузка постов отслеживаемых каналов в непиковые часы
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from utils import metrics
+from utils.analytics import PostFrameBuilder
+from utils.entity_resolver import normalize_channel_link
+from utils.message_parser import ChannelDone, iter_monthly_posts, refresh_month_counters
+from utils.post_store import POST_STORE_PATH, month_bounds, months_between, post_store
+from utils.posts import to_timestamp
+from utils.report_cache import report_cache, report_key
+from utils.report_jobs import report_queue
+from utils.text_analytics import TEXT_ANALYTICS_WORKERS, TextCollector
+
+# Каналы, которые отслеживаются всегда (через запятую), в дополнение к запрошенным в отчетах
+WATCH_CHANNELS = [link.strip() for link in os.getenv("WATCH_CHANNELS", "").split(",") if link.strip()]
+
+# Сколько дней канал из отчета остается в списке без новых запросов
+WATCH_RETENTION_DAYS = int(os.getenv("WATCH_RETENTION_DAYS", "60"))
+
+# Непиковые часы (UTC) в формате "начало-конец", конец не включается; можно через полночь: "22-4"
+PREFETCH_HOURS = os.getenv("PREFETCH_HOURS", "1-6")
+
+# Пауза между проходами по списку и сколько каналов догружается одновременно
+PREFETCH_INTERVAL = int(os.getenv("PREFETCH_INTERVAL", "1800"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "1"))
+
+# За сколько последних месяцев (включая текущий) обновлять счетчики сохраненных постов; 0 — не обновлять
+PREFETCH_REFRESH_MONTHS = int(os.getenv("PREFETCH_REFRESH_MONTHS", "2"))
+
+# Как часто проверять, освободились ли воркеры отчетов (секунды)
+PREFETCH_YIELD_DELAY = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watched (
+    channel TEXT PRIMARY KEY,
+    link TEXT NOT NULL,
+    requested_at INTEGER NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hours(spec):
+    """'1-6' -> (1, 6); пустая строка — круглосуточно"""
+    if not spec.strip():
+        return None
+    start, end = (int(part) % 24 for part in spec.split("-", 1))
+    return start, end
+
+
+def in_window(hour, window):
+    if window is None:
+        return True
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def _previous_month(year, month):
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+class WatchList:
+    """
+    Список отслеживаемых каналов (SQLite, та же база, что у хранилища постов)
+
+    Канал попадает в список, когда по нему запрашивают отчет, и выпадает,
+    если запросов не было WATCH_RETENTION_DAYS. Каналы из WATCH_CHANNELS
+    отслеживаются всегда.
+    """
+
+    def __init__(self, path=POST_STORE_PATH, retention_days=WATCH_RETENTION_DAYS, pinned=WATCH_CHANNELS):
+        self.path = path
+        self.retention_days = retention_days
+        self.pinned = list(pinned)
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def watch(self, channel_links):
+        """Отмечает запрос отчета по каналам"""
+        now = int(time.time())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO watched (channel, link, requested_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (channel) DO UPDATE SET link = excluded.link, requested_at = excluded.requested_at",
+                [(normalize_channel_link(link), link, now) for link in channel_links]
+            )
+
+    def channels(self):
+        """Ссылки на отслеживаемые каналы (без повторов)"""
+        cutoff = int(time.time() - self.retention_days * 86400)
+        with self.conn:
+            self.conn.execute("DELETE FROM watched WHERE requested_at < ?", (cutoff,))
+        links = {normalize_channel_link(link): link for link in self.pinned}
+        for channel, link in self.conn.execute("SELECT channel, link FROM watched ORDER BY requested_at DESC"):
+            links.setdefault(channel, link)
+        return list(links.values())
+
+
+class Prefetcher:
+    """
+    Планировщик догрузки постов отслеживаемых каналов
+
+    В непиковые часы раз в PREFETCH_INTERVAL проходит по списку каналов и
+    через iter_monthly_posts (та же логика, что у get_monthly_messages)
+    догружает новые посты текущего месяца — из сети идут только посты новее
+    уже сохраненных. Прошлый месяц дособирается и помечается завершенным,
+    а его статистика кладется в report_cache, поэтому отчеты в начале
+    месяца отдаются из локальных данных.
+
+    Просмотры и реакции растут еще недели после публикации, поэтому у постов
+    последних PREFETCH_REFRESH_MONTHS месяцев счетчики обновляются пачками
+    по 100 id (refresh_month_counters), а их статистика пересчитывается.
+
+    Одновременно догружается не больше PREFETCH_CONCURRENCY каналов, и пока
+    считаются или ждут отчеты пользователей, новые каналы не начинаются.
+    """
+
+    def __init__(self, watchlist, hours=PREFETCH_HOURS, interval=PREFETCH_INTERVAL,
+                 concurrency=PREFETCH_CONCURRENCY, refresh_months=PREFETCH_REFRESH_MONTHS):
+        self.watchlist = watchlist
+        self.window = parse_hours(hours)
+        self.interval = interval
+        self.concurrency = concurrency
+        self.refresh_months = refresh_months
+        self._task = None
+
+    def start(self):
+        if self.concurrency <= 0:
+            logger.info("Фоновая догрузка отключена (PREFETCH_CONCURRENCY=0)")
+            return
+        self._task = asyncio.ensure_future(self._run())
+        logger.info("Фоновая догрузка: часы %s UTC, раз в %s с", PREFETCH_HOURS or "0-24", self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            if in_window(datetime.utcnow().hour, self.window):
+                try:
+                    await self.sweep()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Ошибка фоновой догрузки")
+            await asyncio.sleep(self.interval)
+
+    async def _wait_for_idle(self):
+        """Интерактивные отчеты важнее: ждем, пока воркеры отчетов освободятся"""
+        while report_queue.active or report_queue.depth:
+            await asyncio.sleep(PREFETCH_YIELD_DELAY)
+
+    async def sweep(self):
+        """Один проход по списку отслеживаемых каналов"""
+        channels = self.watchlist.channels()
+        if not channels:
+            return
+
+        now = datetime.utcnow()
+        current = (now.year, now.month)
+        previous = _previous_month(*current)
+        logger.info("Фоновая догрузка: %s каналов", len(channels))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def prefetch(channel_link):
+            async with semaphore:
+                if not in_window(datetime.utcnow().hour, self.window):
+                    return
+                await self._wait_for_idle()
+                try:
+                    await self._warm_month(channel_link, *previous)
+                    await self._drain_month(channel_link, *current)
+                    await self._refresh_counters(channel_link, current)
+                    metrics.prefetch_channels.inc(result="ok")
+                except Exception as e:
+                    metrics.prefetch_channels.inc(result="error")
+                    logger.warning("Фоновая догрузка %s: %s: %s", channel_link, type(e).__name__, e)
+
+        await asyncio.gather(*(prefetch(channel_link) for channel_link in channels))
+
+    async def _drain_month(self, channel_link, year, month, analyze_text=False):
+        """
+        Догружает месяц канала в хранилище и возвращает его статистику
+
+        При включенной текстовой аналитике посты сохраняются с текстом, чтобы
+        отчет не собирал месяц заново; analyze_text — еще и разобрать тексты.
+        """
+        frame = PostFrameBuilder([to_timestamp(month_bounds(year, month)[0])])
+        with_text = TEXT_ANALYTICS_WORKERS > 0
+        texts = TextCollector() if with_text and analyze_text else None
+        async for _, post in iter_monthly_posts([channel_link], year, month, include_text=with_text):
+            if isinstance(post, ChannelDone):
+                if post.error is not None:
+                    raise post.error
+                continue
+            frame.add(post)
+            if texts is not None:
+                texts.add(post)
+        stats, = frame.period_stats()
+        if texts is not None:
+            stats.text = await texts.result()
+        return stats
+
+    async def _refresh_counters(self, channel_link, current):
+        """Обновляет счетчики постов последних месяцев и пересчитывает их статистику"""
+        if self.refresh_months <= 0:
+            return
+        index = current[0] * 12 + current[1] - 1 - (self.refresh_months - 1)
+        months = months_between((index // 12, index % 12 + 1), current)
+
+        for year, month in months:
+            # Текущий месяц уже обновил _drain_month (iter_monthly_posts освежает сохраненные посты)
+            if (year, month) != current:
+                result = (await refresh_month_counters([channel_link], year, month))[channel_link]
+                if isinstance(result, BaseException):
+                    raise result
+            report_cache.discard(report_key(channel_link, year, month))
+
+        # Завершенные месяцы лежат в кэше бессрочно — кладем туда статистику по свежим счетчикам
+        for year, month in months:
+            stored = post_store.get_month(channel_link, year, month)
+            if (year, month) != current and stored and stored[1]:
+                await self._warm_month(channel_link, year, month)
+
+    async def _warm_month(self, channel_link, year, month):
+        """Завершенный месяц: дособирает посты и кладет статистику в report_cache"""
+        key = report_key(channel_link, year, month)
+        stored = post_store.get_month(channel_link, year, month)
+        if stored and stored[1] and report_cache.get(key) is not None:
+            return
+
+        stats = await self._drain_month(channel_link, year, month, analyze_text=True)
+        if TEXT_ANALYTICS_WORKERS > 0 and stats.text is None:
+            # Тексты разобрать не удалось — статистику досчитает ближайший отчет
+            return
+        report_cache.put(key, stats.as_dict(), immutable=True)
+
+
+watchlist = WatchList()
+prefetcher = Prefetcher(watchlist)
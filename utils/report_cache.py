@@ -0,0 +1,192 @@
+# report_cache.py — кэш готовой статистики каналов и объединение одинаковых запросов
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from utils import metrics
+from utils.entity_resolver import normalize_channel_link
+
+# Сколько записей (канал, год, месяц) держать и сколько жить текущему месяцу
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "256"))
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+def report_key(channel, year, month):
+    """Ключ кэша: нормализованный канал, год, месяц"""
+    return normalize_channel_link(channel), year, month
+
+
+class ReportCache:
+    """
+    LRU-кэш статистики по ключу (канал, год, месяц)
+
+    Прошедшие месяцы не меняются и хранятся без срока (вытесняются только
+    по LRU), текущий месяц живет ttl секунд. Если такой же канал за тот же
+    месяц уже считается, новый запрос ждет тот же результат, а не запускает
+    второе сканирование. Расчет, который больше никто не ждет (запросы
+    отменены или вышли по таймауту), останавливается.
+    """
+
+    def __init__(self, max_entries=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Задача расчета по ключу и сколько запросов ее сейчас ждут
+        self._producers = {}
+        self._interest = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stats, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return stats
+
+    def discard(self, key):
+        """Убирает запись (например, после обновления счетчиков постов месяца)"""
+        self._entries.pop(key, None)
+
+    def put(self, key, stats, immutable):
+        expires_at = None if immutable else time.time() + self.ttl
+        self._entries[key] = (stats, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _abandon(self, task):
+        """
+        Останавливает расчет, который больше никто не ждет
+
+        Ключи убираются из _inflight сразу, а не в on_done: иначе запрос,
+        пришедший до завершения отмены, подключился бы к отменяемому
+        расчету и получил бы чужую отмену.
+        """
+        for key in [key for key, producer in self._producers.items() if producer is task]:
+            del self._producers[key]
+            del self._inflight[key]
+        task.cancel()
+
+    async def get_or_compute(self, channels, months, immutable, compute, on_ready=None, timeout=None):
+        """
+        Статистика каналов по месяцам: из кэша, из уже идущих расчетов или через compute
+
+        Args:
+            channels: список ссылок на каналы
+            months: список месяцев (year, month)
+            immutable: immutable(year, month) — True для завершенных месяцев
+            compute: корутина compute(missing, publish), где missing —
+                {channel: [(year, month), ...]} недостающих месяцев; для каждой
+                пары она должна вызвать publish(channel, (year, month), stats, cacheable)
+            on_ready: необязательный on_ready(channel, (year, month), stats) —
+                вызывается, как только готова статистика очередного месяца канала
+            timeout: сколько секунд ждать недостающие месяцы (None — сколько потребуется)
+
+        Returns:
+            {channel: {(year, month): stats}}; stats = None для месяцев, не готовых к timeout
+        """
+        loop = asyncio.get_running_loop()
+        keys = {
+            (channel, year_month): report_key(channel, *year_month)
+            for channel in channels for year_month in months
+        }
+
+        results = {}
+        waiting = {}
+        missing = {}
+        owned = {}
+        for item, key in keys.items():
+            cached = self.get(key)
+            if cached is not None:
+                metrics.report_cache_lookups.inc(result="hit")
+                logger.info("%s %s: статистика из кэша", *item)
+                results[item] = cached
+                if on_ready:
+                    on_ready(*item, cached)
+            elif key in self._inflight:
+                metrics.report_cache_lookups.inc(result="shared")
+                logger.info("%s %s: ждем уже идущий расчет", *item)
+                waiting[item] = self._inflight[key]
+            else:
+                metrics.report_cache_lookups.inc(result="miss")
+                future = loop.create_future()
+                self._inflight[key] = future
+                waiting[item] = owned[key] = future
+                missing.setdefault(item[0], []).append(item[1])
+
+        if missing:
+            def release(key):
+                # Расчет может закончиться позже, чем по тому же ключу начался новый, —
+                # чужой future из _inflight не трогаем
+                future = owned.pop(key, None)
+                if future is not None and self._inflight.get(key) is future:
+                    del self._inflight[key]
+                    del self._producers[key]
+                return future
+
+            def publish(channel, year_month, stats, cacheable):
+                key = keys[(channel, year_month)]
+                future = release(key)
+                if cacheable:
+                    self.put(key, stats, immutable(*year_month))
+                if future is not None and not future.done():
+                    future.set_result(stats)
+
+            def on_done(task):
+                # Если расчет упал или был отменен — не оставляем ждущих навсегда
+                error = None if task.cancelled() else task.exception()
+                for key in list(owned):
+                    future = release(key)
+                    if not future.done():
+                        if error is None:
+                            future.cancel()
+                        else:
+                            future.set_exception(error)
+
+            # Общий расчет живет отдельно от запроса, который его начал
+            task = asyncio.ensure_future(compute(missing, publish))
+            task.add_done_callback(on_done)
+            for key in owned:
+                self._producers[key] = task
+
+        if on_ready:
+            for item, future in waiting.items():
+                future.add_done_callback(
+                    lambda f, item=item: f.cancelled() or f.exception() or on_ready(*item, f.result())
+                )
+
+        # Общий расчет живет отдельно от запроса, но только пока его кто-то ждет
+        tasks = {self._producers[keys[item]] for item in waiting if keys[item] in self._producers}
+        for task in tasks:
+            self._interest[task] = self._interest.get(task, 0) + 1
+        try:
+            if waiting:
+                # wait() не отменяет сами future: по таймауту расчет остановится, только если он больше никому не нужен
+                await asyncio.wait(set(waiting.values()), timeout=timeout)
+        finally:
+            for task in tasks:
+                self._interest[task] -= 1
+                if not self._interest[task]:
+                    del self._interest[task]
+                    if not task.done():
+                        logger.info("Расчет больше никто не ждет — останавливаем")
+                        self._abandon(task)
+
+        for item, future in waiting.items():
+            # Отмененный future — месяц просто не готов: отменяли не этот запрос
+            results[item] = future.result() if future.done() and not future.cancelled() else None
+        return {
+            channel: {year_month: results[(channel, year_month)] for year_month in months}
+            for channel in channels
+        }
+
+
+report_cache = ReportCache()
@@ -0,0 +1,390 @@
+# report_jobs.py — фоновая очередь генерации отчетов с прогрессом в сообщении
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+from telegram.error import BadRequest, RetryAfter
+
+from utils import metrics
+
+# Сколько отчетов считаем одновременно и сколько может ждать в очереди
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "50"))
+
+# Сколько отчетов один пользователь может держать в очереди и в работе и сколько из них считать одновременно
+USER_MAX_JOBS = int(os.getenv("USER_MAX_JOBS", "2"))
+USER_MAX_RUNNING = int(os.getenv("USER_MAX_RUNNING", "1"))
+
+# Веса пользователей в очереди: "user_id:вес,..." (по умолчанию 1); вес 2 — вдвое большая доля воркеров
+REPORT_USER_WEIGHTS = {
+    int(user_id): float(weight)
+    for user_id, weight in (
+        item.split(":", 1) for item in os.getenv("REPORT_USER_WEIGHTS", "").split(",") if item.strip()
+    )
+}
+
+# Не чаще одного редактирования сообщения о прогрессе за столько секунд
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))
+
+# Лимит Bot API на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+# Сколько раз пробовать отправить итог отчета, если Telegram просит подождать (RetryAfter)
+DELIVER_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """
+    Делит длинный текст на части не длиннее limit по границам строк
+
+    Разметка Markdown в отчетах не переходит через строку, поэтому
+    каждая часть остается корректной. Строка длиннее limit режется как есть.
+    """
+    parts = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+class QueueFullError(Exception):
+    """Очередь отчетов переполнена"""
+
+
+class UserLimitError(Exception):
+    """У пользователя уже USER_MAX_JOBS отчетов в очереди и в работе"""
+
+
+class ReportJob:
+    """
+    Задание на отчет
+
+    run — корутина run(job), которая считает отчет, сообщает прогресс
+    через job.set_progress и возвращает итоговый текст (Markdown).
+    Состояние выводится в processing_msg; правки сообщения идут
+    не чаще PROGRESS_EDIT_INTERVAL. cost — оценка стоимости отчета
+    (utils.admission.estimate_cost), по ней очередь делит воркеров.
+    Задачу можно отменить (cancel) и в очереди, и во время работы:
+    run отменяется вместе со сканированием каналов.
+    """
+
+    def __init__(self, user_id, processing_msg, title, channels, run, cost=1):
+        self.user_id = user_id
+        self.processing_msg = processing_msg
+        self.title = title
+        self.channels = list(channels)
+        self.run = run
+        self.cost = cost
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.created_at = time.monotonic()
+        self.position = 0
+        self.progress = {channel: (0, False) for channel in self.channels}
+        self.cancelled = False
+        self.task = None
+        self._dirty = False
+        self._last_text = None
+        self._last_edit = 0.0
+
+    def set_progress(self, channel, posts, done=False):
+        """Обновляет прогресс канала (вызывается часто, сообщение правится с троттлингом)"""
+        self.progress[channel] = (posts, done)
+        self._dirty = True
+
+    def set_position(self, position):
+        if position != self.position:
+            self.position = position
+            self._dirty = True
+
+    def render(self):
+        if self.position > 0:
+            return (
+                f"⏳ {self.title}\n\n"
+                f"Сейчас много запросов. Ваше место в очереди: {self.position}\n"
+                "Отчет начнет собираться автоматически."
+            )
+
+        lines = [f"🔄 {self.title}\n"]
+        for channel in self.channels:
+            posts, done = self.progress.get(channel, (0, False))
+            mark = "✅" if done else "⏳"
+            lines.append(f"{mark} {channel}: {posts} постов")
+        lines.append("\nЭто может занять несколько минут...")
+        return "\n".join(lines)
+
+    async def edit(self, text, parse_mode=None):
+        """Правит сообщение; ошибки Telegram (в т.ч. «не изменено») не роняют задачу"""
+        try:
+            await self.processing_msg.edit_text(text, parse_mode=parse_mode)
+            self._last_text = text
+            self._last_edit = time.monotonic()
+        except RetryAfter as e:
+            self._last_edit = time.monotonic() + e.retry_after
+        except BadRequest as e:
+            logger.warning("Не удалось обновить сообщение: %s", e)
+
+    def cancel(self):
+        """Отменяет задачу; если run уже идет, он получает CancelledError"""
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _send_final(self, send, text, parse_mode):
+        """
+        Отправляет часть итога, не теряя ее: на RetryAfter ждет и повторяет,
+        разметку, которую Telegram не разобрал, заменяет простым текстом
+        """
+        for attempt in range(1, DELIVER_ATTEMPTS + 1):
+            try:
+                await send(text, parse_mode=parse_mode)
+                return
+            except RetryAfter as e:
+                if attempt == DELIVER_ATTEMPTS:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                if parse_mode is None:
+                    raise
+                logger.warning("Telegram не принял разметку отчета (%s), отправляем без нее", e)
+                parse_mode = None
+
+    async def deliver(self, text, parse_mode=None):
+        """
+        Итог задачи: первая часть — в сообщение о прогрессе, остальные — ответами на него
+
+        В отличие от edit ошибки не глотаются: если итог так и не ушел,
+        исключение получает воркер и задача считается неудачной.
+        """
+        first, *rest = split_message(text)
+        await self._send_final(self.processing_msg.edit_text, first, parse_mode)
+        self._last_text = first
+        self._last_edit = time.monotonic()
+        for part in rest:
+            await self._send_final(self.processing_msg.reply_text, part, parse_mode)
+
+    async def flush(self, force=False):
+        """Выводит текущее состояние, если оно поменялось и интервал прошел"""
+        if not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        self._dirty = False
+        text = self.render()
+        if text != self._last_text:
+            await self.edit(text)
+
+    async def progress_loop(self):
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            await self.flush()
+
+
+class ReportQueue:
+    """
+    Ограниченная очередь отчетов и пул воркеров
+
+    Обработчик Telegram только ставит задачу и сразу возвращается,
+    ожидающие видят свое место в очереди.
+
+    Воркеры делятся между пользователями по взвешенной справедливой очереди
+    (start-time fair queuing): задача получает метку finish = start + cost / вес,
+    где start — не раньше текущего виртуального времени и конца предыдущей
+    задачи того же пользователя. Воркер берет задачу с наименьшей меткой,
+    поэтому небольшой отчет не ждет за длинной серией тяжелых отчетов
+    другого пользователя. Одновременно у пользователя считается не больше
+    USER_MAX_RUNNING отчетов, в очереди и в работе — не больше USER_MAX_JOBS.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS, maxsize=REPORT_QUEUE_SIZE,
+                 user_max_jobs=USER_MAX_JOBS, user_max_running=USER_MAX_RUNNING, weights=REPORT_USER_WEIGHTS):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.user_max_jobs = user_max_jobs
+        self.user_max_running = user_max_running
+        self.weights = weights
+        self._pending = []
+        self._active_jobs = set()
+        self._condition = None
+        self._tasks = []
+        self._running = Counter()
+        self._last_finish = {}
+        self._virtual_time = 0.0
+        self.active = 0
+
+    def start(self):
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        logger.info("Запущено воркеров отчетов: %s", self.workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def user_jobs(self, user_id):
+        """Сколько отчетов пользователя ждут и считаются"""
+        return self._running[user_id] + sum(1 for job in self._pending if job.user_id == user_id)
+
+    def check_user(self, user_id):
+        """Поднимает UserLimitError, если пользователь уже занял все свои места"""
+        if self.user_max_jobs and self.user_jobs(user_id) >= self.user_max_jobs:
+            raise UserLimitError()
+
+    async def submit(self, job):
+        """
+        Ставит задачу в очередь
+
+        Returns:
+            место в очереди (0 — задача начнется сразу)
+        """
+        if len(self._pending) >= self.maxsize:
+            raise QueueFullError()
+        self.check_user(job.user_id)
+
+        async with self._condition:
+            weight = self.weights.get(job.user_id, 1.0)
+            job.start_tag = max(self._virtual_time, self._last_finish.get(job.user_id, 0.0))
+            job.finish_tag = job.start_tag + job.cost / weight
+            self._last_finish[job.user_id] = job.finish_tag
+
+            self._pending.append(job)
+            metrics.report_queue_depth.set(len(self._pending))
+            self._reposition()
+            self._condition.notify_all()
+        return job.position
+
+    async def cancel_user(self, user_id):
+        """
+        Отменяет отчеты пользователя: ожидающие убираются из очереди, идущие останавливаются
+
+        Returns:
+            сколько отчетов отменено
+        """
+        pending = [job for job in self._pending if job.user_id == user_id]
+        running = [job for job in self._active_jobs if job.user_id == user_id and not job.cancelled]
+        for job in pending:
+            self._pending.remove(job)
+            job.cancel()
+        for job in running:
+            job.cancel()
+
+        if pending:
+            metrics.report_queue_depth.set(len(self._pending))
+            # Отмененные задачи не должны отодвигать следующие отчеты пользователя
+            finish_tags = [job.finish_tag for job in self._active_jobs if job.user_id == user_id]
+            if finish_tags:
+                self._last_finish[user_id] = max(finish_tags)
+            else:
+                self._last_finish.pop(user_id, None)
+            self._reposition()
+            for job in pending:
+                await job.edit("⛔ Отчет отменен")
+            for waiting in self._pending:
+                asyncio.ensure_future(waiting.flush())
+        if pending or running:
+            logger.info("Пользователь %s отменил отчеты: в очереди %s, в работе %s",
+                        user_id, len(pending), len(running))
+        return len(pending) + len(running)
+
+    def _eligible(self):
+        """Ожидающие задачи пользователей, у которых есть свободное место, по метке finish"""
+        return sorted(
+            (job for job in self._pending if self._running[job.user_id] < self.user_max_running),
+            key=lambda job: (job.finish_tag, job.created_at)
+        )
+
+    def _reposition(self):
+        """Пересчитывает места в очереди по порядку, в котором воркеры возьмут задачи"""
+        ordered = sorted(self._pending, key=lambda job: (job.finish_tag, job.created_at))
+        # Свободные воркеры заберут первые задачи сразу — у них позиция 0
+        idle = self.workers - self.active
+        for position, waiting in enumerate(ordered, 1):
+            waiting.set_position(max(0, position - idle))
+
+    def _take(self):
+        job = self._eligible()[0]
+        self._pending.remove(job)
+        metrics.report_queue_depth.set(len(self._pending))
+        self._virtual_time = max(self._virtual_time, job.start_tag)
+        self._running[job.user_id] += 1
+        self._active_jobs.add(job)
+        self.active += 1
+        metrics.reports_active.set(self.active)
+
+        # Остальным ожидающим сдвигаем место в очереди
+        self._reposition()
+        for waiting in self._pending:
+            asyncio.ensure_future(waiting.flush())
+        return job
+
+    async def _release(self, job):
+        async with self._condition:
+            self._running[job.user_id] -= 1
+            if not self._running[job.user_id]:
+                del self._running[job.user_id]
+            self._active_jobs.discard(job)
+            if not self.user_jobs(job.user_id) and self._last_finish.get(job.user_id, 0.0) <= self._virtual_time:
+                # Прошлые метки пользователя уже ничего не значат
+                self._last_finish.pop(job.user_id, None)
+            self.active -= 1
+            metrics.reports_active.set(self.active)
+            # Освободилось место пользователя — его следующая задача могла стать доступной
+            self._condition.notify_all()
+
+    async def _worker(self, number):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(self._eligible)
+                job = self._take()
+
+            job.set_position(0)
+            await job.flush(force=True)
+            progress_task = asyncio.ensure_future(job.progress_loop())
+            status = "error"
+            try:
+                try:
+                    job.task = asyncio.ensure_future(job.run(job))
+                    if job.cancelled:
+                        # Отменили, пока задача переходила из очереди к воркеру
+                        job.task.cancel()
+                    report_text = await job.task
+                finally:
+                    # Останавливаем прогресс до финальной правки, чтобы он ее не перезаписал
+                    progress_task.cancel()
+                    await asyncio.gather(progress_task, return_exceptions=True)
+                await job.deliver(report_text, parse_mode='Markdown')
+                status = "ok"
+            except asyncio.CancelledError:
+                status = "cancelled"
+                if asyncio.current_task().cancelling():
+                    # Останавливают сам воркер (stop)
+                    raise
+                await job.edit("⛔ Отчет отменен")
+            except Exception as e:
+                logger.exception("Ошибка в задаче пользователя %s", job.user_id)
+                await job.edit(f"❌ Ошибка при генерации отчета: {str(e)[:100]}")
+            finally:
+                await asyncio.shield(self._release(job))
+                metrics.report_seconds.observe(time.monotonic() - job.created_at, status=status)
+
+
+report_queue = ReportQueue()
@@ -0,0 +1,143 @@
+# report_stats.py — накопительная статистика канала для отчета
+import os
+
+from utils.sketches import QuantileSketch, TopPosts
+from utils.text_analytics import TextStats
+
+# Сколько лучших постов канала помнить (по просмотрам и по взаимодействиям)
+REPORT_TOP_POSTS = int(os.getenv("REPORT_TOP_POSTS", "5"))
+
+# Счетчики поста, по которым считаются квантили: имя в статистике -> атрибут Post
+SKETCH_COUNTERS = {
+    'views': 'views',
+    'reactions': 'reactions_count',
+    'comments': 'comments_count',
+    'forwards': 'forwards_count',
+}
+
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+
+class ChannelStats:
+    """
+    Суммы, скетчи квантилей и топ постов канала за период
+
+    Считаются по колонкам постов всех месяцев сразу (utils.analytics).
+    Два накопителя можно сложить (merge) — например, месяцы одного
+    канала: суммы складываются, скетчи и топы сливаются. Разбивка по
+    дням недели и часам публикации (UTC) — тоже суммы.
+    """
+
+    __slots__ = (
+        "total_posts", "total_views", "total_reactions", "total_comments", "total_forwards",
+        "sketches", "top_views", "top_engagement", "by_weekday", "by_hour", "text"
+    )
+
+    def __init__(self):
+        self.total_posts = 0
+        self.total_views = 0
+        self.total_reactions = 0
+        self.total_comments = 0
+        self.total_forwards = 0
+        self.sketches = {name: QuantileSketch() for name in SKETCH_COUNTERS}
+        self.top_views = TopPosts(REPORT_TOP_POSTS)
+        # Вовлеченность поста: реакции + комментарии + пересылки
+        self.top_engagement = TopPosts(REPORT_TOP_POSTS)
+        # По дню недели и часу публикации: [постов, просмотров]
+        self.by_weekday = [[0, 0] for _ in WEEKDAYS]
+        self.by_hour = [[0, 0] for _ in range(24)]
+        # Текстовая аналитика (utils.text_analytics) считается в пуле процессов и задается отдельно
+        self.text = None
+
+    @classmethod
+    def from_dict(cls, stats):
+        """Накопитель из готовой статистики (as_dict), например из кэша"""
+        result = cls()
+        result.total_posts = stats['total_posts']
+        result.total_views = stats['total_views']
+        result.total_reactions = stats['total_reactions']
+        result.total_comments = stats['total_comments']
+        result.total_forwards = stats['total_forwards']
+        # Статистика без скетчей и разбивки по времени дает пустые скетчи, топы и разбивку
+        for name, sketch in stats.get('sketches', {}).items():
+            result.sketches[name] = QuantileSketch.from_dict(sketch)
+        result.top_views = TopPosts.from_list(REPORT_TOP_POSTS, stats.get('top_views', []))
+        result.top_engagement = TopPosts.from_list(REPORT_TOP_POSTS, stats.get('top_engagement', []))
+        if 'by_weekday' in stats:
+            result.by_weekday = [list(cell) for cell in stats['by_weekday']]
+            result.by_hour = [list(cell) for cell in stats['by_hour']]
+        if 'text' in stats:
+            result.text = TextStats.from_dict(stats['text'])
+        return result
+
+    def merge(self, other):
+        self.total_posts += other.total_posts
+        self.total_views += other.total_views
+        self.total_reactions += other.total_reactions
+        self.total_comments += other.total_comments
+        self.total_forwards += other.total_forwards
+        for name, sketch in other.sketches.items():
+            self.sketches[name].merge(sketch)
+        self.top_views.merge(other.top_views)
+        self.top_engagement.merge(other.top_engagement)
+        for cells, other_cells in ((self.by_weekday, other.by_weekday), (self.by_hour, other.by_hour)):
+            for cell, other_cell in zip(cells, other_cells):
+                cell[0] += other_cell[0]
+                cell[1] += other_cell[1]
+        if other.text is not None:
+            self.text = (self.text or TextStats()).merge(other.text)
+        return self
+
+    def quantiles(self):
+        """{'p50_views': ..., 'p90_views': ..., ...}; пусто, если в скетчах нет значений"""
+        result = {}
+        for name, sketch in self.sketches.items():
+            if not sketch.count:
+                continue
+            values = sketch.quantiles([fraction for _, fraction in QUANTILES])
+            for (label, _), value in zip(QUANTILES, values):
+                result[f'{label}_{name}'] = value
+        return result
+
+    def as_dict(self):
+        """Статистика в формате channel_stats для текста отчета"""
+        total_posts = self.total_posts
+        total_views = self.total_views
+        total_reactions = self.total_reactions
+        total_comments = self.total_comments
+        total_forwards = self.total_forwards
+        interactions = total_reactions + total_comments + total_forwards
+
+        stats = {
+            'total_posts': total_posts,
+            'total_views': total_views,
+            'avg_views': round(total_views / total_posts, 2) if total_posts > 0 else 0,
+            'total_reactions': total_reactions,
+            'avg_reactions': round(total_reactions / total_posts, 2) if total_posts > 0 else 0,
+            'total_comments': total_comments,
+            'avg_comments': round(total_comments / total_posts, 2) if total_posts > 0 else 0,
+            'total_forwards': total_forwards,
+            'avg_forwards': round(total_forwards / total_posts, 2) if total_posts > 0 else 0,
+            # Охваты
+            'coverage_per_reaction': round(total_views / total_reactions, 2) if total_reactions > 0 else 0,
+            'coverage_per_forward': round(total_views / total_forwards, 2) if total_forwards > 0 else 0,
+            'coverage_per_comment': round(total_views / total_comments, 2) if total_comments > 0 else 0,
+            # Вовлеченность: взаимодействия на просмотр, в процентах
+            'engagement_rate': round(interactions / total_views * 100, 2) if total_views > 0 else 0
+        }
+        quantiles = self.quantiles()
+        if quantiles:
+            # Квантили устойчивы к одному вирусному посту, в отличие от средних и охватов.
+            # Скетчи и топы лежат в статистике, чтобы месяцы можно было слить (from_dict + merge)
+            stats.update(quantiles)
+            stats['top_views'] = self.top_views.to_list()
+            stats['top_engagement'] = self.top_engagement.to_list()
+            stats['sketches'] = {name: sketch.to_dict() for name, sketch in self.sketches.items()}
+        if any(posts for posts, _ in self.by_weekday):
+            stats['by_weekday'] = self.by_weekday
+            stats['by_hour'] = self.by_hour
+        if self.text is not None:
+            stats['text'] = self.text.to_dict()
+        return stats
@@ -0,0 +1,67 @@
+# scheduler.py — ограниченный параллельный запуск задач с учетом FloodWait
+import asyncio
+import logging
+import os
+import random
+
+from telethon.errors import FloodWaitError
+
+# Сколько каналов сканируем одновременно через общий Telethon клиент
+MAX_CONCURRENT_CHANNELS = int(os.getenv("MAX_CONCURRENT_CHANNELS", "4"))
+
+# Сколько раз повторяем задачу после FloodWait, прежде чем сдаться
+MAX_FLOOD_RETRIES = int(os.getenv("MAX_FLOOD_RETRIES", "3"))
+
+# Базовая и максимальная добавка к времени ожидания (секунды)
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+def _backoff_delay(flood_seconds, attempt):
+    """Время паузы: требование Telegram + экспоненциальная добавка с джиттером"""
+    extra = min(BASE_BACKOFF * (2 ** (attempt - 1)), MAX_BACKOFF)
+    return flood_seconds + extra + random.uniform(0, BASE_BACKOFF)
+
+
+async def run_bounded(factories, limit=None, labels=None, flood_delay=None):
+    """
+    Запускает задачи параллельно, не больше limit одновременно
+
+    Args:
+        factories: список функций без аргументов, возвращающих корутину
+        limit: максимум одновременно выполняемых задач
+        labels: подписи задач для логов (например, ссылки на каналы)
+        flood_delay: flood_delay(error, attempt) -> секунды паузы перед повтором;
+            по умолчанию — время FloodWait плюс экспоненциальная добавка
+
+    Returns:
+        список результатов в том же порядке, что и factories.
+        Если задача упала, на ее месте будет исключение.
+    """
+    limit = limit or MAX_CONCURRENT_CHANNELS
+    flood_delay = flood_delay or (lambda error, attempt: _backoff_delay(error.seconds, attempt))
+    labels = labels or [str(i) for i in range(len(factories))]
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(factory, label):
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    return await factory()
+            except FloodWaitError as e:
+                attempt += 1
+                if attempt > MAX_FLOOD_RETRIES:
+                    raise
+                # Ждем вне семафора: остальные каналы продолжают работать
+                delay = flood_delay(e, attempt)
+                logger.warning("%s: FloodWait %s с, повтор %s/%s через %.1f с",
+                               label, e.seconds, attempt, MAX_FLOOD_RETRIES, delay)
+                await asyncio.sleep(delay)
+
+    return await asyncio.gather(
+        *(run(factory, label) for factory, label in zip(factories, labels)),
+        return_exceptions=True
+    )
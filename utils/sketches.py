@@ -0,0 +1,164 @@
+# sketches.py — потоковые квантили (KLL) и топ постов без хранения всех постов
+import heapq
+import math
+import random
+
+# Точность скетча: ошибка ранга ~1/k, в памяти — не больше ~3k значений
+SKETCH_K = 128
+
+# Во сколько раз сжимается емкость каждого следующего (нижнего) уровня
+SKETCH_DECAY = 2 / 3
+
+
+class QuantileSketch:
+    """
+    Скетч квантилей в духе KLL
+
+    Значения копятся на нулевом уровне; переполненный уровень сортируется,
+    и каждое второе значение (со случайным сдвигом) переходит уровнем выше
+    с удвоенным весом. Память не зависит от числа значений, а два скетча
+    можно слить (merge) — например, месяцы одного канала. Для небольших
+    потоков (до k значений) квантили точные.
+    """
+
+    __slots__ = ("k", "count", "levels", "_size", "_max_size")
+
+    def __init__(self, k=SKETCH_K):
+        self.k = k
+        self.count = 0
+        self.levels = [[]]
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * SKETCH_DECAY ** depth))
+
+    def _grow(self):
+        self.levels.append([])
+        self._max_size = sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self):
+        """Уплотняет самый нижний переполненный уровень"""
+        for level, items in enumerate(self.levels):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self._grow()
+            items.sort()
+            # Нечетное значение остается на уровне, чтобы суммарный вес не менялся
+            keep = [items.pop()] if len(items) % 2 else []
+            self.levels[level + 1].extend(items[random.getrandbits(1)::2])
+            self.levels[level] = keep
+            self._size = sum(len(items) for items in self.levels)
+            return
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self._size = sum(len(items) for items in self.levels)
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def quantiles(self, fractions):
+        """Значения для долей fractions (0.5 — медиана); для пустого скетча — нули"""
+        weighted = sorted(
+            (value, 1 << level) for level, items in enumerate(self.levels) for value in items
+        )
+        if not weighted:
+            return [0] * len(fractions)
+
+        total = sum(weight for _, weight in weighted)
+        result = []
+        for fraction in fractions:
+            target = fraction * total
+            seen = 0
+            for value, weight in weighted:
+                seen += weight
+                if seen >= target:
+                    break
+            result.append(value)
+        return result
+
+    @classmethod
+    def from_sorted(cls, values, k=SKETCH_K):
+        """
+        Скетч по уже отсортированным значениям — без поштучного add
+
+        Берется каждое 2^h-е значение (со случайным сдвигом) на уровень h,
+        где их помещается не больше k: это то же, что h уплотнений подряд,
+        и ошибка ранга не больше, чем у потокового скетча.
+        """
+        sketch = cls(k)
+        sketch.count = len(values)
+        height = 0
+        while len(values) > k << height:
+            height += 1
+        step = 1 << height
+        sketch.levels = [[] for _ in range(height)] + [values[random.randrange(step)::step] if height else list(values)]
+        sketch._size = len(sketch.levels[-1])
+        sketch._max_size = sum(sketch._capacity(level) for level in range(len(sketch.levels)))
+        return sketch
+
+    def to_dict(self):
+        return {'k': self.k, 'count': self.count, 'levels': self.levels}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        sketch.count = data['count']
+        sketch.levels = [list(items) for items in data['levels']]
+        sketch._size = sum(len(items) for items in sketch.levels)
+        sketch._max_size = sum(sketch._capacity(level) for level in range(len(sketch.levels)))
+        return sketch
+
+
+class TopPosts:
+    """
+    n лучших постов по оценке (просмотры, взаимодействия) — куча ограниченного размера
+
+    Хранятся только (score, message_id, timestamp); кучи разных месяцев сливаются.
+    """
+
+    __slots__ = ("size", "_heap")
+
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+
+    def add(self, score, message_id, timestamp):
+        item = (score, message_id, timestamp)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def merge(self, other):
+        for item in other._heap:
+            self.add(*item)
+        return self
+
+    def items(self):
+        """[(score, message_id, timestamp)], лучшие сначала"""
+        return sorted(self._heap, reverse=True)
+
+    def to_list(self):
+        return [list(item) for item in self.items()]
+
+    @classmethod
+    def from_list(cls, size, items):
+        top = cls(size)
+        for item in items:
+            top.add(*item)
+        return top
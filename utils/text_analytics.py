@@ -0,0 +1,235 @@
+# text_analytics.py — частоты хэштегов, ссылок и слов, длина поста против вовлеченности
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
+
+from utils import metrics
+
+# Сколько процессов разбирают тексты; 0 — текстовая аналитика выключена (тексты не собираются)
+TEXT_ANALYTICS_WORKERS = int(os.getenv("TEXT_ANALYTICS_WORKERS", "2"))
+
+# Сколько постов отправлять в процесс за раз
+TEXT_CHUNK_SIZE = 500
+
+# Сколько самых частых хэштегов, доменов и слов хранить в статистике
+TEXT_TOP_TERMS = 100
+
+# Границы длины текста (символов): без текста, до 200, до 500, до 1000, длиннее
+LENGTH_BUCKETS = (1, 200, 500, 1000)
+LENGTH_LABELS = ("без текста", "до 200", "200–500", "500–1000", "1000+")
+
+HASHTAG_RE = re.compile(r"#(\w+)")
+LINK_RE = re.compile(r"(?:https?://|www\.|\bt\.me/)[^\s<>()\"']+", re.IGNORECASE)
+WORD_RE = re.compile(r"[^\W\d_]{4,}")
+
+# Служебные слова, которые не несут темы поста (слова короче 4 букв не считаются вовсе)
+STOP_WORDS = frozenset("""
+это этот эта эти этого этой этом этих того тому тот там тогда тоже чтобы когда который которая
+которые которых будет будут было были быть есть если даже очень более менее также только можно
+нужно надо просто сейчас потому после через перед между свой своя свои своих себя себе него нему
+неё нее всех всего весь вся всё все какой какая какие такой такая такие ещё еще уже может могут
+вот где куда здесь сегодня вчера завтра пока больше меньше нашей наши наша наш ваши ваша ваш
+this that with from have your what will they their about there here when which would could
+should been were than then them these those into just like more some only also over such
+""".split())
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _length_bucket(length):
+    for index, bound in enumerate(LENGTH_BUCKETS):
+        if length < bound:
+            return index
+    return len(LENGTH_BUCKETS)
+
+
+def _domain(link):
+    if "://" not in link:
+        link = "http://" + link
+    host = urlsplit(link.rstrip(".,;:!?»")).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def length_engagement(lengths):
+    """[(подпись, постов, средние просмотры, вовлеченность в %)] для непустых корзин длины"""
+    result = []
+    for label, (posts, views, interactions) in zip(LENGTH_LABELS, lengths):
+        if posts:
+            engagement = round(interactions / views * 100, 2) if views > 0 else 0
+            result.append((label, posts, round(views / posts, 2), engagement))
+    return result
+
+
+class TextStats:
+    """
+    Текстовая статистика канала: частоты и длина поста против вовлеченности
+
+    Считается в процессах пула пачками постов (analyze_chunk); пачки,
+    месяцы и каналы складываются через merge. В to_dict остаются только
+    TEXT_TOP_TERMS самых частых значений, поэтому частоты после слияния
+    сохраненных месяцев приблизительные для редких значений.
+    """
+
+    __slots__ = ("hashtags", "domains", "keywords", "lengths")
+
+    def __init__(self):
+        self.hashtags = Counter()
+        self.domains = Counter()
+        self.keywords = Counter()
+        # По корзине длины: [постов, просмотров, взаимодействий]
+        self.lengths = [[0, 0, 0] for _ in LENGTH_LABELS]
+
+    def add(self, text, views, interactions):
+        links = LINK_RE.findall(text)
+        self.domains.update(domain for domain in map(_domain, links) if domain)
+        # Хэштеги и слова ищем в тексте без ссылок: иначе #якорь и части адресов попадут в частоты
+        plain = LINK_RE.sub(" ", text)
+        hashtags = HASHTAG_RE.findall(plain)
+        self.hashtags.update(tag.lower() for tag in hashtags)
+        plain = HASHTAG_RE.sub(" ", plain).lower().replace("ё", "е")
+        self.keywords.update(word for word in WORD_RE.findall(plain) if word not in STOP_WORDS)
+
+        bucket = self.lengths[_length_bucket(len(text.strip()))]
+        bucket[0] += 1
+        bucket[1] += views
+        bucket[2] += interactions
+
+    def merge(self, other):
+        self.hashtags.update(other.hashtags)
+        self.domains.update(other.domains)
+        self.keywords.update(other.keywords)
+        for bucket, other_bucket in zip(self.lengths, other.lengths):
+            for i, value in enumerate(other_bucket):
+                bucket[i] += value
+        return self
+
+    def to_dict(self):
+        return {
+            'hashtags': self.hashtags.most_common(TEXT_TOP_TERMS),
+            'domains': self.domains.most_common(TEXT_TOP_TERMS),
+            'keywords': self.keywords.most_common(TEXT_TOP_TERMS),
+            'lengths': self.lengths,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.hashtags.update(dict(data['hashtags']))
+        stats.domains.update(dict(data['domains']))
+        stats.keywords.update(dict(data['keywords']))
+        stats.lengths = [list(bucket) for bucket in data['lengths']]
+        return stats
+
+
+def analyze_chunk(rows):
+    """Выполняется в процессе пула: rows — [(text, views, interactions)]"""
+    stats = TextStats()
+    for text, views, interactions in rows:
+        stats.add(text, views, interactions)
+    return stats
+
+
+def get_executor():
+    """
+    Пул процессов текстовой аналитики (создается при первом обращении)
+
+    Процессы запускаются через spawn: fork процесса с работающим
+    событийным циклом и потоками Telethon/SQLite небезопасен.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=TEXT_ANALYTICS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def _reset_executor(executor):
+    """
+    Забывает пул, в котором упал процесс (например, его убил OOM)
+
+    Сломанный пул отвечает BrokenProcessPool на любую пачку, поэтому
+    следующий get_executor создаст новый. Пул, который уже заменили,
+    не трогаем.
+    """
+    global _executor
+    if _executor is executor:
+        logger.warning("Пул текстовой аналитики сломан — создадим новый")
+        _executor = None
+        executor.shutdown(wait=False)
+
+
+def shutdown_executor():
+    """Останавливает пул процессов при остановке бота; неначатые пачки отменяются"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+class TextCollector:
+    """
+    Копит тексты постов и отправляет их в пул процессов пачками по TEXT_CHUNK_SIZE
+
+    Разбор текстов идет в процессах, событийный цикл только складывает
+    строки в пачку. result() ждет все пачки и сливает их в TextStats.
+    Если процесс пула упал, отчет соберется без текстов, а пул пересоздастся
+    для следующих.
+    """
+
+    def __init__(self):
+        self._chunk = []
+        self._futures = []
+        self._executors = set()
+
+    def add(self, post):
+        interactions = post.reactions_count + post.comments_count + post.forwards_count
+        self._chunk.append((post.text or "", post.views, interactions))
+        if len(self._chunk) >= TEXT_CHUNK_SIZE:
+            self._submit()
+
+    def _submit(self):
+        loop = asyncio.get_running_loop()
+        executor = get_executor()
+        try:
+            future = loop.run_in_executor(executor, analyze_chunk, self._chunk)
+        except BrokenProcessPool:
+            # Пул сломался после прошлых пачек — одна попытка в новом
+            _reset_executor(executor)
+            executor = get_executor()
+            future = loop.run_in_executor(executor, analyze_chunk, self._chunk)
+        self._executors.add(executor)
+        self._futures.append(future)
+        metrics.text_chunks.inc()
+        self._chunk = []
+
+    async def result(self):
+        """Итоговая статистика или None, если пул процессов не справился (отчет соберется без нее)"""
+        if self._chunk:
+            self._submit()
+        started = time.perf_counter()
+        try:
+            parts = await asyncio.gather(*self._futures)
+        except Exception as e:
+            logger.warning("Текстовая аналитика не удалась: %s: %s", type(e).__name__, e)
+            if isinstance(e, BrokenProcessPool):
+                for executor in self._executors:
+                    _reset_executor(executor)
+            return None
+        finally:
+            self._futures = []
+        metrics.text_wait_seconds.observe(time.perf_counter() - started)
+
+        stats = TextStats()
+        for part in parts:
+            stats.merge(part)
+        return stats